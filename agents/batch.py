@@ -0,0 +1,364 @@
+import json
+import shutil
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Literal, Optional, Sequence, Tuple, Type, Union
+
+from phi.agent import Agent
+from pydantic import BaseModel
+
+from agents.cache import ResponseStore
+from agents.checkpoint import JobManifest, WordState, WordStatus, match_records
+from agents.chunking import IncompleteResponseError, TokenPacker
+from agents.sinks import RowSink
+from agents.streaming import openai_model, render_messages, response_format
+from utils.log import logger
+from utils.metrics import metrics
+
+# Working directory for batch input/output files
+DEFAULT_BATCH_DIR = Path(__file__).parent.parent / "data" / "batch"
+
+CHAT_COMPLETIONS_URL: Literal["/v1/chat/completions"] = "/v1/chat/completions"
+TERMINAL_STATUSES = ("completed", "failed", "expired", "cancelled")
+
+
+def build_request_body(agent: Agent, prompt: str) -> Dict[str, Any]:
+    """Render the chat completion request `agent` would send for `prompt`."""
+    messages = render_messages(agent, prompt)
+    model = openai_model(agent)
+    body: Dict[str, Any] = {k: v for k, v in model.request_kwargs.items() if k != "response_format"}
+    body.update(model=model.id, messages=messages)
+    if agent.response_model is not None:
+        body["response_format"] = response_format(agent.response_model)
+    return body
+
+
+def write_batch_file(path: Union[str, Path], requests: Iterable[tuple]) -> int:
+    """Write `(custom_id, body)` pairs as an OpenAI Batch API input file.
+
+    Returns:
+        int: Number of requests written.
+    """
+    count = 0
+    with open(path, "w", encoding="utf-8") as f:
+        for custom_id, body in requests:
+            line = {"custom_id": custom_id, "method": "POST", "url": CHAT_COMPLETIONS_URL, "body": body}
+            f.write(json.dumps(line, ensure_ascii=False) + "\n")
+            count += 1
+    return count
+
+
+def parse_batch_output(
+    path: Union[str, Path], response_model: Type[BaseModel], array_key: str
+) -> Dict[str, Union[List[BaseModel], Exception]]:
+    """Parse a Batch API output file into records per `custom_id`.
+
+    Requests that errored, were truncated or did not validate map to an exception instead.
+    """
+    results: Dict[str, Union[List[BaseModel], Exception]] = {}
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            custom_id = entry["custom_id"]
+            response = entry.get("response") or {}
+            if entry.get("error") or response.get("status_code") != 200:
+                results[custom_id] = RuntimeError(str(entry.get("error") or response))
+                continue
+            choice = response["body"]["choices"][0]
+            if choice.get("finish_reason") == "length":
+                results[custom_id] = IncompleteResponseError("Response truncated at max_tokens")
+                continue
+            try:
+                parsed = response_model.model_validate_json(choice["message"]["content"])
+                results[custom_id] = list(getattr(parsed, array_key))
+            except Exception as e:
+                results[custom_id] = e
+    return results
+
+
+class BatchBackend:
+    """Minimal interface of the OpenAI Batch API used by `OfflineBatchRunner`."""
+
+    def submit(self, input_path: Path) -> str:
+        raise NotImplementedError
+
+    def status(self, batch_id: str) -> str:
+        raise NotImplementedError
+
+    def download(self, batch_id: str, output_path: Path) -> None:
+        raise NotImplementedError
+
+
+class OpenAIBatchBackend(BatchBackend):
+    """Submits batch files to the OpenAI Batch API."""
+
+    def __init__(self, client: Optional[Any] = None, completion_window: Literal["24h"] = "24h"):
+        if client is None:
+            from openai import OpenAI
+
+            client = OpenAI()
+        self.client = client
+        self.completion_window = completion_window
+
+    def submit(self, input_path: Path) -> str:
+        with open(input_path, "rb") as f:
+            input_file = self.client.files.create(file=f, purpose="batch")
+        batch = self.client.batches.create(
+            input_file_id=input_file.id,
+            endpoint=CHAT_COMPLETIONS_URL,
+            completion_window=self.completion_window,
+        )
+        return batch.id
+
+    def status(self, batch_id: str) -> str:
+        return self.client.batches.retrieve(batch_id).status
+
+    def download(self, batch_id: str, output_path: Path) -> None:
+        batch = self.client.batches.retrieve(batch_id)
+        with open(output_path, "w", encoding="utf-8") as f:
+            for file_id in (batch.output_file_id, batch.error_file_id):
+                if file_id:
+                    f.write(self.client.files.content(file_id).text)
+
+
+class LocalBatchBackend(BatchBackend):
+    """File-based stand-in for the Batch API, for running the offline pipeline without network.
+
+    Each submitted batch gets a directory under `root` holding its input, output and
+    status. Requests are answered on a background thread by `handler`, which receives the
+    request body and returns the assistant message content.
+    """
+
+    def __init__(self, root: Union[str, Path], handler: Callable[[Dict[str, Any]], str]):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.handler = handler
+
+    def _dir(self, batch_id: str) -> Path:
+        return self.root / batch_id
+
+    def _set_status(self, batch_id: str, status: str) -> None:
+        tmp = self._dir(batch_id) / "status.tmp"
+        tmp.write_text(status)
+        tmp.replace(self._dir(batch_id) / "status")
+
+    def submit(self, input_path: Path) -> str:
+        batch_id = f"batch_{uuid.uuid4().hex}"
+        self._dir(batch_id).mkdir()
+        shutil.copy(input_path, self._dir(batch_id) / "input.jsonl")
+        self._set_status(batch_id, "in_progress")
+        threading.Thread(target=self._process, args=(batch_id,), daemon=True).start()
+        return batch_id
+
+    def _process(self, batch_id: str) -> None:
+        src = open(self._dir(batch_id) / "input.jsonl", "r", encoding="utf-8")
+        with src, open(self._dir(batch_id) / "output.jsonl", "w", encoding="utf-8") as dst:
+            for line in src:
+                if not line.strip():
+                    continue
+                request = json.loads(line)
+                try:
+                    content = self.handler(request["body"])
+                    response = {
+                        "status_code": 200,
+                        "body": {
+                            "object": "chat.completion",
+                            "model": request["body"].get("model"),
+                            "choices": [
+                                {
+                                    "index": 0,
+                                    "finish_reason": "stop",
+                                    "message": {"role": "assistant", "content": content},
+                                }
+                            ],
+                        },
+                    }
+                    error = None
+                except Exception as e:
+                    response, error = None, {"code": type(e).__name__, "message": str(e)}
+                entry = {"custom_id": request["custom_id"], "response": response, "error": error}
+                dst.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        self._set_status(batch_id, "completed")
+
+    def status(self, batch_id: str) -> str:
+        return (self._dir(batch_id) / "status").read_text()
+
+    def download(self, batch_id: str, output_path: Path) -> None:
+        shutil.copy(self._dir(batch_id) / "output.jsonl", output_path)
+
+
+class OfflineBatchRunner:
+    """Generates all unfinished rows of a `JobManifest` through a Batch API backend.
+
+    Every chunk prompt is rendered into one JSONL batch file, submitted once and polled
+    until it finishes. Results are bulk-parsed into `response_model`, enriched by
+    `postprocess` and written to the sink and to `on_done`, like `JobRunner`; rows whose
+    request failed stay `failed` in the manifest for a later run.
+
+    With a `response_cache`, rows whose records are already cached under `cache_scope` (the
+    scope the generator's own `run_cached` uses) are finished before submitting, and only
+    the rest go into the batch. Parsed records are added to the cache.
+
+    The batch id is saved in the manifest as soon as the batch is submitted. A run that
+    finds a saved batch (because the previous one died while waiting) polls and downloads
+    that batch instead of submitting and paying for the same requests again.
+    """
+
+    def __init__(
+        self,
+        manifest: JobManifest,
+        agent: Agent,
+        build_prompt: Callable[[List[dict], int], str],
+        array_key: str,
+        record_key_field: str,
+        key_fields: Sequence[str],
+        backend: BatchBackend,
+        workdir: Union[str, Path, None] = None,
+        chunk_size: int = 10,
+        packer: Optional[TokenPacker] = None,
+        poll_interval: float = 30.0,
+        timeout: float = 24 * 60 * 60,
+        postprocess: Optional[Callable[[List[BaseModel]], None]] = None,
+        on_done: Optional[Callable[[List[Tuple[WordState, BaseModel]]], None]] = None,
+        response_cache: Optional[ResponseStore] = None,
+        cache_scope: str = "",
+        record_type: Optional[Type[BaseModel]] = None,
+    ):
+        if response_cache is not None and record_type is None:
+            raise ValueError("A record_type is needed to read records from the response cache")
+        self.manifest = manifest
+        self.agent = agent
+        self.build_prompt = build_prompt
+        self.array_key = array_key
+        self.record_key_field = record_key_field
+        self.key_fields = list(key_fields)
+        self.backend = backend
+        self.workdir = Path(workdir) if workdir is not None else DEFAULT_BATCH_DIR
+        self.chunk_size = chunk_size
+        self.packer = packer
+        self.poll_interval = poll_interval
+        self.timeout = timeout
+        self.postprocess = postprocess
+        self.on_done = on_done
+        self.response_cache = response_cache
+        self.cache_scope = cache_scope
+        self.record_type = record_type
+
+    def wait(self, batch_id: str) -> str:
+        deadline = time.monotonic() + self.timeout
+        while True:
+            status = self.backend.status(batch_id)
+            if status in TERMINAL_STATUSES:
+                return status
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"Batch {batch_id} still {status} after {self.timeout}s")
+            logger.info(f"Batch {batch_id} is {status}")
+            time.sleep(self.poll_interval)
+
+    def run(self, sink: Optional[RowSink], retry_failed: bool = True) -> Dict[str, int]:
+        response_model = self.agent.response_model
+        if response_model is None:
+            raise ValueError(f"Agent {self.agent.name} has no response_model to parse batch results into")
+        remaining = self.manifest.remaining(retry_failed=retry_failed)
+        submitted = self.manifest.submitted_batch()
+        if submitted is None and not remaining:
+            return self.manifest.counts()
+
+        self.manifest.rewind(sink)
+        if submitted is not None:
+            batch_id, chunk_keys = submitted
+            by_key = {state.key: state for state in remaining}
+            # Rows finished before the previous run died are skipped when the results are matched
+            chunks = [[by_key[key] for key in keys if key in by_key] for keys in chunk_keys]
+            logger.info(f"Resuming batch {batch_id} submitted by an earlier run")
+        else:
+            remaining = self._finish_cached(remaining, sink)
+            if not remaining:
+                self.manifest.release(sink)
+                return self.manifest.counts()
+            batch_id, chunks = self._submit(remaining)
+
+        self.manifest.mark([state for chunk in chunks for state in chunk], WordStatus.in_flight)
+        status = self.wait(batch_id)
+        if status != "completed":
+            self.manifest.clear_batch(batch_id)
+            raise RuntimeError(f"Batch {batch_id} ended with status {status}")
+        self.workdir.mkdir(parents=True, exist_ok=True)
+        output_path = self.workdir / f"{batch_id}.results.jsonl"
+        self.backend.download(batch_id, output_path)
+
+        results = parse_batch_output(output_path, response_model, self.array_key)
+        for i, chunk in enumerate(chunks):
+            for state in chunk:
+                state.attempts += 1
+            result = results.get(f"chunk-{i}", RuntimeError("No result in batch output"))
+            failed: List[WordState] = []
+            if isinstance(result, Exception):
+                for state in chunk:
+                    state.last_error = f"{type(result).__name__}: {result}"
+                failed = chunk
+            else:
+                matched, failed = match_records(chunk, result, self.key_fields[0], self.record_key_field)
+                cache = self.response_cache
+                if cache is not None:
+                    cache.put_many({self._cache_key(cache, state): record for state, record in matched})
+                self._finish(matched, sink)
+            self.manifest.mark(failed, WordStatus.failed)
+        self.manifest.clear_batch(batch_id)
+        self.manifest.release(sink)
+        return self.manifest.counts()
+
+    def _cache_key(self, cache: ResponseStore, state: WordState) -> str:
+        return cache.make_key(self.cache_scope, *(state.item[f] for f in self.key_fields))
+
+    def _finish_cached(self, remaining: List[WordState], sink: Optional[RowSink]) -> List[WordState]:
+        """Finish the rows whose records are already in `response_cache`; returns the others."""
+        cache = self.response_cache
+        if cache is None or self.record_type is None:
+            return remaining
+        keys = [self._cache_key(cache, state) for state in remaining]
+        cached = cache.get_many(keys, self.record_type)
+        hits = [(state, cached[key]) for state, key in zip(remaining, keys) if key in cached]
+        metrics.record_cache("responses", hits=len(hits), misses=len(remaining) - len(hits))
+        if hits:
+            logger.info(f"{len(hits)} rows served from the response cache")
+            self._finish(hits, sink)
+        return [state for state, key in zip(remaining, keys) if key not in cached]
+
+    def _finish(self, matched: List[Tuple[WordState, BaseModel]], sink: Optional[RowSink]) -> None:
+        if not matched:
+            return
+        records = [record for _, record in matched]
+        if self.postprocess is not None:
+            with metrics.time("postprocess"):
+                self.postprocess(records)
+        if sink is not None:
+            sink.write(records, items=[state.item for state, _ in matched])
+        if self.on_done is not None:
+            self.on_done(matched)
+        self.manifest.mark([state for state, _ in matched], WordStatus.done, sink=sink)
+
+    def _submit(self, remaining: List[WordState]) -> Tuple[str, List[List[WordState]]]:
+        if self.packer is not None:
+            chunks = list(self.packer.iter_batches(remaining, lambda state: state.item))
+        else:
+            chunks = [remaining[i : i + self.chunk_size] for i in range(0, len(remaining), self.chunk_size)]
+
+        self.workdir.mkdir(parents=True, exist_ok=True)
+        input_path = self.workdir / f"{uuid.uuid4().hex[:12]}.requests.jsonl"
+        offset = 0
+        requests = []
+        for i, chunk in enumerate(chunks):
+            prompt = self.build_prompt([state.item for state in chunk], offset)
+            requests.append((f"chunk-{i}", build_request_body(self.agent, prompt)))
+            offset += len(chunk)
+        count = write_batch_file(input_path, requests)
+        logger.info(f"Wrote {count} requests for {len(remaining)} rows to {input_path}")
+
+        batch_id = self.backend.submit(input_path)
+        self.manifest.save_batch(batch_id, chunks)
+        return batch_id, chunks
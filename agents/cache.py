@@ -0,0 +1,425 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+import unicodedata
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Mapping,
+    Optional,
+    Protocol,
+    Sequence,
+    Tuple,
+    Type,
+    TypeVar,
+    Union,
+)
+
+from phi.agent import Agent
+from pydantic import BaseModel
+
+from agents.settings import agent_settings
+from agents.singleflight import SingleFlight
+from utils.log import logger
+from utils.metrics import metrics
+
+RecordT = TypeVar("RecordT", bound=BaseModel)
+
+# Default location of the on-disk response cache
+DEFAULT_CACHE_PATH = Path(__file__).parent.parent / "data" / "cache" / "responses.sqlite"
+
+
+def normalize_text(text: str) -> str:
+    """Normalize a word or meaning so that trivially different spellings share a cache entry."""
+    return " ".join(unicodedata.normalize("NFKC", str(text)).casefold().split())
+
+
+def agent_scope(agent: Agent, prompt: str = "") -> str:
+    """Fingerprint everything about an agent that changes its output for a given word.
+
+    Covers the model id, temperature, description, rendered instructions and the fixed
+    part of the user prompt.
+    """
+    payload = {
+        "model": agent.model.id if agent.model is not None else None,
+        "temperature": getattr(agent.model, "temperature", None),
+        "description": agent.description,
+        "instructions": agent.instructions,
+        "prompt": prompt,
+        "response_model": agent.response_model.__name__ if agent.response_model is not None else None,
+    }
+    return hashlib.sha256(json.dumps(payload, ensure_ascii=False, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+class ResponseStore(Protocol):
+    """What `run_cached` needs from a cache of generator records."""
+
+    def make_key(self, scope: str, *parts: str) -> str: ...
+
+    def get_many(self, keys: Sequence[str], record_type: Type[RecordT]) -> Dict[str, RecordT]: ...
+
+    def put_many(self, entries: Mapping[str, BaseModel]) -> None: ...
+
+
+class BaseResponseCache:
+    """Keys, expiry and eviction settings, and hit counters shared by the response caches.
+
+    Entries are keyed by `(scope, normalized item)` where scope comes from `agent_scope`.
+    Entries older than `ttl_seconds` are treated as misses, and once the cache holds more
+    than `max_entries` entries the least recently used ones are evicted.
+    """
+
+    def __init__(self, ttl_seconds: Optional[int] = None, max_entries: Optional[int] = None):
+        self.ttl_seconds = (
+            ttl_seconds if ttl_seconds is not None else agent_settings.response_cache_ttl_seconds
+        )
+        self.max_entries = (
+            max_entries if max_entries is not None else agent_settings.response_cache_max_entries
+        )
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(scope: str, *parts: str) -> str:
+        raw = "\x1f".join([scope, *(normalize_text(p) for p in parts)])
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get_many(self, keys: Sequence[str], record_type: Type[RecordT]) -> Dict[str, RecordT]:
+        raise NotImplementedError
+
+    def put_many(self, entries: Mapping[str, BaseModel]) -> None:
+        raise NotImplementedError
+
+    def _count(self, keys: Sequence[str], found: Mapping[str, BaseModel]) -> None:
+        with self._lock:
+            self.hits += len(found)
+            self.misses += len(set(keys)) - len(found)
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+    def close(self) -> None:
+        pass
+
+
+class ResponseCache(BaseResponseCache):
+    """Persistent SQLite cache of validated generator records.
+
+    The number of entries is tracked as they are written, so puts only trim the least
+    recently used entries once the cache is over `max_entries`. Expired entries are
+    already misses and are deleted (and the count re-read) at most once per
+    `evict_interval` seconds.
+    """
+
+    def __init__(
+        self,
+        path: Union[str, Path, None] = None,
+        ttl_seconds: Optional[int] = None,
+        max_entries: Optional[int] = None,
+        evict_interval: float = 60.0,
+    ):
+        super().__init__(ttl_seconds, max_entries)
+        self.evict_interval = evict_interval
+        self._evicted_at = 0.0
+        self.path = Path(path) if path is not None else DEFAULT_CACHE_PATH
+        if str(self.path) != ":memory:":
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                record_type TEXT NOT NULL,
+                value TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_used_at REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS responses_last_used_at ON responses (last_used_at)")
+        self._conn.commit()
+        (self._entries,) = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()
+
+    def get_many(self, keys: Sequence[str], record_type: Type[RecordT]) -> Dict[str, RecordT]:
+        """Look up several keys at once. Missing, expired or wrong-type entries count as misses."""
+        if not keys:
+            return {}
+        now = time.time()
+        found: Dict[str, RecordT] = {}
+        with self._lock:
+            placeholders = ",".join("?" for _ in keys)
+            rows = self._conn.execute(
+                f"SELECT key, record_type, value, created_at FROM responses WHERE key IN ({placeholders})",
+                list(keys),
+            ).fetchall()
+            for key, stored_type, value, created_at in rows:
+                if stored_type != record_type.__name__ or now - created_at > self.ttl_seconds:
+                    continue
+                found[key] = record_type.model_validate_json(value)
+            if found:
+                self._conn.executemany(
+                    "UPDATE responses SET last_used_at = ? WHERE key = ?", [(now, k) for k in found]
+                )
+                self._conn.commit()
+        self._count(keys, found)
+        return found
+
+    def put_many(self, entries: Mapping[str, BaseModel]) -> None:
+        if not entries:
+            return
+        now = time.time()
+        with self._lock:
+            placeholders = ",".join("?" for _ in entries)
+            (replaced,) = self._conn.execute(
+                f"SELECT COUNT(*) FROM responses WHERE key IN ({placeholders})", list(entries)
+            ).fetchone()
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO responses (key, record_type, value, created_at, last_used_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                [(k, type(v).__name__, v.model_dump_json(), now, now) for k, v in entries.items()],
+            )
+            self._entries += len(entries) - replaced
+            self._evict(now)
+            self._conn.commit()
+
+    def _evict(self, now: float) -> None:
+        """Delete expired and least recently used entries. Must be called holding `_lock`."""
+        if now - self._evicted_at >= self.evict_interval:
+            self._evicted_at = now
+            self._conn.execute("DELETE FROM responses WHERE created_at < ?", (now - self.ttl_seconds,))
+            # Other processes may write to the same file, so the count is re-read here
+            (self._entries,) = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()
+        if self._entries > self.max_entries:
+            deleted = self._conn.execute(
+                "DELETE FROM responses WHERE key IN "
+                "(SELECT key FROM responses ORDER BY last_used_at ASC LIMIT ?)",
+                (self._entries - self.max_entries,),
+            ).rowcount
+            self._entries -= deleted
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+class PgResponseCache(BaseResponseCache):
+    """Response cache backed by the shared Postgres `response_cache` table.
+
+    Every API worker and batch run reads and fills the same cache, so a word generated
+    for one learner is served to the next from any process. Expired and least recently
+    used entries are evicted at most once per `evict_interval` seconds.
+    """
+
+    def __init__(
+        self,
+        engine: Optional[Any] = None,
+        ttl_seconds: Optional[int] = None,
+        max_entries: Optional[int] = None,
+        evict_interval: float = 60.0,
+    ):
+        if engine is None:
+            from db.session import get_db_engine
+
+            engine = get_db_engine()
+        super().__init__(ttl_seconds, max_entries)
+        self.engine = engine
+        self.evict_interval = evict_interval
+        self._evicted_at = 0.0
+
+    def get_many(self, keys: Sequence[str], record_type: Type[RecordT]) -> Dict[str, RecordT]:
+        """Look up several keys in one query. Missing, expired or wrong-type entries count as misses."""
+        from sqlalchemy import func, select, update
+
+        from db.tables import ResponseCacheEntry as Entry
+
+        if not keys:
+            return {}
+        cutoff = datetime.now(timezone.utc) - timedelta(seconds=self.ttl_seconds)
+        with self.engine.begin() as conn:
+            rows = conn.execute(
+                select(Entry.key, Entry.value).where(
+                    Entry.key.in_(list(keys)),
+                    Entry.record_type == record_type.__name__,
+                    Entry.created_at >= cutoff,
+                )
+            ).all()
+            found = {key: record_type.model_validate(value) for key, value in rows}
+            if found:
+                conn.execute(update(Entry).where(Entry.key.in_(list(found))).values(last_used_at=func.now()))
+        self._count(keys, found)
+        return found
+
+    def put_many(self, entries: Mapping[str, BaseModel]) -> None:
+        from sqlalchemy import func
+        from sqlalchemy.dialects.postgresql import insert
+
+        from db.tables import ResponseCacheEntry as Entry
+
+        if not entries:
+            return
+        statement = insert(Entry).values(
+            [
+                {"key": k, "record_type": type(v).__name__, "value": v.model_dump(mode="json")}
+                for k, v in entries.items()
+            ]
+        )
+        statement = statement.on_conflict_do_update(
+            index_elements=[Entry.key],
+            set_={
+                "record_type": statement.excluded.record_type,
+                "value": statement.excluded.value,
+                "created_at": func.now(),
+                "last_used_at": func.now(),
+            },
+        )
+        with self.engine.begin() as conn:
+            conn.execute(statement)
+        self._maybe_evict()
+
+    def _maybe_evict(self) -> None:
+        from sqlalchemy import delete, select
+
+        from db.tables import ResponseCacheEntry as Entry
+
+        now = time.monotonic()
+        with self._lock:
+            if now - self._evicted_at < self.evict_interval:
+                return
+            self._evicted_at = now
+        cutoff = datetime.now(timezone.utc) - timedelta(seconds=self.ttl_seconds)
+        with self.engine.begin() as conn:
+            conn.execute(delete(Entry).where(Entry.created_at < cutoff))
+            overflow = select(Entry.key).order_by(Entry.last_used_at.desc()).offset(self.max_entries)
+            conn.execute(delete(Entry).where(Entry.key.in_(overflow)))
+
+
+def open_response_cache() -> BaseResponseCache:
+    """Open the response cache selected by `agent_settings.response_cache_backend`."""
+    if agent_settings.response_cache_backend == "postgres":
+        return PgResponseCache()
+    return ResponseCache()
+
+
+def _lookup(
+    cache: ResponseStore, scope: str, items: List[dict], key_fields: Sequence[str], record_type: Type[RecordT]
+) -> Tuple[List[str], Dict[str, RecordT], List[Tuple[str, dict]]]:
+    """Cache keys of `items`, the records found for them and the `(key, item)` pairs missing."""
+    keys = [cache.make_key(scope, *(item[f] for f in key_fields)) for item in items]
+    cached = cache.get_many(keys, record_type)
+    missing = [(key, item) for key, item in zip(keys, items) if key not in cached]
+    metrics.record_cache("responses", hits=len(keys) - len(missing), misses=len(missing))
+    return keys, cached, missing
+
+
+def _wanted_keys(missing: List[Tuple[str, dict]], key_fields: Sequence[str]) -> Dict[str, List[str]]:
+    # Fresh records are matched back to the keys of their items by normalized word, in order
+    wanted: Dict[str, List[str]] = {}
+    for key, item in missing:
+        wanted.setdefault(normalize_text(item[key_fields[0]]), []).append(key)
+    return wanted
+
+
+def run_cached(
+    cache: Optional[ResponseStore],
+    scope: str,
+    items: List[dict],
+    key_fields: Sequence[str],
+    record_type: Type[RecordT],
+    record_key_field: str,
+    run: Callable[[List[dict]], List[RecordT]],
+    flight: Optional[SingleFlight] = None,
+) -> List[RecordT]:
+    """Serve `items` from the cache and send only the misses to `run`.
+
+    Fresh records are matched back to their input items by the normalized `record_key_field`,
+    never by position, so a model that reorders or renames entries cannot get a card cached
+    under another word's key. Items sharing a word are matched in order. Records that cannot
+    be matched are still returned but are not cached.
+
+    With a `flight`, concurrent calls missing the same keys (e.g. the same word list
+    uploaded twice) share one call of `run`; each caller gets its own copy of the records.
+
+    Returns:
+        List[RecordT]: Records in input order, followed by any unmatched fresh records.
+    """
+    if cache is None:
+        return run(items)
+
+    keys, cached, missing = _lookup(cache, scope, items, key_fields, record_type)
+    if not missing:
+        return [cached[key] for key in keys]
+
+    todo = [item for _, item in missing]
+    if flight is not None:
+        shared = flight.do(tuple(key for key, _ in missing), lambda: run(todo))
+        fresh = [record.model_copy(deep=True) for record in shared]
+    else:
+        fresh = run(todo)
+    wanted = _wanted_keys(missing, key_fields)
+    by_key: Dict[str, RecordT] = {}
+    extras: List[RecordT] = []
+    for record in fresh:
+        keys_left = wanted.get(normalize_text(getattr(record, record_key_field)))
+        if keys_left:
+            by_key[keys_left.pop(0)] = record
+        else:
+            extras.append(record)
+    if extras:
+        logger.warning(
+            f"{len(extras)} of {len(fresh)} records match no requested {record_key_field}; not caching them"
+        )
+    cache.put_many(by_key)
+
+    results = [cached.get(key) or by_key.get(key) for key in keys]
+    return [r for r in results if r is not None] + extras
+
+
+def stream_cached(
+    cache: Optional[ResponseStore],
+    scope: str,
+    items: List[dict],
+    key_fields: Sequence[str],
+    record_type: Type[RecordT],
+    record_key_field: str,
+    stream: Callable[[List[dict]], Iterable[RecordT]],
+) -> Iterator[RecordT]:
+    """Like `run_cached`, for a `stream` that yields records as the model finishes them.
+
+    Cached records are yielded first, then each fresh record as soon as `stream` yields it.
+    Fresh records are matched and cached one at a time, so a stream cut off halfway still
+    caches the records it completed.
+    """
+    if cache is None:
+        yield from stream(items)
+        return
+
+    keys, cached, missing = _lookup(cache, scope, items, key_fields, record_type)
+    for key in keys:
+        if key in cached:
+            yield cached[key]
+    if not missing:
+        return
+
+    wanted = _wanted_keys(missing, key_fields)
+    for record in stream([item for _, item in missing]):
+        keys_left = wanted.get(normalize_text(getattr(record, record_key_field)))
+        if keys_left:
+            cache.put_many({keys_left.pop(0): record})
+        else:
+            logger.warning(f"Streamed record matches no requested {record_key_field}; not caching it")
+        yield record
@@ -0,0 +1,447 @@
+import json
+import random
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass, field
+from enum import Enum
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple, Union
+
+from pydantic import BaseModel
+
+from agents.cache import normalize_text
+from agents.chunking import IncompleteResponseError, TokenPacker
+from agents.pipeline import Pipeline, Stage
+from agents.scheduler import ChunkScheduler
+from agents.sinks import RowSink
+from utils.log import logger
+from utils.metrics import metrics
+
+
+class WordStatus(str, Enum):
+    pending = "pending"
+    in_flight = "in_flight"
+    done = "done"
+    failed = "failed"
+
+
+class WordState(BaseModel):
+    """Progress of one input row within a job."""
+
+    position: int
+    key: str
+    item: dict
+    status: WordStatus = WordStatus.pending
+    attempts: int = 0
+    last_error: Optional[str] = None
+
+
+def item_key(item: dict, key_fields: Sequence[str]) -> str:
+    return "\x1f".join(normalize_text(item[f]) for f in key_fields)
+
+
+class JobManifest:
+    """SQLite-backed record of per-word progress for a batch generation job.
+
+    Every state change is committed in a single transaction, so the manifest on disk is
+    always consistent and a run can be resumed from it after a crash. Updates touch only
+    the rows of the chunk being processed, and resuming reads only unfinished rows.
+    """
+
+    def __init__(self, path: Union[str, Path]):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS words (
+                key TEXT PRIMARY KEY,
+                position INTEGER NOT NULL,
+                item TEXT NOT NULL,
+                status TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                last_error TEXT,
+                updated_at REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS words_status_position ON words (status, position)")
+        # Size of each file sink when its rows were last checkpointed as done, while a run is going
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS sinks (path TEXT PRIMARY KEY, position INTEGER NOT NULL)"
+        )
+        # Batch API batches submitted for this job and not processed yet, with the row keys of each request
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS batches (batch_id TEXT PRIMARY KEY, chunks TEXT NOT NULL, "
+            "submitted_at REAL NOT NULL)"
+        )
+        self._conn.commit()
+
+    def add_items(self, items: Sequence[dict], key_fields: Sequence[str]) -> int:
+        """Register input rows. Rows already in the manifest keep their state.
+
+        Returns:
+            int: Number of newly added rows.
+        """
+        now = time.time()
+        with self._lock:
+            (offset,) = self._conn.execute("SELECT COALESCE(MAX(position) + 1, 0) FROM words").fetchone()
+            before = self._conn.total_changes
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO words (key, position, item, status, updated_at) VALUES (?, ?, ?, ?, ?)",
+                [
+                    (
+                        item_key(item, key_fields),
+                        offset + i,
+                        json.dumps(item, ensure_ascii=False),
+                        "pending",
+                        now,
+                    )
+                    for i, item in enumerate(items)
+                ],
+            )
+            self._conn.commit()
+            return self._conn.total_changes - before
+
+    def requeue(self, items: Sequence[dict], key_fields: Sequence[str]) -> None:
+        """Make `items` the whole job, all pending, dropping rows that are not among them.
+
+        Used by incremental runs, where the rows to (re)generate are decided elsewhere and
+        may include rows an earlier job already finished.
+        """
+        keys = [item_key(item, key_fields) for item in items]
+        with self._lock:
+            self._conn.execute("DELETE FROM words")
+            self._conn.executemany(
+                "INSERT INTO words (key, position, item, status, updated_at) VALUES (?, ?, ?, 'pending', ?) "
+                "ON CONFLICT (key) DO NOTHING",
+                [
+                    (key, i, json.dumps(item, ensure_ascii=False), time.time())
+                    for i, (key, item) in enumerate(zip(keys, items))
+                ],
+            )
+            self._conn.commit()
+
+    def remaining(self, retry_failed: bool = True) -> List[WordState]:
+        """Rows that still need work, in input order.
+
+        Rows left `in_flight` by an interrupted run go back to `pending`. Failed rows are
+        included (with a fresh attempt budget) when `retry_failed` is set.
+        """
+        statuses = ["pending", "in_flight"] + (["failed"] if retry_failed else [])
+        placeholders = ",".join("?" for _ in statuses)
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT position, key, item, status, attempts, last_error FROM words "
+                f"WHERE status IN ({placeholders}) ORDER BY position",
+                statuses,
+            ).fetchall()
+            self._conn.execute(
+                f"UPDATE words SET status = 'pending', attempts = 0 WHERE status IN ({placeholders})",
+                statuses,
+            )
+            self._conn.commit()
+        return [
+            WordState(position=position, key=key, item=json.loads(item), attempts=0, last_error=last_error)
+            for position, key, item, _, _, last_error in rows
+        ]
+
+    def mark(self, states: Sequence[WordState], status: WordStatus, sink: Optional[RowSink] = None) -> None:
+        """Set the status of `states`.
+
+        With a `sink`, its current `position()` is saved in the same transaction, so the
+        rows marked done and the rows in the sink always agree (see `rewind`).
+        """
+        now = time.time()
+        for state in states:
+            state.status = status
+        position = sink.position() if sink is not None else None
+        with self._lock:
+            self._conn.executemany(
+                "UPDATE words SET status = ?, attempts = ?, last_error = ?, updated_at = ? WHERE key = ?",
+                [(status.value, s.attempts, s.last_error, now, s.key) for s in states],
+            )
+            if sink is not None and position is not None:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO sinks (path, position) VALUES (?, ?)", (str(sink.path), position)
+                )
+            self._conn.commit()
+
+    def rewind(self, sink: Optional[RowSink]) -> None:
+        """Drop the rows a crashed run wrote to `sink` after its last checkpoint.
+
+        Those rows are not marked done, so they are generated and written again; without
+        the rewind they would appear twice in the output.
+        """
+        position = sink.position() if sink is not None else None
+        if sink is None or position is None:
+            return
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT position FROM sinks WHERE path = ?", (str(sink.path),)
+            ).fetchone()
+        if row is not None and row[0] < position:
+            logger.warning(f"Removing rows written to {sink.path} after the last checkpoint")
+            sink.truncate(row[0])
+
+    def release(self, sink: Optional[RowSink]) -> None:
+        """Forget the checkpointed position of `sink` once a run has finished cleanly."""
+        if sink is None:
+            return
+        with self._lock:
+            self._conn.execute("DELETE FROM sinks WHERE path = ?", (str(sink.path),))
+            self._conn.commit()
+
+    def save_batch(self, batch_id: str, chunks: Sequence[Sequence[WordState]]) -> None:
+        """Remember a submitted Batch API batch, so a rerun waits for it instead of paying for it again.
+
+        `chunks` are the rows of each request of the batch, in `custom_id` order.
+        """
+        keys = [[state.key for state in chunk] for chunk in chunks]
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO batches (batch_id, chunks, submitted_at) VALUES (?, ?, ?)",
+                (batch_id, json.dumps(keys, ensure_ascii=False), time.time()),
+            )
+            self._conn.commit()
+
+    def submitted_batch(self) -> Optional[Tuple[str, List[List[str]]]]:
+        """The oldest batch saved by `save_batch` and not cleared yet, with the row keys of each request."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT batch_id, chunks FROM batches ORDER BY submitted_at LIMIT 1"
+            ).fetchone()
+        return (row[0], json.loads(row[1])) if row is not None else None
+
+    def clear_batch(self, batch_id: str) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM batches WHERE batch_id = ?", (batch_id,))
+            self._conn.commit()
+
+    def counts(self) -> Dict[str, int]:
+        with self._lock:
+            rows = self._conn.execute("SELECT status, COUNT(*) FROM words GROUP BY status").fetchall()
+        return {status.value: 0 for status in WordStatus} | dict(rows)
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+def match_records(
+    batch: List[WordState], records: Sequence[BaseModel], item_field: str, record_key_field: str
+) -> Tuple[List[Tuple[WordState, BaseModel]], List[WordState]]:
+    """Pair generated records with the rows they were generated for.
+
+    Records are matched by comparing the normalized `item_field` of each row with
+    `record_key_field` of each record, never by position, so a reordered or renamed record
+    is not stored under the wrong row. Rows sharing a key are matched in order.
+
+    Returns:
+        Tuple: `(matched, missing)` where `missing` are rows with no record.
+    """
+    by_key: Dict[str, List[BaseModel]] = {}
+    for record in records:
+        by_key.setdefault(normalize_text(getattr(record, record_key_field)), []).append(record)
+    matched = []
+    missing = []
+    for state in batch:
+        candidates = by_key.get(normalize_text(state.item[item_field]))
+        if candidates:
+            matched.append((state, candidates.pop(0)))
+        else:
+            missing.append(state)
+    for state in missing:
+        state.last_error = "No record returned"
+    return matched, missing
+
+
+@dataclass
+class ChunkOutcome:
+    done: List[Tuple[WordState, BaseModel]] = field(default_factory=list)
+    failed: List[WordState] = field(default_factory=list)
+
+
+class JobRunner:
+    """Runs the unfinished rows of a `JobManifest` through a generator function.
+
+    A failing batch is retried with exponential backoff, split in half each time, until
+    single rows have used up `max_attempts`. Rows the generator returned no record for are
+    retried the same way. Finished records go to `sink` and are then checkpointed as done,
+    one chunk at a time, in input order. The checkpoint also records how far the sink got,
+    so rows written just before a crash are removed on resume instead of written twice.
+
+    `postprocess`, if given, can enrich each chunk's records in place before they are written.
+    It runs as its own `Pipeline` stage, so it overlaps with the generation of later chunks.
+    `on_done`, if given, receives each chunk's `(row, record)` pairs right after they are written.
+
+    With a `stream` (e.g. `FlashcardGenerator.stream`), each chunk's first attempt yields
+    its records one by one, and each record is postprocessed, written and checkpointed as
+    soon as the model has finished it, while the rest of the chunk is still being generated.
+    Rows the stream left without a record are retried through `generate`.
+
+    Rows are cut into chunks of `chunk_size`, or by token budget when a `packer` is given.
+    The packer is told about every success and failure so later chunks shrink after
+    truncated responses.
+    """
+
+    def __init__(
+        self,
+        manifest: JobManifest,
+        generate: Callable[[List[dict]], Sequence[BaseModel]],
+        record_key_field: str,
+        key_fields: Sequence[str],
+        chunk_size: int = 10,
+        packer: Optional[TokenPacker] = None,
+        max_attempts: int = 3,
+        base_delay: float = 1.0,
+        max_delay: float = 60.0,
+        scheduler_factory: Optional[Callable[..., ChunkScheduler]] = None,
+        postprocess: Optional[Callable[[List[BaseModel]], None]] = None,
+        on_done: Optional[Callable[[List[Tuple[WordState, BaseModel]]], None]] = None,
+        sleep: Callable[[float], None] = time.sleep,
+        stream: Optional[Callable[[List[dict]], Iterable[BaseModel]]] = None,
+    ):
+        self.manifest = manifest
+        self.generate = generate
+        self.record_key_field = record_key_field
+        self.key_fields = list(key_fields)
+        self.chunk_size = chunk_size
+        self.packer = packer
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.scheduler_factory = scheduler_factory or ChunkScheduler.from_settings
+        self.postprocess = postprocess
+        self.on_done = on_done
+        self.sleep = sleep
+        self.stream = stream
+
+    def backoff(self, attempts: int) -> float:
+        delay = min(self.max_delay, self.base_delay * 2 ** max(attempts - 1, 0))
+        return delay * random.uniform(0.5, 1.0)
+
+    def _process(self, chunk: List[WordState]) -> ChunkOutcome:
+        self.manifest.mark(chunk, WordStatus.in_flight)
+        return self._run_batches([chunk], ChunkOutcome())
+
+    def _run_batches(self, batches: List[List[WordState]], outcome: ChunkOutcome) -> ChunkOutcome:
+        while batches:
+            batch = batches.pop(0)
+            for state in batch:
+                state.attempts += 1
+            try:
+                records = self.generate([s.item for s in batch])
+                matched, missing = match_records(batch, records, self.key_fields[0], self.record_key_field)
+                outcome.done.extend(matched)
+                if self.packer is not None:
+                    if len(records) < len(batch):
+                        self.packer.record_failure(
+                            IncompleteResponseError(f"Got {len(records)} of {len(batch)} records")
+                        )
+                    else:
+                        self.packer.record_success()
+            except Exception as e:
+                logger.warning(f"Batch of {len(batch)} failed (attempt {batch[0].attempts}): {e}")
+                if self.packer is not None:
+                    self.packer.record_failure(e)
+                for state in batch:
+                    state.last_error = f"{type(e).__name__}: {e}"
+                missing = batch
+            self._requeue(missing, batches, outcome)
+        return outcome
+
+    def _requeue(
+        self, missing: List[WordState], batches: List[List[WordState]], outcome: ChunkOutcome
+    ) -> None:
+        if not missing:
+            return
+        retryable = [s for s in missing if s.attempts < self.max_attempts]
+        outcome.failed.extend(s for s in missing if s.attempts >= self.max_attempts)
+        if not retryable:
+            return
+        metrics.inc("retries_total", len(retryable), stage="generate")
+        self.sleep(self.backoff(max(s.attempts for s in retryable)))
+        # Retry in smaller batches so one bad row cannot sink its neighbours
+        if len(retryable) > 1:
+            half = len(retryable) // 2
+            batches[:0] = [retryable[:half], retryable[half:]]
+        else:
+            batches.insert(0, retryable)
+
+    def _stream_process(self, chunk: List[WordState]) -> Iterator[ChunkOutcome]:
+        """Like `_process`, yielding one outcome per record as `stream` produces it, then one for the retries."""
+        if self.stream is None:
+            raise ValueError("JobRunner has no stream to generate from")
+        self.manifest.mark(chunk, WordStatus.in_flight)
+        for state in chunk:
+            state.attempts += 1
+        waiting = list(chunk)
+        received = 0
+        try:
+            for record in self.stream([s.item for s in chunk]):
+                received += 1
+                matched, waiting = match_records(waiting, [record], self.key_fields[0], self.record_key_field)
+                if matched:
+                    yield ChunkOutcome(done=matched)
+            error: Exception = IncompleteResponseError(f"Got {received} of {len(chunk)} records")
+        except Exception as e:
+            logger.warning(f"Streamed batch of {len(chunk)} failed (attempt {chunk[0].attempts}): {e}")
+            for state in waiting:
+                state.last_error = f"{type(e).__name__}: {e}"
+            error = e
+        if self.packer is not None:
+            if waiting:
+                self.packer.record_failure(error)
+            else:
+                self.packer.record_success()
+        if waiting:
+            outcome = ChunkOutcome()
+            batches: List[List[WordState]] = []
+            self._requeue(waiting, batches, outcome)
+            yield self._run_batches(batches, outcome)
+
+    def run(self, sink: Optional[RowSink], retry_failed: bool = True) -> Dict[str, int]:
+        """Process all remaining rows, writing records to `sink` if one is given.
+
+        Returns:
+            Dict[str, int]: Row counts per status after the run.
+        """
+        remaining = self.manifest.remaining(retry_failed=retry_failed)
+        logger.info(f"{len(remaining)} rows left to generate")
+        if self.packer is not None:
+            # Packed lazily, so chunks cut after a failure already use the reduced budget
+            chunks: Iterable[List[WordState]] = self.packer.iter_batches(remaining, lambda state: state.item)
+        else:
+            chunks = (remaining[i : i + self.chunk_size] for i in range(0, len(remaining), self.chunk_size))
+
+        self.manifest.rewind(sink)
+        # The model, the enrichment and the writes below each work on a different chunk at a time
+        if self.stream is not None:
+            stages = [Stage.streamed("generate", self.scheduler_factory(self._stream_process))]
+        else:
+            stages = [Stage.scheduled("generate", self.scheduler_factory(self._process))]
+        if self.postprocess is not None:
+            stages.append(Stage.map("postprocess", self._postprocess))
+        # Streamed chunks arrive one record at a time
+        log = logger.debug if self.stream is not None else logger.info
+        for i, outcome in enumerate(Pipeline(stages).run(chunks)):
+            records = [record for _, record in outcome.done]
+            if sink is not None:
+                sink.write(records, items=[state.item for state, _ in outcome.done])
+            if self.on_done is not None and outcome.done:
+                self.on_done(outcome.done)
+            self.manifest.mark([state for state, _ in outcome.done], WordStatus.done, sink=sink)
+            self.manifest.mark(outcome.failed, WordStatus.failed)
+            log(f"Chunk {i + 1}: {len(outcome.done)} done, {len(outcome.failed)} failed")
+        self.manifest.release(sink)
+        return self.manifest.counts()
+
+    def _postprocess(self, outcome: ChunkOutcome) -> ChunkOutcome:
+        records = [record for _, record in outcome.done]
+        if records and self.postprocess is not None:
+            with metrics.time("postprocess"):
+                self.postprocess(records)
+        return outcome
@@ -0,0 +1,131 @@
+import json
+import threading
+from functools import lru_cache
+from typing import Callable, Iterable, Iterator, List, Optional, Sequence, Tuple, TypeVar, cast
+
+from agents.settings import agent_settings
+from utils.log import logger
+
+T = TypeVar("T")
+
+
+class IncompleteResponseError(RuntimeError):
+    """The model's structured output was truncated or could not be validated."""
+
+
+def is_size_failure(exc: BaseException) -> bool:
+    """Whether a failure suggests the request was too large for one structured response."""
+    from openai import LengthFinishReasonError
+    from pydantic import ValidationError
+
+    return isinstance(
+        exc, (IncompleteResponseError, LengthFinishReasonError, ValidationError, json.JSONDecodeError)
+    )
+
+
+@lru_cache(maxsize=None)
+def _encoding_for(model_id: str):
+    import tiktoken
+
+    try:
+        return tiktoken.encoding_for_model(model_id)
+    except KeyError:
+        return tiktoken.get_encoding("o200k_base")
+
+
+def token_counter(model_id: str) -> Callable[[str], int]:
+    """Return a function counting tokens for `model_id`.
+
+    Falls back to a character-based estimate when the tiktoken encoding cannot be loaded,
+    e.g. without network access on first use.
+    """
+    try:
+        encoding = _encoding_for(model_id)
+    except Exception as e:
+        logger.warning(f"Could not load tiktoken encoding for {model_id}, estimating from length: {e}")
+        return lambda text: len(text) // 2 + 1
+    return lambda text: len(encoding.encode(text))
+
+
+class TokenPacker:
+    """Packs items into requests that fit a prompt and completion token budget.
+
+    Each item's prompt cost is the token count of its rendered prompt line. Its completion
+    cost is estimated as `completion_overhead + completion_ratio * prompt tokens`, which
+    covers the structured JSON wrapper plus the example sentences and translations.
+
+    The completion budget adapts: `record_failure` halves it after a truncated or invalid
+    response, and `record_success` grows it back towards the configured maximum.
+    """
+
+    def __init__(
+        self,
+        render_item: Callable[[dict], str],
+        model_id: Optional[str] = None,
+        prompt_budget: Optional[int] = None,
+        completion_budget: Optional[int] = None,
+        max_items: Optional[int] = None,
+        completion_overhead: int = 120,
+        completion_ratio: float = 3.0,
+        count_tokens: Optional[Callable[[str], int]] = None,
+    ):
+        self.render_item = render_item
+        self.count_tokens = count_tokens or token_counter(model_id or agent_settings.gpt_4o_mini)
+        self.prompt_budget = prompt_budget or agent_settings.batch_prompt_token_budget
+        self.max_completion_budget = completion_budget or agent_settings.batch_completion_token_budget
+        self.completion_budget = self.max_completion_budget
+        self.max_items = max_items or agent_settings.batch_max_items
+        self.completion_overhead = completion_overhead
+        self.completion_ratio = completion_ratio
+        self._lock = threading.Lock()
+
+    def estimate_item(self, item: dict) -> Tuple[int, int]:
+        """Return the (prompt, completion) token estimate for one item."""
+        prompt_tokens = self.count_tokens(self.render_item(item))
+        return prompt_tokens, int(self.completion_overhead + self.completion_ratio * prompt_tokens)
+
+    def estimate_batch(self, items: Sequence[dict]) -> int:
+        """Total prompt + completion tokens for a batch, for tokens-per-minute limiting."""
+        return sum(sum(self.estimate_item(item)) for item in items)
+
+    def iter_batches(
+        self, items: Iterable[T], get_item: Optional[Callable[[T], dict]] = None
+    ) -> Iterator[List[T]]:
+        """Lazily pack `items` into batches using the budget current at the time each batch is cut.
+
+        `get_item` returns the row dict of an entry; entries are rows themselves by default.
+        A single item larger than the budget still gets a batch of its own.
+        """
+        batch: List[T] = []
+        prompt_total = completion_total = 0
+        for entry in items:
+            item = get_item(entry) if get_item is not None else cast(dict, entry)
+            prompt_tokens, completion_tokens = self.estimate_item(item)
+            with self._lock:
+                completion_budget = self.completion_budget
+            if batch and (
+                len(batch) >= self.max_items
+                or prompt_total + prompt_tokens > self.prompt_budget
+                or completion_total + completion_tokens > completion_budget
+            ):
+                yield batch
+                batch, prompt_total, completion_total = [], 0, 0
+            batch.append(entry)
+            prompt_total += prompt_tokens
+            completion_total += completion_tokens
+        if batch:
+            yield batch
+
+    def pack(self, items: Sequence[dict]) -> List[List[dict]]:
+        return list(self.iter_batches(items))
+
+    def record_failure(self, exc: BaseException) -> None:
+        if not is_size_failure(exc):
+            return
+        with self._lock:
+            self.completion_budget = max(self.completion_overhead, self.completion_budget // 2)
+            logger.info(f"Shrinking completion budget to {self.completion_budget} tokens after: {exc}")
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.completion_budget = min(self.max_completion_budget, int(self.completion_budget * 1.25) + 1)
@@ -0,0 +1,218 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple, Type, Union
+
+from pydantic import BaseModel
+
+from agents.cache import normalize_text
+from agents.checkpoint import WordState, item_key
+from agents.deck_format import write_deck
+from agents.sinks import open_sink
+from utils.log import logger
+
+
+def row_fingerprint(item: dict, key_fields: Sequence[str], config: str) -> str:
+    """Fingerprint of an input row: its normalized key fields plus the generator config hash."""
+    raw = "\x1f".join([config, *(normalize_text(item[f]) for f in key_fields)])
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+@dataclass
+class DeckDiff:
+    """How the input rows of a deck changed since the last run, as lists of row keys.
+
+    A row whose meaning was edited gets a new key; it is reported as `changed` under its
+    new key and `renamed` maps its old key to it.
+    """
+
+    added: List[str] = field(default_factory=list)
+    changed: List[str] = field(default_factory=list)
+    removed: List[str] = field(default_factory=list)
+    renamed: Dict[str, str] = field(default_factory=dict)
+    unchanged: int = 0
+
+    def summary(self) -> str:
+        return (
+            f"{len(self.added)} added, {len(self.changed)} changed, "
+            f"{len(self.removed)} removed, {self.unchanged} unchanged"
+        )
+
+
+class DeckIndex:
+    """SQLite index of a deck's input rows and the records last generated for them.
+
+    Rows are identified by all of their normalized key fields, so each sense of a word
+    (e.g. やります "làm" and やります "cho") is a row of its own. They carry two
+    fingerprints: the one `update` computed from the current input and the one the
+    stored record was generated from. Rows where they differ are `pending`. The deck
+    output is rebuilt from the stored records with `export`, so unchanged rows never go
+    through the model again and rows deleted from the input disappear from the output.
+    """
+
+    def __init__(self, path: Union[str, Path]):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS rows (
+                key TEXT PRIMARY KEY,
+                position INTEGER NOT NULL,
+                item TEXT NOT NULL,
+                wanted TEXT NOT NULL,
+                fingerprint TEXT,
+                record TEXT
+            )
+            """
+        )
+        self._conn.commit()
+        self.key_fields: List[str] = []
+        self.config = ""
+
+    def update(self, items: Sequence[dict], key_fields: Sequence[str], config: str) -> DeckDiff:
+        """Diff `items` against the index and make it describe them.
+
+        New rows are registered as pending, edited rows are marked pending, rows that are
+        no longer in `items` are deleted together with their records.
+
+        A new row and a removed row with the same term (the first key field) are the same
+        row with an edited meaning: the row is moved to its new key and kept with its
+        record, so it is reported as changed rather than as removed and re-added. Several
+        senses of a term are paired up in input order.
+
+        Args:
+            items: The full current input of the deck, in order.
+            key_fields: Fields that identify a row; the first one names it in the output.
+            config: Hash of the generator configuration (see `agent_scope`), so that a prompt
+                or model change regenerates every row.
+        """
+        self.key_fields = list(key_fields)
+        self.config = config
+        diff = DeckDiff()
+        current: Dict[str, Tuple[int, dict, str]] = {}
+        for position, item in enumerate(items):
+            key = item_key(item, key_fields)
+            if key in current:
+                logger.warning(f"Ignoring repeated row {item[key_fields[0]]!r}")
+                continue
+            current[key] = (position, item, row_fingerprint(item, key_fields, config))
+
+        with self._lock:
+            previous: Dict[str, Tuple[Optional[str], Optional[str]]] = {}
+            for key, fingerprint, stored_item in self._conn.execute(
+                "SELECT key, fingerprint, item FROM rows ORDER BY position"
+            ):
+                stored = json.loads(stored_item)
+                term = normalize_text(stored[key_fields[0]]) if key_fields[0] in stored else None
+                previous[key] = (fingerprint, term)
+            unmatched: Dict[Optional[str], List[str]] = {}
+            for key, (_, term) in previous.items():
+                if key not in current:
+                    unmatched.setdefault(term, []).append(key)
+
+            for key, (_, item, wanted) in current.items():
+                if key in previous:
+                    if previous[key][0] != wanted:
+                        diff.changed.append(key)
+                    else:
+                        diff.unchanged += 1
+                    continue
+                old_keys = unmatched.get(normalize_text(item[key_fields[0]]))
+                if old_keys:
+                    diff.renamed[old_keys.pop(0)] = key
+                    diff.changed.append(key)
+                else:
+                    diff.added.append(key)
+            diff.removed = [key for key in previous if key not in current and key not in diff.renamed]
+
+            self._conn.executemany("DELETE FROM rows WHERE key = ?", [(key,) for key in diff.removed])
+            self._conn.executemany(
+                "UPDATE rows SET key = ? WHERE key = ?", [(new, old) for old, new in diff.renamed.items()]
+            )
+            self._conn.executemany(
+                "INSERT INTO rows (key, position, item, wanted) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (key) DO UPDATE SET position = excluded.position, item = excluded.item, "
+                "wanted = excluded.wanted",
+                [
+                    (key, position, json.dumps(item, ensure_ascii=False), wanted)
+                    for key, (position, item, wanted) in current.items()
+                ],
+            )
+            self._conn.commit()
+        return diff
+
+    def pending(self) -> List[dict]:
+        """Input rows whose stored record is missing or was generated from different input, in order."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT item FROM rows WHERE fingerprint IS NULL OR fingerprint != wanted ORDER BY position"
+            ).fetchall()
+        return [json.loads(item) for (item,) in rows]
+
+    def store(self, done: Sequence[Tuple[WordState, BaseModel]]) -> None:
+        """Save generated records for their input rows. Usable as `JobRunner(on_done=...)`."""
+        values = []
+        for state, record in done:
+            values.append(
+                (
+                    record.model_dump_json(),
+                    row_fingerprint(state.item, self.key_fields, self.config),
+                    item_key(state.item, self.key_fields),
+                )
+            )
+        with self._lock:
+            self._conn.executemany("UPDATE rows SET record = ?, fingerprint = ? WHERE key = ?", values)
+            self._conn.commit()
+
+    def records(self, record_type: Type[BaseModel], batch_size: int = 1000):
+        """Yield lists of stored records in input order.
+
+        Rows whose regeneration failed keep their previous record; rows that never had one
+        are skipped.
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT record FROM rows WHERE record IS NOT NULL ORDER BY position"
+            ).fetchall()
+        for start in range(0, len(rows), batch_size):
+            yield [record_type.model_validate_json(r) for (r,) in rows[start : start + batch_size]]
+
+    def records_by_key(self, record_type: Type[BaseModel]) -> Dict[str, BaseModel]:
+        """Stored records by row key, e.g. to merge the indexes of several shards of a deck."""
+        with self._lock:
+            rows = self._conn.execute("SELECT key, record FROM rows WHERE record IS NOT NULL").fetchall()
+        return {key: record_type.model_validate_json(record) for key, record in rows}
+
+    def export(
+        self, path: Union[str, Path], record_type: Type[BaseModel], format: Optional[str] = None
+    ) -> int:
+        """Rewrite the deck output at `path` from the stored records.
+
+        The output is written next to `path` and swapped into place, so a failed export
+        leaves the previous file untouched. Parquet output uses the canonical deck schema
+        of `record_type` (see `agents.deck_format`).
+
+        Returns:
+            int: Number of records written.
+        """
+        path = Path(path)
+        if (format or path.suffix.lstrip(".")).lower() == "parquet":
+            return write_deck(path, self.records(record_type), record_type)
+        tmp_path = path.with_name(f".{path.stem}.tmp{path.suffix}")
+        if tmp_path.exists():
+            tmp_path.unlink()
+        with open_sink(tmp_path, columns=list(record_type.model_fields), format=format) as sink:
+            for records in self.records(record_type):
+                sink.write(records)
+        os.replace(tmp_path, path)
+        return sink.rows_written
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,113 @@
+import os
+import typing
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Type, Union
+
+from pydantic import BaseModel
+
+from agents.sinks import ParquetSink
+
+# Bumped when the columns of the canonical deck files change incompatibly
+SCHEMA_VERSION = "1"
+
+_ARROW_TYPES: Dict[Any, str] = {str: "string", int: "int64", float: "float64", bool: "bool_"}
+
+
+@lru_cache(maxsize=None)
+def arrow_schema(record_type: Type[BaseModel]) -> Any:
+    """Canonical Arrow schema of a deck record type such as `Flashcard` or `Grammar`.
+
+    One column per model field, in field order. Required fields are non-nullable and
+    `Optional[...]` fields are nullable. The record type and schema version are kept in the
+    schema metadata, so a deck file says what it holds.
+    """
+    import pyarrow as pa
+
+    fields = []
+    for name, info in record_type.model_fields.items():
+        annotation = info.annotation
+        args = [a for a in typing.get_args(annotation) if a is not type(None)]
+        nullable = not info.is_required() or len(args) < len(typing.get_args(annotation))
+        if args and nullable:
+            annotation = args[0]
+        arrow_type = getattr(pa, _ARROW_TYPES.get(annotation, "string"))()
+        fields.append(pa.field(name, arrow_type, nullable=nullable))
+    return pa.schema(fields, metadata={"record_type": record_type.__name__, "schema_version": SCHEMA_VERSION})
+
+
+def deck_path(path: Union[str, Path]) -> Path:
+    """The canonical Parquet file of a deck whose export is `path` (e.g. `new.xlsx` -> `new.parquet`)."""
+    return Path(path).with_suffix(".parquet")
+
+
+def write_deck(
+    path: Union[str, Path], batches: Iterator[Sequence[BaseModel]], record_type: Type[BaseModel]
+) -> int:
+    """Write batches of records to a new deck file, one row group per batch.
+
+    The file is written next to `path` and swapped into place, so readers never see a
+    partial deck.
+
+    Returns:
+        int: Number of records written.
+    """
+    path = Path(path)
+    tmp_path = path.with_name(f".{path.stem}.tmp{path.suffix}")
+    if tmp_path.exists():
+        tmp_path.unlink()
+    with ParquetSink(tmp_path, list(record_type.model_fields), schema=arrow_schema(record_type)) as sink:
+        for records in batches:
+            sink.write(records)
+    os.replace(tmp_path, path)
+    return sink.rows_written
+
+
+def read_deck(path: Union[str, Path], columns: Optional[Sequence[str]] = None) -> Any:
+    """Read a deck file into an Arrow table through a memory map.
+
+    The columns stay in Arrow buffers; nothing is converted to Python objects, which is
+    what makes reloading a large deck cheap. Pass `columns` to read only some of them.
+    """
+    import pyarrow.parquet as pq
+
+    return pq.read_table(path, columns=list(columns) if columns else None, memory_map=True)
+
+
+def iter_deck(
+    path: Union[str, Path], record_type: Type[BaseModel], batch_size: int = 1000
+) -> Iterator[List[BaseModel]]:
+    """Yield lists of `record_type` records from a deck file, one row batch at a time."""
+    import pyarrow.parquet as pq
+
+    parquet_file = pq.ParquetFile(path, memory_map=True)
+    columns = [c for c in record_type.model_fields if c in parquet_file.schema_arrow.names]
+    for batch in parquet_file.iter_batches(batch_size=batch_size, columns=columns):
+        yield [record_type.model_validate(row) for row in batch.to_pylist()]
+
+
+def export_deck(
+    path: Union[str, Path],
+    output_file: Union[str, Path],
+    format: Optional[str] = None,
+    media_store: Optional[Any] = None,
+) -> int:
+    """Export a deck file to CSV, XLSX, JSONL or an Anki .apkg package.
+
+    CSV and XLSX are export formats only: the pipeline reads and writes the Parquet deck,
+    and the exports are rebuilt from it. Images in the `media_store` (see
+    `tools.media_store.MediaStore.localize`) that the deck references are packed into .apkg
+    packages.
+
+    Returns:
+        int: Number of rows written.
+    """
+    format = (format or Path(output_file).suffix.lstrip(".")).lower()
+    if format == "apkg":
+        from tools.export_apkg import export_csv_to_apkg
+
+        return export_csv_to_apkg(path, output_file, media_store=media_store)
+
+    from tools.converters import convert
+
+    return convert(path, output_file, format=format)
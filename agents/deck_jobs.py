@@ -0,0 +1,226 @@
+import asyncio
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from enum import Enum
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Sequence, Tuple
+
+from pydantic import BaseModel
+
+from agents.checkpoint import JobManifest, JobRunner, WordState
+from agents.settings import agent_settings
+from utils.log import logger
+
+
+class JobStatus(str, Enum):
+    queued = "queued"
+    running = "running"
+    done = "done"
+    failed = "failed"
+
+
+FINISHED_STATUSES = (JobStatus.done, JobStatus.failed)
+
+
+class DeckEvent(BaseModel):
+    """One progress event of a deck job. `id` increases by one per event within a job."""
+
+    id: int
+    event: str
+    data: Dict[str, Any]
+
+
+class DeckJob:
+    """A deck generation job and the ordered log of its progress events.
+
+    Events are published from the worker thread running the job and read by any number
+    of asyncio subscribers, which are woken through their own event loop instead of
+    blocking a thread while they wait.
+    """
+
+    def __init__(self, kind: str, items: List[dict]):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.items = items
+        # Rows of the job once repeated rows are dropped, and how many were dropped
+        self.total = len(items)
+        self.skipped = 0
+        self.status = JobStatus.queued
+        self.created_at = time.time()
+        self.finished_at: Optional[float] = None
+        self.error: Optional[str] = None
+        self.records: List[dict] = []
+        self.failed = 0
+        self.events: List[DeckEvent] = []
+        self._lock = threading.Lock()
+        self._waiters: List[Tuple[asyncio.AbstractEventLoop, asyncio.Event]] = []
+
+    @property
+    def finished(self) -> bool:
+        return self.status in FINISHED_STATUSES
+
+    def _append(
+        self, event: str, data: Dict[str, Any]
+    ) -> List[Tuple[asyncio.AbstractEventLoop, asyncio.Event]]:
+        """Append an event and return the waiters to wake. Must be called holding `_lock`."""
+        self.events.append(DeckEvent(id=len(self.events) + 1, event=event, data=data))
+        waiters, self._waiters = self._waiters, []
+        return waiters
+
+    @staticmethod
+    def _wake(waiters: List[Tuple[asyncio.AbstractEventLoop, asyncio.Event]]) -> None:
+        for loop, waiter in waiters:
+            try:
+                loop.call_soon_threadsafe(waiter.set)
+            except RuntimeError:
+                # The subscriber's loop is already closed
+                pass
+
+    def publish(self, event: str, data: Dict[str, Any]) -> None:
+        with self._lock:
+            waiters = self._append(event, data)
+        self._wake(waiters)
+
+    def set_status(self, status: JobStatus, error: Optional[str] = None) -> None:
+        # The status and its event change together, so a subscriber that sees the job
+        # finished has already been given the final status event
+        with self._lock:
+            self.status = status
+            self.error = error
+            if status in FINISHED_STATUSES:
+                self.finished_at = time.time()
+            waiters = self._append("status", self.summary())
+        self._wake(waiters)
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "status": self.status.value,
+            "total": self.total,
+            "done": len(self.records),
+            "failed": self.failed,
+            "skipped": self.skipped,
+            "error": self.error,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+        }
+
+    async def subscribe(self, after: int = 0, keepalive: float = 15.0) -> AsyncIterator[Optional[DeckEvent]]:
+        """Yield events with an id above `after` as they are published, until the job finishes.
+
+        Yields `None` after `keepalive` seconds without events, so callers can keep an idle
+        connection open.
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            with self._lock:
+                pending = self.events[after:]
+                # Only a fully drained job counts as finished
+                finished = not pending and self.finished
+                if not pending and not finished:
+                    waiter = asyncio.Event()
+                    self._waiters.append((loop, waiter))
+            for event in pending:
+                yield event
+            after += len(pending)
+            if pending:
+                continue
+            if finished:
+                return
+            try:
+                await asyncio.wait_for(waiter.wait(), timeout=keepalive)
+            except asyncio.TimeoutError:
+                yield None
+
+
+class DeckJobQueue:
+    """Runs deck jobs on a fixed pool of worker threads.
+
+    Submitting only enqueues the job, so callers never wait on the model. Jobs beyond
+    `max_workers` wait in the queue. Finished jobs are kept for inspection until more
+    than `max_retained` jobs exist, then the oldest finished ones are dropped.
+    """
+
+    def __init__(self, max_workers: Optional[int] = None, max_retained: Optional[int] = None):
+        self.max_workers = max_workers or agent_settings.deck_job_workers
+        self.max_retained = max_retained or agent_settings.deck_jobs_retained
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="deck-job")
+        self._jobs: "OrderedDict[str, DeckJob]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def submit(
+        self,
+        kind: str,
+        items: List[dict],
+        generate: Callable[[List[dict]], Sequence[BaseModel]],
+        record_key_field: str,
+        key_fields: Sequence[str],
+        postprocess: Optional[Callable[[List[BaseModel]], None]] = None,
+        **runner_kwargs,
+    ) -> DeckJob:
+        job = DeckJob(kind, items)
+        with self._lock:
+            self._jobs[job.id] = job
+            self._prune()
+        job.publish("status", job.summary())
+        self._executor.submit(
+            self._run, job, generate, record_key_field, list(key_fields), postprocess, runner_kwargs
+        )
+        return job
+
+    def get(self, job_id: str) -> Optional[DeckJob]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _prune(self) -> None:
+        excess = len(self._jobs) - self.max_retained
+        for job_id in [job_id for job_id, job in self._jobs.items() if job.finished][: max(excess, 0)]:
+            del self._jobs[job_id]
+
+    def _run(
+        self,
+        job: DeckJob,
+        generate: Callable[[List[dict]], Sequence[BaseModel]],
+        record_key_field: str,
+        key_fields: List[str],
+        postprocess: Optional[Callable[[List[BaseModel]], None]],
+        runner_kwargs: Dict[str, Any],
+    ) -> None:
+        def on_done(done: List[Tuple[WordState, BaseModel]]) -> None:
+            for state, record in done:
+                row = record.model_dump()
+                job.records.append(row)
+                job.publish("card", {"position": state.position, "record": row})
+
+        # Each job tracks its rows in a private in-memory manifest
+        manifest = JobManifest(":memory:")
+        try:
+            # Repeated rows share a key and are generated once, so `total` counts them once
+            job.total = manifest.add_items(job.items, key_fields=key_fields)
+            job.skipped = len(job.items) - job.total
+            if job.skipped:
+                logger.warning(f"Deck job {job.id}: skipping {job.skipped} repeated rows")
+            job.set_status(JobStatus.running)
+            runner = JobRunner(
+                manifest,
+                generate,
+                record_key_field=record_key_field,
+                key_fields=key_fields,
+                postprocess=postprocess,
+                on_done=on_done,
+                **runner_kwargs,
+            )
+            counts = runner.run(None)
+            job.failed = counts["failed"]
+            job.set_status(JobStatus.done)
+        except Exception as e:
+            logger.exception(f"Deck job {job.id} failed")
+            job.set_status(JobStatus.failed, error=f"{type(e).__name__}: {e}")
+        finally:
+            manifest.close()
+
+    def shutdown(self, wait: bool = True) -> None:
+        self._executor.shutdown(wait=wait)
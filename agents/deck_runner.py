@@ -0,0 +1,216 @@
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple, Type, Union
+
+from pydantic import BaseModel
+
+from agents.batch import OfflineBatchRunner, OpenAIBatchBackend
+from agents.cache import ResponseStore
+from agents.checkpoint import JobManifest, JobRunner
+from agents.chunking import TokenPacker
+from agents.deck_diff import DeckIndex
+from agents.deck_format import deck_path, export_deck, iter_deck
+from agents.dedupe import EmbeddingCache, Embedder, dedupe_items, repeated_sentences
+from agents.scheduler import ChunkScheduler
+from agents.settings import agent_settings
+from agents.sinks import DbSink
+from tools.converters import read_rows
+from utils.log import logger
+from utils.metrics import metrics
+
+
+@dataclass
+class DeckSpec:
+    """What differs between one kind of deck and another; `run_deck` does the rest.
+
+    Args:
+        name: Deck name in the deck tables.
+        kind: Deck kind of `DbSink` ("flashcards" or "grammars").
+        record_type: Pydantic model of one card, e.g. `Flashcard`.
+        key_fields: Input columns; the first one names the card and is the record's key field.
+        generate: Generates the records of a chunk of input rows. Must be thread-safe.
+        agent: The agent behind `generate`, used for Batch API requests.
+        build_prompt: Renders a chunk of rows into the prompt, for Batch API requests.
+        format_item: Renders one row, to pack rows into requests by token budget.
+        array_key: Field of the response model holding the records, e.g. "flashcards".
+        model_id: Model whose tokenizer sizes the requests.
+        config: Hash of everything that shapes a card (see `agent_scope`); changing it
+            regenerates the whole deck.
+        postprocess: Enriches each chunk's records in place, e.g. with images.
+        response_cache: The cache behind `generate`, checked before Batch API requests.
+        cache_scope: Scope of the records in `response_cache` (see `run_cached`).
+        stream: Yields the records of a chunk as the model finishes each one, used instead
+            of `generate` when `stream_records` is set. Must be thread-safe.
+        media_store: The `MediaStore` holding the images `postprocess` stores, packed into
+            .apkg exports.
+    """
+
+    name: str
+    kind: str
+    record_type: Type[BaseModel]
+    key_fields: Sequence[str]
+    generate: Callable[[List[dict]], Sequence[BaseModel]]
+    agent: Any
+    build_prompt: Callable[[List[dict], int], str]
+    format_item: Callable[[dict], str]
+    array_key: str
+    model_id: str
+    config: str
+    postprocess: Optional[Callable[[List[BaseModel]], None]] = None
+    response_cache: Optional[ResponseStore] = None
+    cache_scope: str = ""
+    stream: Optional[Callable[[List[dict]], Iterable[BaseModel]]] = None
+    media_store: Optional[Any] = None
+
+    @property
+    def record_key_field(self) -> str:
+        return self.key_fields[0]
+
+
+def read_items(path: Union[str, Path], key_fields: Sequence[str]) -> List[dict]:
+    """Input rows of a deck (CSV with a header, XLSX, Parquet...), keeping only `key_fields`.
+
+    Rows with an empty first key field are skipped.
+    """
+    items = []
+    for batch in read_rows(path):
+        for row in batch:
+            item = {f: str(row.get(f) or "").strip() for f in key_fields}
+            if item[key_fields[0]]:
+                items.append(item)
+    return items
+
+
+def prepare_items(items: List[dict], key_fields: Sequence[str]) -> Tuple[List[dict], Optional[Embedder]]:
+    """Fold near-duplicate rows together when `dedupe_inputs` is set.
+
+    Returns:
+        Tuple: The rows to generate, and the embedder used (None when dedupe is off).
+    """
+    if not agent_settings.dedupe_inputs:
+        return items, None
+    # Near-duplicate rows are generated once; their meanings are merged into the first row
+    embedder = Embedder(cache=EmbeddingCache())
+    deduped = dedupe_items(items, key_fields=key_fields, embedder=embedder)
+    logger.info(f"Near-duplicate rows: {deduped.summary()}")
+    return deduped.items, embedder
+
+
+def generate_deck(spec: DeckSpec, items: List[dict], path: Union[str, Path]) -> Dict[str, int]:
+    """Bring the records stored in `<path>.index.sqlite` up to date with `items`.
+
+    Only rows that are new or changed since the last run go through the model (see
+    `DeckIndex`). Progress is checkpointed in `<path>.job.sqlite`, so an interrupted run
+    picks up where it stopped.
+
+    Returns:
+        Dict[str, int]: Row counts per status of this run's job.
+    """
+    # The deck index remembers what each row was last generated from, so only new or edited rows
+    # go through the model and rows deleted from the input drop out of the output
+    deck_index = DeckIndex(f"{path}.index.sqlite")
+    manifest = JobManifest(f"{path}.job.sqlite")
+    try:
+        diff = deck_index.update(items, key_fields=spec.key_fields, config=spec.config)
+        logger.info(f"Deck changes since the last run: {diff.summary()}")
+
+        # Cards are upserted into the deck tables as soon as each chunk is generated, so other workers can query them
+        db_sink = (
+            DbSink(spec.name, kind=spec.kind, key_fields=spec.key_fields)
+            if agent_settings.deck_database
+            else None
+        )
+        if db_sink is not None:
+            db_sink.delete([*diff.removed, *diff.renamed])
+
+        manifest.requeue(deck_index.pending(), key_fields=spec.key_fields)
+        # Rows are packed into each request up to a token budget that shrinks after truncated responses
+        packer = TokenPacker(spec.format_item, model_id=spec.model_id)
+        if agent_settings.batch_offline:
+            # Render every chunk into one Batch API file and wait for it instead of calling the model live
+            runner: Any = OfflineBatchRunner(
+                manifest,
+                spec.agent,
+                spec.build_prompt,
+                array_key=spec.array_key,
+                record_key_field=spec.record_key_field,
+                key_fields=spec.key_fields,
+                backend=OpenAIBatchBackend(),
+                packer=packer,
+                postprocess=spec.postprocess,
+                on_done=deck_index.store,
+                response_cache=spec.response_cache,
+                cache_scope=spec.cache_scope,
+                record_type=spec.record_type,
+            )
+        else:
+            runner = JobRunner(
+                manifest,
+                spec.generate,
+                record_key_field=spec.record_key_field,
+                key_fields=spec.key_fields,
+                packer=packer,
+                # Keep several chunks in flight; results still arrive in input order
+                scheduler_factory=lambda worker: ChunkScheduler.from_settings(
+                    worker,
+                    estimate_tokens=lambda chunk: packer.estimate_batch([state.item for state in chunk]),
+                ),
+                postprocess=spec.postprocess,
+                on_done=deck_index.store,
+                stream=spec.stream if agent_settings.stream_records else None,
+            )
+        counts = runner.run(db_sink)
+    finally:
+        manifest.close()
+        deck_index.close()
+    if counts.get("failed"):
+        logger.warning(f"{counts['failed']} {spec.kind} failed and keep their previous card, if any")
+    return counts
+
+
+def report_repeated_sentences(spec: DeckSpec, deck_file: Union[str, Path], embedder: Embedder) -> None:
+    records = [record for batch in iter_deck(deck_file, spec.record_type) for record in batch]
+    fields = ("example_sentences_1", "example_sentences_2")
+    for i, j, similarity in repeated_sentences(records, fields, embedder):
+        first = getattr(records[i], spec.record_key_field)
+        second = getattr(records[j], spec.record_key_field)
+        logger.info(f"Near-identical example sentences ({similarity:.2f}): {first} / {second}")
+
+
+def metrics_path(output_path: Union[str, Path]) -> Path:
+    """Where the metrics summary of the run that wrote `output_path` goes, e.g. n3.metrics.json."""
+    return Path(output_path).with_suffix(".metrics.json")
+
+
+def run_deck(spec: DeckSpec, input_path: Union[str, Path], output_path: Union[str, Path]) -> Dict[str, int]:
+    """Generate the deck of `input_path` and export it to `output_path`.
+
+    The cards are kept in a Parquet deck next to `output_path`, which is exported from it.
+    See `generate_deck` for what is regenerated. Latency, tokens, cost, retries and cache
+    hits of the run are summarized in `metrics_path(output_path)`.
+
+    Returns:
+        Dict[str, int]: Row counts per status of this run's job.
+    """
+    output_path = Path(output_path)
+    deck_file = deck_path(output_path)
+    started = metrics.snapshot()
+    items, embedder = prepare_items(read_items(input_path, spec.key_fields), spec.key_fields)
+    counts = generate_deck(spec, items, output_path)
+
+    # The output is rebuilt from the index, which holds the latest record of every row
+    deck_index = DeckIndex(f"{output_path}.index.sqlite")
+    try:
+        written = deck_index.export(deck_file, spec.record_type)
+    finally:
+        deck_index.close()
+    export_deck(deck_file, output_path, media_store=spec.media_store)
+    logger.info(f"{written} {spec.kind} saved to {deck_file} and exported to {output_path}")
+
+    if embedder is not None:
+        report_repeated_sentences(spec, deck_file, embedder)
+    summary = metrics.since(started).write_summary(
+        metrics_path(output_path), deck=spec.name, kind=spec.kind, counts=counts, written=written
+    )
+    logger.info(f"Slowest stage: {summary['hot_stage']}, estimated cost: ${summary['cost_usd']['total']}")
+    return counts
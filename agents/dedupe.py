@@ -0,0 +1,370 @@
+import hashlib
+import sqlite3
+import threading
+from dataclasses import dataclass, field
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+from agents.cache import normalize_text
+from agents.settings import agent_settings
+from utils.log import logger
+
+# Default location of the on-disk embedding cache
+DEFAULT_EMBEDDING_CACHE_PATH = Path(__file__).parent.parent / "data" / "cache" / "embeddings.sqlite"
+
+# (i, j, cosine similarity) with i < j
+Pair = Tuple[int, int, float]
+
+
+@lru_cache
+def _openai_client() -> Any:
+    from openai import OpenAI
+
+    return OpenAI()
+
+
+def openai_embed_fn(model_id: str) -> Callable[[List[str]], List[List[float]]]:
+    """Embed a list of strings in one request to the OpenAI embeddings endpoint."""
+
+    def embed(texts: List[str]) -> List[List[float]]:
+        response = _openai_client().embeddings.create(model=model_id, input=texts)
+        return [d.embedding for d in sorted(response.data, key=lambda d: d.index)]
+
+    return embed
+
+
+class EmbeddingCache:
+    """Persistent SQLite cache of embeddings, keyed by model and normalized text.
+
+    Vectors are stored as float32 bytes, so a string is embedded once per model however
+    many decks or runs it appears in.
+    """
+
+    def __init__(self, path: Union[str, Path, None] = None):
+        self.path = Path(path) if path is not None else DEFAULT_EMBEDDING_CACHE_PATH
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        if str(self.path) != ":memory:":
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL)"
+        )
+        self._conn.commit()
+
+    @staticmethod
+    def make_key(model: str, text: str) -> str:
+        return hashlib.sha256(f"{model}\x1f{normalize_text(text)}".encode("utf-8")).hexdigest()
+
+    def get_many(self, keys: Sequence[str], batch_size: int = 500) -> Dict[str, np.ndarray]:
+        found: Dict[str, np.ndarray] = {}
+        with self._lock:
+            for start in range(0, len(keys), batch_size):
+                batch = list(keys[start : start + batch_size])
+                placeholders = ",".join("?" for _ in batch)
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch
+                ).fetchall()
+                for key, vector in rows:
+                    found[key] = np.frombuffer(vector, dtype=np.float32)
+            self.hits += len(found)
+            self.misses += len(set(keys)) - len(found)
+        return found
+
+    def put_many(self, entries: Dict[str, np.ndarray]) -> None:
+        if not entries:
+            return
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)",
+                [(k, np.asarray(v, dtype=np.float32).tobytes()) for k, v in entries.items()],
+            )
+            self._conn.commit()
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hits / lookups if lookups else 0.0}
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+class Embedder:
+    """Batch embeds strings with `agent_settings.embedding_model`, through an `EmbeddingCache`.
+
+    Texts are deduplicated after normalization and only cache misses go to the API, in
+    requests of up to `batch_size` strings. Returned vectors have unit length, so a dot
+    product is their cosine similarity.
+
+    Args:
+        model_id: Embedding model, defaults to `agent_settings.embedding_model`.
+        cache: Where embeddings are kept between runs; in-memory only if not given.
+        batch_size: Strings per embeddings request.
+        embed_fn: Embeds a list of strings; defaults to the OpenAI embeddings endpoint.
+    """
+
+    def __init__(
+        self,
+        model_id: Optional[str] = None,
+        cache: Optional[EmbeddingCache] = None,
+        batch_size: int = 512,
+        embed_fn: Optional[Callable[[List[str]], List[List[float]]]] = None,
+    ):
+        self.model_id = model_id or agent_settings.embedding_model
+        self.cache = cache if cache is not None else EmbeddingCache(":memory:")
+        self.batch_size = batch_size
+        self.embed_fn = embed_fn or openai_embed_fn(self.model_id)
+        self.requests = 0
+
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        """Embed `texts` in order, as a `(len(texts), dim)` float32 array."""
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+        keys = [self.cache.make_key(self.model_id, t) for t in texts]
+        unique: Dict[str, str] = {}
+        for key, text in zip(keys, texts):
+            unique.setdefault(key, normalize_text(text))
+        vectors = self.cache.get_many(list(unique))
+
+        missing = [key for key in unique if key not in vectors]
+        for start in range(0, len(missing), self.batch_size):
+            batch = missing[start : start + self.batch_size]
+            embedded = np.asarray(self.embed_fn([unique[k] for k in batch]), dtype=np.float32)
+            self.requests += 1
+            embedded /= np.maximum(np.linalg.norm(embedded, axis=1, keepdims=True), 1e-12)
+            fresh = dict(zip(batch, embedded))
+            self.cache.put_many(fresh)
+            vectors.update(fresh)
+        return np.stack([vectors[key] for key in keys])
+
+
+class LshIndex:
+    """Approximate nearest-neighbor search with random hyperplane hashing.
+
+    Each of `tables` hash tables buckets vectors by the signs of `bits` random
+    projections. Only vectors that share a bucket in some table are compared, which
+    finds close pairs with high probability without comparing every pair. Below
+    `exact_below` vectors the full similarity matrix is cheaper and is used instead.
+    """
+
+    def __init__(self, bits: int = 12, tables: int = 8, exact_below: int = 2048, seed: int = 0):
+        self.bits = bits
+        self.tables = tables
+        self.exact_below = exact_below
+        self.seed = seed
+
+    def pairs(self, vectors: np.ndarray, threshold: float) -> List[Pair]:
+        """Pairs of rows of `vectors` (unit length) with a cosine similarity of at least `threshold`."""
+        n = len(vectors)
+        if n < 2:
+            return []
+        if n < self.exact_below:
+            similarity = vectors @ vectors.T
+            i, j = np.nonzero(np.triu(similarity >= threshold, k=1))
+            return [(int(a), int(b), float(similarity[a, b])) for a, b in zip(i, j)]
+
+        rng = np.random.default_rng(self.seed)
+        planes = rng.standard_normal((self.tables, vectors.shape[1], self.bits)).astype(np.float32)
+        weights = 1 << np.arange(self.bits)
+        candidates = set()
+        for table in planes:
+            codes = ((vectors @ table) > 0) @ weights
+            order = np.argsort(codes, kind="stable")
+            boundaries = np.flatnonzero(np.diff(codes[order])) + 1
+            for bucket in np.split(order, boundaries):
+                if len(bucket) > 1:
+                    bucket = np.sort(bucket)
+                    for a in range(len(bucket)):
+                        for b in range(a + 1, len(bucket)):
+                            candidates.add((int(bucket[a]), int(bucket[b])))
+        if not candidates:
+            return []
+        pairs = np.array(sorted(candidates))
+        similarity = np.einsum("ij,ij->i", vectors[pairs[:, 0]], vectors[pairs[:, 1]])
+        keep = similarity >= threshold
+        return [(int(a), int(b), float(s)) for (a, b), s in zip(pairs[keep], similarity[keep])]
+
+
+class PgVectorIndex:
+    """Nearest-neighbor search in Postgres with pgvector's HNSW index.
+
+    Vectors are loaded into a temporary table on one connection, indexed with
+    `vector_cosine_ops`, and every row's neighbors are found in a single lateral join.
+    Suited to inputs too large to hold comfortably in the worker.
+    """
+
+    def __init__(self, engine: Optional[Any] = None, neighbors: int = 8, ef_search: int = 64):
+        if engine is None:
+            from db.session import get_db_engine
+
+            engine = get_db_engine()
+        self.engine = engine
+        self.neighbors = neighbors
+        self.ef_search = ef_search
+
+    def pairs(self, vectors: np.ndarray, threshold: float) -> List[Pair]:
+        from sqlalchemy import text
+
+        if len(vectors) < 2:
+            return []
+        dim = vectors.shape[1]
+        with self.engine.begin() as conn:
+            conn.execute(
+                text(
+                    f"CREATE TEMP TABLE dedupe_vectors (pos integer PRIMARY KEY, embedding vector({dim})) ON COMMIT DROP"
+                )
+            )
+            conn.execute(
+                text("INSERT INTO dedupe_vectors (pos, embedding) VALUES (:pos, CAST(:embedding AS vector))"),
+                [{"pos": i, "embedding": str(v.tolist())} for i, v in enumerate(vectors)],
+            )
+            conn.execute(text("CREATE INDEX ON dedupe_vectors USING hnsw (embedding vector_cosine_ops)"))
+            conn.execute(text(f"SET LOCAL hnsw.ef_search = {int(self.ef_search)}"))
+            rows = conn.execute(
+                text(
+                    "SELECT a.pos, n.pos, 1 - n.distance FROM dedupe_vectors a CROSS JOIN LATERAL ("
+                    "  SELECT b.pos, a.embedding <=> b.embedding AS distance FROM dedupe_vectors b"
+                    "  WHERE b.pos <> a.pos ORDER BY a.embedding <=> b.embedding LIMIT :k"
+                    ") n WHERE n.distance <= :max_distance AND a.pos < n.pos"
+                ),
+                {"k": self.neighbors, "max_distance": 1 - threshold},
+            ).all()
+        return [(int(a), int(b), float(s)) for a, b, s in rows]
+
+
+def group_pairs(n: int, pairs: Sequence[Pair]) -> List[List[int]]:
+    """Connected groups of near-duplicates, each sorted, ordered by their first member."""
+    parent = list(range(n))
+
+    def find(i: int) -> int:
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for a, b, _ in pairs:
+        ra, rb = find(a), find(b)
+        if ra != rb:
+            parent[max(ra, rb)] = min(ra, rb)
+    groups: Dict[int, List[int]] = {}
+    for i in range(n):
+        groups.setdefault(find(i), []).append(i)
+    return [members for members in groups.values() if len(members) > 1]
+
+
+@dataclass
+class DedupeResult:
+    """Outcome of `dedupe_items`: the rows to generate and what happened to the others."""
+
+    items: List[dict]
+    # Key of each kept row -> rows folded into it
+    merged: Dict[str, List[dict]] = field(default_factory=dict)
+    # Rows dropped because a reference row already covers them
+    skipped: List[dict] = field(default_factory=list)
+
+    def summary(self) -> str:
+        folded = sum(len(rows) for rows in self.merged.values())
+        return f"{len(self.items)} kept, {folded} merged, {len(self.skipped)} skipped"
+
+
+def item_text(item: dict, key_fields: Sequence[str]) -> str:
+    return " | ".join(str(item[f]) for f in key_fields)
+
+
+def dedupe_items(
+    items: Sequence[dict],
+    key_fields: Sequence[str],
+    embedder: Embedder,
+    threshold: Optional[float] = None,
+    reference: Sequence[dict] = (),
+    index: Optional[Any] = None,
+) -> DedupeResult:
+    """Fold near-duplicate input rows together before generation.
+
+    Rows are compared by the embedding of their key fields (e.g. word and meaning). In each
+    group of near-duplicates the first row is kept and the distinct meanings of the others
+    are appended to it. Rows close to any `reference` row, e.g. a deck that was already
+    generated, are skipped altogether.
+
+    Args:
+        items: Input rows, in order.
+        key_fields: Fields compared, the first one identifying the row.
+        embedder: Embeds the rows, through its cache.
+        threshold: Minimum cosine similarity of near-duplicates, defaults to `agent_settings.dedupe_threshold`.
+        reference: Rows already covered elsewhere.
+        index: `LshIndex` (default) or `PgVectorIndex`.
+    """
+    threshold = threshold if threshold is not None else agent_settings.dedupe_threshold
+    index = index or LshIndex()
+    rows = list(reference) + list(items)
+    if not items:
+        return DedupeResult(items=[])
+    vectors = embedder.embed([item_text(row, key_fields) for row in rows])
+    offset = len(reference)
+
+    dropped = set()
+    result = DedupeResult(items=[])
+    kept_meanings: Dict[int, List[str]] = {}
+    for group in group_pairs(len(rows), index.pairs(vectors, threshold)):
+        if group[0] < offset:
+            result.skipped.extend(rows[i] for i in group if i >= offset)
+            dropped.update(group)
+            continue
+        keeper, others = group[0], group[1:]
+        result.merged[str(rows[keeper][key_fields[0]])] = [rows[i] for i in others]
+        dropped.update(others)
+        if len(key_fields) > 1:
+            meaning_field = key_fields[1]
+            meanings = kept_meanings.setdefault(keeper, [str(rows[keeper][meaning_field])])
+            for i in others:
+                meaning = str(rows[i][meaning_field])
+                if normalize_text(meaning) not in {normalize_text(m) for m in meanings}:
+                    meanings.append(meaning)
+
+    for i in range(offset, len(rows)):
+        if i in dropped:
+            continue
+        row = dict(rows[i])
+        if i in kept_meanings and len(key_fields) > 1:
+            row[key_fields[1]] = "; ".join(kept_meanings[i])
+        result.items.append(row)
+    logger.debug(f"Dedupe: {result.summary()}, embedding cache {embedder.cache.stats()}")
+    return result
+
+
+def repeated_sentences(
+    records: Sequence[Any],
+    fields: Sequence[str],
+    embedder: Embedder,
+    threshold: Optional[float] = None,
+    index: Optional[Any] = None,
+) -> List[Pair]:
+    """Pairs of records whose example sentences are near-identical, as `(i, j, similarity)`.
+
+    Every sentence of every record is compared with the sentences of the other records;
+    the later record of each pair is the one to regenerate.
+    """
+    threshold = threshold if threshold is not None else agent_settings.dedupe_threshold
+    index = index or LshIndex()
+    owners, sentences = [], []
+    for position, record in enumerate(records):
+        row = record.model_dump() if hasattr(record, "model_dump") else record
+        for f in fields:
+            if row.get(f):
+                owners.append(position)
+                sentences.append(row[f])
+    if len(sentences) < 2:
+        return []
+    best: Dict[Tuple[int, int], float] = {}
+    for a, b, similarity in index.pairs(embedder.embed(sentences), threshold):
+        i, j = owners[a], owners[b]
+        if i != j:
+            key = (min(i, j), max(i, j))
+            best[key] = max(best.get(key, 0.0), similarity)
+    return sorted((i, j, s) for (i, j), s in best.items())
@@ -1,3 +1,4 @@
+from functools import lru_cache
 from typing import Optional
 
 from phi.agent import Agent
@@ -5,15 +6,27 @@ from phi.model.openai import OpenAIChat
 from phi.knowledge.agent import AgentKnowledge
 from phi.storage.agent.postgres import PgAgentStorage
 from phi.tools.duckduckgo import DuckDuckGo
-from phi.vectordb.pgvector import PgVector, SearchType
+from phi.vectordb.pgvector import SearchType
 
+from agents.knowledge import TunedPgVector
 from agents.settings import agent_settings
-from db.session import db_url
+from db.session import get_db_engine
 
-example_agent_storage = PgAgentStorage(table_name="example_agent_sessions", db_url=db_url)
-example_agent_knowledge = AgentKnowledge(
-    vector_db=PgVector(table_name="example_agent_knowledge", db_url=db_url, search_type=SearchType.hybrid)
-)
+
+@lru_cache
+def get_example_agent_storage() -> PgAgentStorage:
+    # Share the process-wide pool instead of letting phi open a separate engine
+    return PgAgentStorage(table_name="example_agent_sessions", db_engine=get_db_engine())
+
+
+@lru_cache
+def get_example_agent_knowledge() -> AgentKnowledge:
+    # Hybrid search through the configured HNSW/IVFFlat and tsvector indexes, with per-worker query caches
+    return AgentKnowledge(
+        vector_db=TunedPgVector(
+            table_name="example_agent_knowledge", db_engine=get_db_engine(), search_type=SearchType.hybrid
+        )
+    )
 
 
 def get_example_agent(
@@ -60,11 +73,11 @@ def get_example_agent(
         # Add the current date and time to the instructions
         add_datetime_to_instructions=True,
         # Store agent sessions in the database
-        storage=example_agent_storage,
+        storage=get_example_agent_storage(),
         # Enable read the chat history from the database
         read_chat_history=True,
         # Store knowledge in a vector database
-        knowledge=example_agent_knowledge,
+        knowledge=get_example_agent_knowledge(),
         # Enable searching the knowledge base
         search_knowledge=True,
         # Enable monitoring on phidata.app
@@ -1,17 +1,23 @@
 import os
-from typing import Optional
-from pydantic import Field
+import threading
+from typing import Any, Optional, cast
+from pydantic import Field, PrivateAttr
 
 from phi.agent import Agent, RunResponse
-from phi.utils.pprint import pprint_run_response
 from phi.model.openai import OpenAIChat
 
 
+from agents.cache import BaseResponseCache, agent_scope, open_response_cache, run_cached, stream_cached
+from agents.chunking import IncompleteResponseError
+from agents.deck_runner import DeckSpec, run_deck
+from agents.singleflight import SingleFlight, SingleFlightAgent
 from agents.settings import agent_settings
+from agents.streaming import stream_structured
 from pydantic import BaseModel, Field
-import pandas as pd
-from tools.search_image import get_images_for_word
+from tools.media_store import MediaStore
+from tools.search_image import get_images_for_words
 from typing import Iterator
+from utils.metrics import metrics, record_run_usage
 
 
 class Flashcard(BaseModel):
@@ -26,16 +32,49 @@ class Flashcard(BaseModel):
 class FlashcardList(BaseModel):
   flashcards: list[Flashcard] = Field(..., description="List of flashcards")
 
+PROMPT_HEADER = "Please generate 2 example sentences for each word and its meaning at Vietnamese"
+
+
+def format_word(word: dict, number: int = 1) -> str:
+    return f"{number}. Word: {word['word']} - Meaning: {word['meaning']}\n"
+
+
+def build_prompt(chunk: list[dict], offset: int = 0) -> str:
+    return PROMPT_HEADER + "".join(format_word(word, offset + j + 1) for j, word in enumerate(chunk))
+
+
+def attach_images(flashcards: list[Flashcard], media_store: Optional[MediaStore] = None) -> None:
+    """Set `image_url` on each flashcard to the first image found for its word, searching in parallel.
+
+    With a `media_store`, the images are downloaded as thumbnails and `image_url` becomes the local media name.
+    """
+    images = get_images_for_words([f.word for f in flashcards], num_images=1)
+    for flashcard in flashcards:
+        flashcard.image_url = next(iter(images.get(flashcard.word, [])), flashcard.image_url)
+    if media_store is not None:
+        media_store.localize(flashcards)
+
+
 class FlashcardGenerator(Agent):
     target_language: str = Field(default="English")
     native_language: str = Field(default="Vietnamese")
     related_sentence_agent: Agent = Field(default=None)
-
-    def __init__(self, target_language: str = "English", native_language: str = "Vietnamese"):
-      super().__init__()
+    response_cache: Optional[BaseResponseCache] = Field(default=None)
+    _thread_agents: Any = PrivateAttr(default_factory=threading.local)
+    _singleflight: SingleFlight = PrivateAttr(default_factory=SingleFlight)
+
+    def __init__(
+      self,
+      target_language: str = "English",
+      native_language: str = "Vietnamese",
+      response_cache: Optional[BaseResponseCache] = None,
+      debug_mode: bool = False,
+    ):
+      super().__init__(debug_mode=debug_mode)
       self.target_language = target_language
       self.native_language = native_language
-      self.related_sentence_agent = Agent(
+      self.response_cache = response_cache
+      self.related_sentence_agent = SingleFlightAgent(
         name="Related Sentence generator Agent",
         agent_id="related_sentence_generator",
         model=OpenAIChat(
@@ -60,92 +99,133 @@ class FlashcardGenerator(Agent):
           "9. For each example sentence, provide its translation in the native language on the next line",
           "10. Return only the example sentences {self.target_language} and their translations {self.native_language}, without any additional explanations",
         ],
-        debug=True,
+        debug_mode=debug_mode,
         response_model=FlashcardList,
         structured_outputs=True,
       )
 
-    def run(self, word: str):
+    def run(self, word: str) -> RunResponse:
+        """Generate flashcards for a word. Safe to call from several threads.
+
+        Concurrent calls for the same normalized word and language pair share one model call
+        and all receive the same (read-only) response. Results are kept in `response_cache`,
+        so with a `PgResponseCache` every worker serves words another worker already generated.
+        """
+        key = BaseResponseCache.make_key(
+          agent_scope(self.related_sentence_agent), self.target_language, self.native_language, word
+        )
+        with metrics.time("flashcards.run"):
+            return self._singleflight.do(key, lambda: self._run_word(key, word))
+
+    def _run_word(self, key: str, word: str) -> RunResponse:
+        if self.response_cache is not None:
+            cached = self.response_cache.get_many([key], FlashcardList).get(key)
+            metrics.record_cache("responses", hits=int(cached is not None), misses=int(cached is None))
+            if cached is not None:
+                return RunResponse(
+                    content=cached, content_type=FlashcardList.__name__, agent_id=self.related_sentence_agent.agent_id
+                )
         # self.related_sentence_agent.print_response(word, stream=True)
-        return self.related_sentence_agent.run(word, stream=True)
-    
+        # With a response_model, phi returns a single RunResponse even when streaming
+        response = cast(RunResponse, self._agent_for_thread().run(word, stream=True))
+        record_run_usage(getattr(self.related_sentence_agent.model, "id", None), response)
+        if self.response_cache is not None and isinstance(response.content, FlashcardList):
+            self.response_cache.put_many({key: response.content})
+        return response
+
+    def _agent_for_thread(self) -> Agent:
+        # Agents keep per-run state, so each scheduler thread works on its own copy
+        agent = getattr(self._thread_agents, "agent", None)
+        if agent is None:
+            agent = self.related_sentence_agent.deep_copy()
+            self._thread_agents.agent = agent
+        return agent
+
+    def generate(self, chunk: list[dict], offset: int = 0) -> list[Flashcard]:
+        """Generate flashcards for a chunk of `{"word", "meaning"}` dicts. Safe to call from several threads.
+
+        Words already in `response_cache` are served from it; only the rest reach the model.
+        """
+        return run_cached(
+            self.response_cache,
+            agent_scope(self.related_sentence_agent, PROMPT_HEADER),
+            chunk,
+            key_fields=("word", "meaning"),
+            record_type=Flashcard,
+            record_key_field="word",
+            run=lambda items: self._generate(items, offset),
+            flight=self._singleflight,
+        )
+
+    def stream(self, chunk: list[dict], offset: int = 0) -> Iterator[Flashcard]:
+        """Yield flashcards for a chunk one at a time, as soon as each has been generated.
+
+        Cached ones come first, straight from `response_cache`; the rest are streamed from the
+        model and cached as they arrive, so downstream stages can start on the first card while
+        the rest are still being written.
+        """
+        return stream_cached(
+            self.response_cache,
+            agent_scope(self.related_sentence_agent, PROMPT_HEADER),
+            chunk,
+            key_fields=("word", "meaning"),
+            record_type=Flashcard,
+            record_key_field="word",
+            stream=lambda items: stream_structured(
+                self._agent_for_thread(), build_prompt(items, offset), "flashcards", Flashcard
+            ),
+        )
+
+    def _generate(self, chunk: list[dict], offset: int = 0) -> list[Flashcard]:
+        with metrics.time("flashcards.generate"):
+            response = cast(RunResponse, self._agent_for_thread().run(build_prompt(chunk, offset), stream=True))
+        record_run_usage(getattr(self.related_sentence_agent.model, "id", None), response)
+        if not isinstance(response.content, FlashcardList):
+            raise IncompleteResponseError(f"Response for {len(chunk)} words is not a valid FlashcardList")
+        return list(response.content.flashcards)
+
+
+def deck_spec(
+    name: str,
+    target_language: str = "Japanese",
+    native_language: str = "Vietnamese",
+    response_cache: Optional[BaseResponseCache] = None,
+) -> DeckSpec:
+    """Flashcard deck `name` for one language pair, for `run_deck` or the sharded runner (agents/sharding.py)."""
+    flashcard_generator = FlashcardGenerator(
+        target_language=target_language, native_language=native_language, response_cache=response_cache
+    )
+    # Images are stored locally as thumbnails so the deck does not depend on remote URLs
+    media_store = MediaStore() if agent_settings.flashcard_images else None
+    config = agent_scope(flashcard_generator.related_sentence_agent, PROMPT_HEADER)
+    return DeckSpec(
+        name=name,
+        kind="flashcards",
+        record_type=Flashcard,
+        key_fields=("word", "meaning"),
+        generate=flashcard_generator.generate,
+        stream=flashcard_generator.stream,
+        agent=flashcard_generator.related_sentence_agent,
+        build_prompt=build_prompt,
+        format_item=format_word,
+        array_key="flashcards",
+        model_id=agent_settings.gpt_4o_mini,
+        config=f"{config}:images={agent_settings.flashcard_images}",
+        postprocess=(
+            (lambda cards: attach_images(cast(list[Flashcard], cards), media_store))
+            if media_store is not None
+            else None
+        ),
+        response_cache=response_cache,
+        cache_scope=config,
+        media_store=media_store,
+    )
+
 
 if __name__ == "__main__":
-    try:
-        flashcard_generator = FlashcardGenerator(target_language="Japanese", native_language="Vietnamese")
-        # Read words from csv file
-        with open(f"{os.path.dirname(os.path.abspath(__file__))}/../data/new-grammar.csv", "r") as file:
-            words = file.read().splitlines()
-            words = [word.split(",") for word in words]
-            words = [{"word": word[0], "meaning": word[1]} for word in words]
-
-        # Split words into chunks of 10
-        chunks = [words[i:i+10] for i in range(0, len(words), 10)]
-        
-        # Create DataFrame to store all flashcards
-        output_path = f"{os.path.dirname(os.path.abspath(__file__))}/../data/new-grammar.xlsx"
-        
-        # Check if file exists and read existing data
-        if os.path.exists(output_path):
-            existing_df = pd.read_excel(output_path)
-        else:
-            existing_df = pd.DataFrame()
-
-        for i, chunk in enumerate(chunks):
-            try:
-                chunk_flashcards: list[Flashcard] = []
-                prompt = "Please generate 2 example sentences for each word and its meaning at Vietnamese"
-                for j, word in enumerate(chunk):
-                    prompt += f"{i*10 + j + 1}. Word: {word['word']} - Meaning: {word['meaning']}\n"
-                response: Iterator[RunResponse] = flashcard_generator.run(prompt)
-                pprint_run_response(response, markdown=True, show_time=True)
-                
-                # Add flashcards from response to the chunk list
-                if hasattr(response.content, 'flashcards'):
-                    chunk_flashcards.extend(response.content.flashcards)
-                
-                # Get image for each flashcard in the chunk
-                # for flashcard in chunk_flashcards:
-                #     flashcard.image_url = get_images_for_word(flashcard.word)[0]
-                #     print(flashcard.image_url)
-
-                # Convert chunk to DataFrame
-                chunk_df = pd.DataFrame([{
-                    'word': f.word,
-                    'meaning': f.meaning,
-                    'example_sentences_1': f.example_sentences_1,
-                    'meaning_example_sentences_1': f.meaning_example_sentences_1,
-                    'example_sentences_2': f.example_sentences_2,
-                    'meaning_example_sentences_2': f.meaning_example_sentences_2,
-                    'image_url': f.image_url
-                } for f in chunk_flashcards])
-                
-                # Concatenate with existing data and save
-                if existing_df.empty:
-                    chunk_df.to_excel(output_path, index=False)
-                else:
-                    updated_df = pd.concat([existing_df, chunk_df], ignore_index=True)
-                    updated_df.to_excel(output_path, index=False)
-                
-                # Update existing_df for next iteration
-                existing_df = pd.read_excel(output_path)
-                print(f"Chunk {i+1} saved to {output_path}")
-
-            except Exception as e:
-                print(f"Error processing chunk {i+1}: {str(e)}")
-                # Đóng file Excel nếu có lỗi xảy ra trong quá trình xử lý chunk
-                if 'updated_df' in locals():
-                    del updated_df
-                if 'existing_df' in locals():
-                    del existing_df
-                raise  # Ném lại lỗi để dừng chương trình
-
-        print(f"All flashcards saved to {output_path}")
-
-    except Exception as e:
-        print(f"An error occurred: {str(e)}")
-        # Đảm bảo giải phóng tất cả tài nguyên Excel
-        if 'updated_df' in locals():
-            del updated_df
-        if 'existing_df' in locals():
-            del existing_df
+    data_dir = f"{os.path.dirname(os.path.abspath(__file__))}/../data"
+    response_cache = open_response_cache()
+    spec = deck_spec("new-grammar", response_cache=response_cache)
+    counts = run_deck(spec, f"{data_dir}/new-grammar.csv", f"{data_dir}/new-grammar.xlsx")
+    print(f"Flashcards: {counts}")
+    print(f"Response cache: {response_cache.stats()}")
@@ -1,15 +1,20 @@
 import os
-from typing import Optional
-from pydantic import Field
+import threading
+from typing import Any, Optional, cast
+from pydantic import Field, PrivateAttr
 
 from phi.agent import Agent, RunResponse
-from phi.utils.pprint import pprint_run_response
 from phi.model.openai import OpenAIChat
 
+from agents.cache import BaseResponseCache, agent_scope, open_response_cache, run_cached, stream_cached
+from agents.chunking import IncompleteResponseError
+from agents.deck_runner import DeckSpec, run_deck
 from agents.settings import agent_settings
+from agents.singleflight import SingleFlight, SingleFlightAgent
+from agents.streaming import stream_structured
 from pydantic import BaseModel, Field
-import pandas as pd
 from typing import Iterator
+from utils.metrics import metrics, record_run_usage
 
 
 class Grammar(BaseModel):
@@ -24,18 +29,37 @@ class Grammar(BaseModel):
 class GrammarList(BaseModel):
   grammars: list[Grammar] = Field(..., description="List of grammars")
 
+
+def format_grammar(grammar: dict, number: int = 1) -> str:
+    return f"{number}. Grammar: {grammar['grammar']}, Meaning need to rewrite: {grammar['meaning']}\n"
+
+
+def build_prompt(chunk: list[dict], offset: int = 0) -> str:
+    return "".join(format_grammar(grammar, offset + j + 1) for j, grammar in enumerate(chunk))
+
+
 class GrammarGenerator(Agent):
     target_language: str = Field(default="English")
     native_language: str = Field(default="Vietnamese")
     grammar_agent: Agent = Field(default=None)
+    response_cache: Optional[BaseResponseCache] = Field(default=None)
+    _thread_agents: Any = PrivateAttr(default_factory=threading.local)
+    _singleflight: SingleFlight = PrivateAttr(default_factory=SingleFlight)
 
-    def __init__(self, target_language: str = "English", native_language: str = "Vietnamese"):
-      super().__init__()
+    def __init__(
+      self,
+      target_language: str = "English",
+      native_language: str = "Vietnamese",
+      response_cache: Optional[BaseResponseCache] = None,
+      debug_mode: bool = False,
+    ):
+      super().__init__(debug_mode=debug_mode)
       self.target_language = target_language
       self.native_language = native_language
-      self.grammar_agent = Agent(
-        name="Related Sentence generator Agent",
-        agent_id="related_sentence_generator",
+      self.response_cache = response_cache
+      self.grammar_agent = SingleFlightAgent(
+        name="Grammar generator Agent",
+        agent_id="grammar_generator",
         model=OpenAIChat(
           id=agent_settings.gpt_4,
           max_tokens=agent_settings.default_max_completion_tokens,
@@ -57,67 +81,102 @@ class GrammarGenerator(Agent):
           "7. For each example sentence, provide its translation in the native language on the next line",
           "8. Return only the example sentences and their translations, without any additional explanations",
         ],
-        debug=True,
+        debug_mode=debug_mode,
         response_model=GrammarList,
         structured_outputs=True,
       )
 
     def run(self, word: str):
-        return self.grammar_agent.run(word, stream=True)
+        with metrics.time("grammars.run"):
+            response = self.grammar_agent.run(word, stream=True)
+        record_run_usage(getattr(self.grammar_agent.model, "id", None), response)
+        return response
         # self.grammar_agent.print_response(word, stream=True)
-    
+
+    def _agent_for_thread(self) -> Agent:
+        # Agents keep per-run state, so each thread works on its own copy
+        agent = getattr(self._thread_agents, "agent", None)
+        if agent is None:
+            agent = self.grammar_agent.deep_copy()
+            self._thread_agents.agent = agent
+        return agent
+
+    def generate(self, chunk: list[dict], offset: int = 0) -> list[Grammar]:
+        """Generate grammar cards for a chunk of `{"grammar", "meaning"}` dicts.
+
+        Grammars already in `response_cache` are served from it; only the rest reach the model.
+        """
+        return run_cached(
+            self.response_cache,
+            agent_scope(self.grammar_agent),
+            chunk,
+            key_fields=("grammar", "meaning"),
+            record_type=Grammar,
+            record_key_field="grammar",
+            run=lambda items: self._generate(items, offset),
+            flight=self._singleflight,
+        )
+
+    def stream(self, chunk: list[dict], offset: int = 0) -> Iterator[Grammar]:
+        """Yield grammar cards for a chunk one at a time, as soon as each has been generated.
+
+        Cached ones come first, straight from `response_cache`; the rest are streamed from the
+        model and cached as they arrive, so downstream stages can start on the first card while
+        the rest are still being written.
+        """
+        return stream_cached(
+            self.response_cache,
+            agent_scope(self.grammar_agent),
+            chunk,
+            key_fields=("grammar", "meaning"),
+            record_type=Grammar,
+            record_key_field="grammar",
+            stream=lambda items: stream_structured(
+                self._agent_for_thread(), build_prompt(items, offset), "grammars", Grammar
+            ),
+        )
+
+    def _generate(self, chunk: list[dict], offset: int = 0) -> list[Grammar]:
+        with metrics.time("grammars.generate"):
+            response = cast(RunResponse, self._agent_for_thread().run(build_prompt(chunk, offset), stream=True))
+        record_run_usage(getattr(self.grammar_agent.model, "id", None), response)
+        if not isinstance(response.content, GrammarList):
+            raise IncompleteResponseError(f"Response for {len(chunk)} grammars is not a valid GrammarList")
+        return list(response.content.grammars)
+
+
+def deck_spec(
+    name: str,
+    target_language: str = "Japanese",
+    native_language: str = "Vietnamese",
+    response_cache: Optional[BaseResponseCache] = None,
+) -> DeckSpec:
+    """Grammar deck `name` for one language pair, for `run_deck` or the sharded runner (agents/sharding.py)."""
+    grammar_generator = GrammarGenerator(
+        target_language=target_language, native_language=native_language, response_cache=response_cache
+    )
+    return DeckSpec(
+        name=name,
+        kind="grammars",
+        record_type=Grammar,
+        key_fields=("grammar", "meaning"),
+        generate=grammar_generator.generate,
+        stream=grammar_generator.stream,
+        agent=grammar_generator.grammar_agent,
+        build_prompt=build_prompt,
+        format_item=format_grammar,
+        array_key="grammars",
+        model_id=agent_settings.gpt_4,
+        config=agent_scope(grammar_generator.grammar_agent),
+        response_cache=response_cache,
+        cache_scope=agent_scope(grammar_generator.grammar_agent),
+    )
+
 
 if __name__ == "__main__":
-    grammar_generator = GrammarGenerator(target_language="Japanese", native_language="Vietnamese")
-    # Read words from csv file
-    with open(f"{os.path.dirname(os.path.abspath(__file__))}/../data/grammars_input.csv", "r") as file:
-        grammars = file.read().splitlines()
-        grammars = [grammar.split(",") for grammar in grammars]
-        grammars = [{"grammar": grammar[0], "meaning": grammar[1]} for grammar in grammars]
-
-    # Split words into chunks of 10
-    chunks = [grammars[i:i+10] for i in range(0, len(grammars), 10)]
-    
-    # Create DataFrame to store all flashcards
-    output_path = f"{os.path.dirname(os.path.abspath(__file__))}/../data/grammars_output.csv"
-    
-    # Check if file exists and read existing data
-    if os.path.exists(output_path):
-        existing_df = pd.read_csv(output_path)
-    else:
-        existing_df = pd.DataFrame()
-
-    for i, chunk in enumerate(chunks):
-        try:
-            chunk_grammars: list[Grammar] = []
-            prompt = ""
-            for j, grammar in enumerate(chunk):
-                prompt += f"{i*10 + j + 1}. Grammar: {grammar['grammar']}, Meaning need to rewrite: {grammar['meaning']}\n"
-            response: Iterator[RunResponse] = grammar_generator.run(prompt)
-            pprint_run_response(response, markdown=True, show_time=True)
-
-            # Add grammars from response to the chunk list
-            if hasattr(response.content, 'grammars'):
-                chunk_grammars.extend(response.content.grammars)
-
-            # Convert chunk to DataFrame
-            chunk_df = pd.DataFrame([{
-                'grammar': f.grammar,
-                'meaning': f.meaning,
-                'example_sentences_1': f.example_sentences_1,
-                'meaning_example_sentences_1': f.meaning_example_sentences_1,
-                'example_sentences_2': f.example_sentences_2,
-                'meaning_example_sentences_2': f.meaning_example_sentences_2,
-                'image_url': f.image_url
-            } for f in chunk_grammars])
-            
-            # Concatenate with existing data and save
-            if existing_df.empty:
-                chunk_df.to_csv(output_path, index=False)
-                existing_df = chunk_df
-            else:
-                updated_df = pd.concat([existing_df, chunk_df], ignore_index=True)
-                updated_df.to_csv(output_path, index=False)
-                existing_df = updated_df
-        except Exception as e:
-            print(f"Error processing chunk {i}: {e}")
\ No newline at end of file
+    data_dir = f"{os.path.dirname(os.path.abspath(__file__))}/../data"
+    response_cache = open_response_cache()
+    spec = deck_spec("grammars_output", response_cache=response_cache)
+    counts = run_deck(spec, f"{data_dir}/grammars_input.csv", f"{data_dir}/grammars_output.csv")
+    print(f"Grammars: {counts}")
+    print(f"Response cache: {response_cache.stats()}")
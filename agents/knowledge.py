@@ -0,0 +1,326 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, List, Optional, Tuple, Union
+
+from phi.document import Document
+from phi.vectordb.distance import Distance
+from phi.vectordb.pgvector import HNSW, Ivfflat, PgVector
+from sqlalchemy import (
+    Column,
+    Computed,
+    Index,
+    bindparam,
+    desc,
+    func,
+    inspect,
+    literal_column,
+    select,
+    text,
+    union,
+)
+from sqlalchemy.dialects.postgresql import TSVECTOR
+from sqlalchemy.schema import Table
+
+from agents.settings import agent_settings
+from utils.log import logger
+
+
+class QueryCache:
+    """Thread-safe LRU cache whose entries optionally expire after `ttl_seconds`."""
+
+    def __init__(self, maxsize: int, ttl_seconds: Optional[float] = None):
+        self.maxsize = maxsize
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                stored_at, value = entry
+                if self.ttl_seconds is None or time.monotonic() - stored_at <= self.ttl_seconds:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+            self.misses += 1
+            return default
+
+    def put(self, key: Hashable, value: Any) -> None:
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+def vector_index_from_settings() -> Union[HNSW, Ivfflat]:
+    """The vector index configured by the `knowledge_*` agent settings."""
+    if agent_settings.knowledge_index == "ivfflat":
+        return Ivfflat(
+            lists=agent_settings.knowledge_ivfflat_lists,
+            probes=agent_settings.knowledge_ivfflat_probes,
+            dynamic_lists=False,
+        )
+    if agent_settings.knowledge_index == "hnsw":
+        return HNSW(
+            m=agent_settings.knowledge_hnsw_m,
+            ef_construction=agent_settings.knowledge_hnsw_ef_construction,
+            ef_search=agent_settings.knowledge_ef_search,
+        )
+    raise ValueError(f"Unsupported knowledge index: {agent_settings.knowledge_index}")
+
+
+class TunedPgVector(PgVector):
+    """`PgVector` whose searches are served by its indexes and cached in memory.
+
+    - The keyword half of hybrid search reads a stored `content_tsv` column through a GIN
+      index, instead of computing `to_tsvector` for every row on every query. Tables
+      created before the column existed get it on `create` or on their first search.
+    - Hybrid search re-ranks only the top `candidates` rows of the vector index and of the
+      keyword index, so the HNSW/IVFFlat index is used rather than a full scan.
+    - Query embeddings and search results are kept in LRU caches; results expire after
+      `result_ttl_seconds` and are dropped whenever documents are written.
+
+    Args:
+        candidates: Rows taken from each index before hybrid re-ranking.
+        query_cache_size: Entries of each of the embedding and result caches.
+        result_ttl_seconds: Lifetime of a cached search result.
+        **kwargs: Passed to `PgVector`; `vector_index` defaults to `vector_index_from_settings()`.
+    """
+
+    def __init__(
+        self,
+        *args,
+        candidates: Optional[int] = None,
+        query_cache_size: Optional[int] = None,
+        result_ttl_seconds: Optional[float] = None,
+        **kwargs,
+    ):
+        kwargs.setdefault("vector_index", vector_index_from_settings())
+        super().__init__(*args, **kwargs)
+        self.candidates = candidates or agent_settings.knowledge_search_candidates
+        cache_size = (
+            query_cache_size if query_cache_size is not None else agent_settings.knowledge_query_cache_size
+        )
+        self.embedding_cache = QueryCache(cache_size)
+        self.result_cache = QueryCache(
+            cache_size,
+            ttl_seconds=(
+                result_ttl_seconds
+                if result_ttl_seconds is not None
+                else agent_settings.knowledge_result_cache_ttl_seconds
+            ),
+        )
+        self._tsv_ready = False
+        self._tsv_lock = threading.Lock()
+
+    @property
+    def tsv_expression(self) -> str:
+        return f"to_tsvector('{self.content_language}'::regconfig, coalesce(content, ''))"
+
+    def get_table_v1(self) -> Table:
+        table = super().get_table_v1()
+        if "content_tsv" not in table.c:
+            table.append_column(
+                Column("content_tsv", TSVECTOR, Computed(self.tsv_expression, persisted=True))
+            )
+            Index(f"idx_{self.table_name}_content_tsv", table.c.content_tsv, postgresql_using="gin")
+        return table
+
+    def _create_gin_index(self, force_recreate: bool = False) -> None:
+        """Add the stored tsvector column and its GIN index to tables created before they existed."""
+        index_name = f"idx_{self.table_name}_content_tsv"
+        with self.Session() as sess, sess.begin():
+            sess.execute(
+                text(
+                    f"ALTER TABLE {self.table.fullname} ADD COLUMN IF NOT EXISTS content_tsv tsvector "
+                    f"GENERATED ALWAYS AS ({self.tsv_expression}) STORED"
+                )
+            )
+            if force_recreate:
+                sess.execute(text(f'DROP INDEX IF EXISTS {self.schema}."{index_name}"'))
+            sess.execute(
+                text(
+                    f'CREATE INDEX IF NOT EXISTS "{index_name}" ON {self.table.fullname} USING GIN (content_tsv)'
+                )
+            )
+
+    def _ensure_tsv_column(self) -> None:
+        """Add `content_tsv` and its index, once per process, if the table does not have them yet."""
+        if self._tsv_ready:
+            return
+        with self._tsv_lock:
+            if self._tsv_ready:
+                return
+            columns = inspect(self.db_engine).get_columns(self.table_name, schema=self.schema)
+            if "content_tsv" not in {column["name"] for column in columns}:
+                logger.info(f"Adding the content_tsv column to {self.table.fullname}")
+                self._create_gin_index()
+            self._tsv_ready = True
+
+    def create(self) -> None:
+        super().create()
+        self._ensure_tsv_column()
+
+    def query_embedding(self, query: str) -> Optional[List[float]]:
+        embedding = self.embedding_cache.get(query)
+        if embedding is None:
+            embedding = self.embedder.get_embedding(query)
+            if embedding is not None:
+                self.embedding_cache.put(query, embedding)
+        return embedding
+
+    def search(self, query: str, limit: int = 5, filters: Optional[Dict[str, Any]] = None) -> List[Document]:
+        key = (self.search_type.value, query, limit, json.dumps(filters, sort_keys=True, default=str))
+        documents = self.result_cache.get(key)
+        if documents is None:
+            documents = super().search(query=query, limit=limit, filters=filters)
+            # Failed searches return [] as well, so only non-empty results are kept
+            if documents:
+                self.result_cache.put(key, documents)
+        return list(documents)
+
+    def insert(self, *args, **kwargs) -> None:
+        super().insert(*args, **kwargs)
+        self.result_cache.clear()
+
+    def upsert(self, *args, **kwargs) -> None:
+        super().upsert(*args, **kwargs)
+        self.result_cache.clear()
+
+    def delete(self) -> bool:
+        deleted = super().delete()
+        self.result_cache.clear()
+        return deleted
+
+    def _columns(self) -> list:
+        # The embedding column is left out: callers only read the content
+        t = self.table.c
+        return [t.id, t.name, t.meta_data, t.content, t.usage]
+
+    def _distance(self, embedding: List[float]):
+        column = self.table.c.embedding
+        if self.distance == Distance.l2:
+            return column.l2_distance(embedding)
+        if self.distance == Distance.max_inner_product:
+            return column.max_inner_product(embedding)
+        return column.cosine_distance(embedding)
+
+    def _vector_score(self, embedding: List[float]):
+        # Same scale as PgVector.hybrid_search, so vector_score_weight keeps its meaning
+        if self.distance == Distance.max_inner_product:
+            return (self.table.c.embedding.max_inner_product(embedding) + 1) / 2
+        return 1 / (1 + self._distance(embedding))
+
+    def _ts_query(self, query: str):
+        processed = self.enable_prefix_matching(query) if self.prefix_match else query
+        return func.websearch_to_tsquery(
+            literal_column(f"'{self.content_language}'::regconfig"), bindparam("query", value=processed)
+        )
+
+    def _filtered(self, stmt, filters: Optional[Dict[str, Any]]):
+        return stmt.where(self.table.c.filters.contains(filters)) if filters is not None else stmt
+
+    def _execute(self, stmt, kind: str) -> List[Document]:
+        logger.debug(f"{kind} search query: {stmt}")
+        try:
+            self._ensure_tsv_column()
+            with self.Session() as sess, sess.begin():
+                if isinstance(self.vector_index, Ivfflat):
+                    sess.execute(text(f"SET LOCAL ivfflat.probes = {int(self.vector_index.probes)}"))
+                elif isinstance(self.vector_index, HNSW):
+                    sess.execute(text(f"SET LOCAL hnsw.ef_search = {int(self.vector_index.ef_search)}"))
+                rows = sess.execute(stmt).fetchall()
+        except Exception as e:
+            logger.error(f"Error performing {kind.lower()} search: {e}")
+            return []
+        return [
+            Document(
+                id=row.id,
+                name=row.name,
+                meta_data=row.meta_data,
+                content=row.content,
+                embedder=self.embedder,
+                usage=row.usage,
+            )
+            for row in rows
+        ]
+
+    def vector_search(
+        self, query: str, limit: int = 5, filters: Optional[Dict[str, Any]] = None
+    ) -> List[Document]:
+        embedding = self.query_embedding(query)
+        if embedding is None:
+            logger.error(f"Error getting embedding for Query: {query}")
+            return []
+        stmt = (
+            self._filtered(select(*self._columns()), filters).order_by(self._distance(embedding)).limit(limit)
+        )
+        return self._execute(stmt, "Vector")
+
+    def keyword_search(
+        self, query: str, limit: int = 5, filters: Optional[Dict[str, Any]] = None
+    ) -> List[Document]:
+        tsv = self.table.c.content_tsv
+        ts_query = self._ts_query(query)
+        stmt = (
+            self._filtered(select(*self._columns()).where(tsv.op("@@")(ts_query)), filters)
+            .order_by(func.ts_rank_cd(tsv, ts_query).desc())
+            .limit(limit)
+        )
+        return self._execute(stmt, "Keyword")
+
+    def hybrid_search(
+        self, query: str, limit: int = 5, filters: Optional[Dict[str, Any]] = None
+    ) -> List[Document]:
+        embedding = self.query_embedding(query)
+        if embedding is None:
+            logger.error(f"Error getting embedding for Query: {query}")
+            return []
+        if not 0 <= self.vector_score_weight <= 1:
+            raise ValueError("vector_score_weight must be between 0 and 1")
+
+        t = self.table.c
+        ts_query = self._ts_query(query)
+        candidates = max(self.candidates, limit)
+        # Nearest rows by the vector index and best matches by the GIN index, re-ranked together
+        vector_ids = (
+            self._filtered(select(t.id), filters).order_by(self._distance(embedding)).limit(candidates)
+        )
+        keyword_ids = (
+            self._filtered(select(t.id).where(t.content_tsv.op("@@")(ts_query)), filters)
+            .order_by(func.ts_rank_cd(t.content_tsv, ts_query).desc())
+            .limit(candidates)
+        )
+        candidate_ids = union(vector_ids, keyword_ids).subquery()
+        score = self.vector_score_weight * self._vector_score(embedding) + (
+            1 - self.vector_score_weight
+        ) * func.ts_rank_cd(t.content_tsv, ts_query)
+        stmt = (
+            select(*self._columns(), score.label("hybrid_score"))
+            .where(t.id.in_(select(candidate_ids.c.id)))
+            .order_by(desc("hybrid_score"))
+            .limit(limit)
+        )
+        return self._execute(stmt, "Hybrid")
@@ -0,0 +1,220 @@
+import hashlib
+import json
+import os
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Set, Tuple, Union
+
+from agents.cache import normalize_text
+from agents.dedupe import openai_embed_fn
+from agents.scheduler import ChunkScheduler, RateLimiter
+from agents.settings import agent_settings
+from tools.converters import read_rows
+from utils.log import logger
+
+# (id, name, content, meta_data, content_hash)
+KnowledgeRow = Tuple[str, str, str, Dict[str, Any], str]
+
+COPY_COLUMNS = ("id", "name", "meta_data", "filters", "content", "embedding", "content_hash")
+
+# Cells that identify a row: the term and its meaning, the first two columns of every deck file
+KEY_CELLS = 2
+
+
+def row_content(row: dict) -> str:
+    """One `column: value` line per non-empty cell, which reads well to the model and the tsvector."""
+    return "\n".join(f"{k}: {v}" for k, v in row.items() if k and v not in (None, ""))
+
+
+def knowledge_row(row: dict, source: str, position: int) -> Optional[KnowledgeRow]:
+    content = row_content(row)
+    if not content:
+        return None
+    # A row keeps its id while its other cells change, so an edited example replaces its old
+    # document, and each sense of a word (e.g. やります "làm" and "cho") has a document of its own
+    key = "\x1f".join(normalize_text(str(v or "")) for v in list(row.values())[:KEY_CELLS])
+    doc_id = hashlib.md5(f"{source}\x1f{key}".encode("utf-8")).hexdigest()
+    content_hash = hashlib.md5(content.replace("\x00", "\ufffd").encode("utf-8")).hexdigest()
+    return doc_id, source, content, {"source": source, "row": position}, content_hash
+
+
+class KnowledgeLoader:
+    """Bulk loads spreadsheet rows into a `PgVector` table such as `example_agent_knowledge`.
+
+    Any file `tools.converters.read_rows` reads can be loaded (CSV, XLSX, Anki text, Parquet).
+
+    Rows are streamed from the file `read_batch_size` at a time and compared with the
+    stored `content_hash` of their id, so a reload only embeds new or edited rows. Those
+    are embedded `embed_batch_size` per request on a `ChunkScheduler`, with up to
+    `concurrency` requests in flight under the embedding rate limits, while completed
+    batches are written. Writes COPY the rows into a temporary table and upsert them from
+    there with one statement per `write_batch_size` rows. Documents of the source whose
+    row is no longer in the file are deleted at the end of the load.
+
+    Args:
+        vector_db: Table to load into; its embedder's model is used for the documents.
+        embed_fn: Embeds a list of strings; defaults to the OpenAI embeddings endpoint.
+        rate_limiter: Defaults to the `knowledge_embed_*` agent settings.
+    """
+
+    def __init__(
+        self,
+        vector_db: Any,
+        embed_fn: Optional[Callable[[List[str]], List[List[float]]]] = None,
+        embed_batch_size: Optional[int] = None,
+        concurrency: Optional[int] = None,
+        read_batch_size: int = 2000,
+        write_batch_size: int = 5000,
+        rate_limiter: Optional[RateLimiter] = None,
+    ):
+        self.vector_db = vector_db
+        model_id = getattr(vector_db.embedder, "model", None) or agent_settings.embedding_model
+        self.embed_fn = embed_fn or openai_embed_fn(model_id)
+        self.embed_batch_size = embed_batch_size or agent_settings.knowledge_embed_batch_size
+        self.concurrency = concurrency or agent_settings.knowledge_embed_concurrency
+        self.read_batch_size = read_batch_size
+        self.write_batch_size = write_batch_size
+        self.rate_limiter = rate_limiter or RateLimiter(
+            requests_per_minute=agent_settings.knowledge_embed_requests_per_minute,
+            tokens_per_minute=agent_settings.knowledge_embed_tokens_per_minute,
+        )
+
+    def existing_hashes(self, ids: Sequence[str]) -> Dict[str, str]:
+        from sqlalchemy import select
+
+        table = self.vector_db.table
+        with self.vector_db.db_engine.connect() as conn:
+            rows = conn.execute(
+                select(table.c.id, table.c.content_hash).where(table.c.id.in_(list(ids)))
+            ).all()
+        return {doc_id: content_hash for doc_id, content_hash in rows}
+
+    def delete_missing(self, source: str, keep: Set[str]) -> int:
+        """Delete the documents of `source` whose id is not in `keep`. Returns how many were deleted."""
+        from sqlalchemy import delete, select
+
+        table = self.vector_db.table
+        with self.vector_db.db_engine.begin() as conn:
+            stored = conn.execute(select(table.c.id).where(table.c.name == source)).scalars().all()
+            stale = [doc_id for doc_id in stored if doc_id not in keep]
+            for start in range(0, len(stale), self.write_batch_size):
+                conn.execute(
+                    delete(table).where(table.c.id.in_(stale[start : start + self.write_batch_size]))
+                )
+        return len(stale)
+
+    def write(self, rows: List[KnowledgeRow], embeddings: List[List[float]]) -> None:
+        """COPY rows into a temporary table, then upsert them into the knowledge table in one statement."""
+        table = self.vector_db.table.fullname
+        dimensions = len(embeddings[0])
+        columns = ", ".join(COPY_COLUMNS)
+        raw = self.vector_db.db_engine.raw_connection()
+        try:
+            with raw.cursor() as cur:
+                cur.execute(
+                    "CREATE TEMP TABLE knowledge_stage (id varchar, name varchar, meta_data jsonb, filters jsonb, "
+                    f"content text, embedding vector({dimensions}), content_hash varchar) ON COMMIT DROP"
+                )
+                with cur.copy(f"COPY knowledge_stage ({columns}) FROM STDIN") as copy:
+                    for (doc_id, name, content, meta_data, content_hash), embedding in zip(rows, embeddings):
+                        copy.write_row(
+                            (
+                                doc_id,
+                                name,
+                                json.dumps(meta_data, ensure_ascii=False),
+                                json.dumps({"source": name}, ensure_ascii=False),
+                                content.replace("\x00", "\ufffd"),
+                                "[" + ",".join(repr(float(x)) for x in embedding) + "]",
+                                content_hash,
+                            )
+                        )
+                updates = ", ".join(f"{c} = EXCLUDED.{c}" for c in COPY_COLUMNS if c != "id")
+                cur.execute(
+                    f"INSERT INTO {table} ({columns}) SELECT {columns} FROM knowledge_stage "
+                    f"ON CONFLICT (id) DO UPDATE SET {updates}, updated_at = now()"
+                )
+            raw.commit()
+        finally:
+            raw.close()
+
+    def _changed(
+        self, path: Path, source: str, counts: Dict[str, int], seen: Set[str]
+    ) -> Iterator[List[KnowledgeRow]]:
+        """Embedding batches of the rows whose content differs from what is stored; adds every id to `seen`."""
+        position = 0
+        pending: List[KnowledgeRow] = []
+        for batch in read_rows(path, self.read_batch_size):
+            rows = []
+            for row in batch:
+                position += 1
+                item = knowledge_row(row, source, position)
+                # The first row with a given key wins; later repeats in the same file are ignored
+                if item is not None and item[0] not in seen:
+                    seen.add(item[0])
+                    rows.append(item)
+            counts["rows"] += len(rows)
+            stored = self.existing_hashes([r[0] for r in rows]) if rows else {}
+            for item in rows:
+                if stored.get(item[0]) == item[4]:
+                    counts["unchanged"] += 1
+                else:
+                    pending.append(item)
+            while len(pending) >= self.embed_batch_size:
+                yield pending[: self.embed_batch_size]
+                pending = pending[self.embed_batch_size :]
+        if pending:
+            yield pending
+
+    def _embed(self, rows: List[KnowledgeRow]) -> Tuple[List[KnowledgeRow], List[List[float]]]:
+        return rows, self.embed_fn([content for _, _, content, _, _ in rows])
+
+    def load(self, path: Union[str, Path], source: Optional[str] = None) -> Dict[str, int]:
+        """Load one file; `source` (default: the file name) names its documents and filters searches.
+
+        Returns:
+            Dict[str, int]: Rows read, left unchanged and written, and stale documents deleted.
+        """
+        path = Path(path)
+        source = source or path.stem
+        counts = {"rows": 0, "unchanged": 0, "written": 0, "deleted": 0}
+        self.vector_db.create()
+
+        scheduler = ChunkScheduler(
+            self._embed,
+            concurrency=self.concurrency,
+            rate_limiter=self.rate_limiter,
+            # Rough upper bound for the tokens per minute limit: Japanese text is about a token per character
+            estimate_tokens=lambda rows: sum(len(r[2]) for r in rows),
+        )
+        buffer_rows: List[KnowledgeRow] = []
+        buffer_embeddings: List[List[float]] = []
+        seen: Set[str] = set()
+        for _, (rows, embeddings) in scheduler.map(self._changed(path, source, counts, seen)):
+            buffer_rows.extend(rows)
+            buffer_embeddings.extend(embeddings)
+            if len(buffer_rows) >= self.write_batch_size:
+                self.write(buffer_rows, buffer_embeddings)
+                counts["written"] += len(buffer_rows)
+                buffer_rows, buffer_embeddings = [], []
+        if buffer_rows:
+            self.write(buffer_rows, buffer_embeddings)
+            counts["written"] += len(buffer_rows)
+        counts["deleted"] = self.delete_missing(source, seen)
+
+        if (counts["written"] or counts["deleted"]) and hasattr(self.vector_db, "result_cache"):
+            self.vector_db.result_cache.clear()
+        logger.info(f"Loaded {path.name} into {self.vector_db.table.fullname}: {counts}")
+        return counts
+
+
+if __name__ == "__main__":
+    from agents.example import get_example_agent_knowledge
+
+    data_dir = Path(os.path.dirname(os.path.abspath(__file__))) / ".." / "data"
+    vector_db = get_example_agent_knowledge().vector_db
+    if vector_db is None:
+        raise SystemExit("The example agent has no knowledge table")
+    loader = KnowledgeLoader(vector_db)
+    for name in ("flashcards.csv", "grammars_output.csv", "luyendich.csv"):
+        print(f"{name}: {loader.load(data_dir / name)}")
+    # Build the vector and keyword indexes once the bulk of the rows is in
+    vector_db.optimize()
@@ -0,0 +1,149 @@
+import queue
+import threading
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Generator, Iterable, Iterator, List, Optional, Sequence
+
+from agents.scheduler import ChunkScheduler
+from agents.settings import agent_settings
+from utils.log import logger
+
+# Marks the end of a stage's output
+_DONE = object()
+# How often threads blocked on a queue check whether the pipeline was stopped
+_POLL_SECONDS = 0.1
+
+
+@dataclass
+class _Failure:
+    stage: str
+    error: BaseException
+
+
+class _UpstreamFailure(Exception):
+    def __init__(self, failure: _Failure):
+        super().__init__(failure.stage)
+        self.failure = failure
+
+
+@dataclass
+class Stage:
+    """A named step of a `Pipeline`: turns the stream of items it receives into a stream of results.
+
+    `process` gets an iterator over the stage's input and the pipeline's stop event, and
+    returns an iterable of outputs, which must come out in input order. A stage that works
+    ahead of its output should start no new work once the event is set. Most stages are
+    built with `map` or `scheduled`.
+    """
+
+    name: str
+    process: Callable[[Iterator[Any], threading.Event], Iterable[Any]]
+
+    @classmethod
+    def map(cls, name: str, fn: Callable[[Any], Any], workers: int = 1) -> "Stage":
+        """Apply `fn` to each item on up to `workers` threads, keeping the input order."""
+        if workers <= 1:
+            return cls(name, lambda items, stop: (fn(item) for item in items))
+        return cls.scheduled(name, ChunkScheduler(fn, concurrency=workers))
+
+    @classmethod
+    def scheduled(cls, name: str, scheduler: ChunkScheduler) -> "Stage":
+        """Run the items through a `ChunkScheduler`, with its concurrency and rate limits."""
+        return cls(name, lambda items, stop: (result for _, result in scheduler.map(items, cancel=stop)))
+
+    @classmethod
+    def streamed(cls, name: str, scheduler: ChunkScheduler) -> "Stage":
+        """Like `scheduled`, for a worker yielding several results per item (see `ChunkScheduler.stream`)."""
+        return cls(name, lambda items, stop: (result for _, result in scheduler.stream(items, cancel=stop)))
+
+
+class Pipeline:
+    """Runs the items of a source through a sequence of stages, all of them at the same time.
+
+    The source and every stage run on their own thread and are connected by queues of at
+    most `queue_size` items. A slow stage fills its input queue and then blocks the stages
+    before it, so memory stays bounded while e.g. the model, the image search and the sink
+    all work on different chunks. Results come out of `run` in source order.
+
+    If the source or a stage raises, the remaining stages are stopped and `run` re-raises
+    the exception once every thread has exited, so no stage is still working when the
+    caller cleans up. The same holds when the caller stops iterating early. `counts` holds
+    the number of items each stage has produced.
+    """
+
+    def __init__(self, stages: Sequence[Stage], queue_size: Optional[int] = None):
+        self.stages = list(stages)
+        self.queue_size = queue_size or agent_settings.pipeline_queue_size
+        self.counts: Dict[str, int] = {stage.name: 0 for stage in self.stages}
+
+    def run(self, source: Iterable[Any]) -> Generator[Any, None, None]:
+        stop = threading.Event()
+        queues: List["queue.Queue[Any]"] = [
+            queue.Queue(maxsize=self.queue_size) for _ in range(len(self.stages) + 1)
+        ]
+
+        def put(outbox: "queue.Queue[Any]", item: Any) -> bool:
+            while not stop.is_set():
+                try:
+                    outbox.put(item, timeout=_POLL_SECONDS)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        def get(inbox: "queue.Queue[Any]") -> Any:
+            while not stop.is_set():
+                try:
+                    return inbox.get(timeout=_POLL_SECONDS)
+                except queue.Empty:
+                    continue
+            return _DONE
+
+        def drain(inbox: "queue.Queue[Any]") -> Iterator[Any]:
+            while True:
+                item = get(inbox)
+                if item is _DONE:
+                    return
+                if isinstance(item, _Failure):
+                    raise _UpstreamFailure(item)
+                yield item
+
+        def feed() -> None:
+            try:
+                for item in source:
+                    if not put(queues[0], item):
+                        return
+                put(queues[0], _DONE)
+            except BaseException as e:
+                put(queues[0], _Failure("source", e))
+
+        def work(index: int, stage: Stage) -> None:
+            outbox = queues[index + 1]
+            try:
+                for result in stage.process(drain(queues[index]), stop):
+                    self.counts[stage.name] += 1
+                    if not put(outbox, result):
+                        return
+                put(outbox, _DONE)
+            except _UpstreamFailure as e:
+                put(outbox, e.failure)
+            except BaseException as e:
+                put(outbox, _Failure(stage.name, e))
+
+        threads = [threading.Thread(target=feed, name="pipeline-source", daemon=True)]
+        threads += [
+            threading.Thread(target=work, args=(i, stage), name=f"pipeline-{stage.name}", daemon=True)
+            for i, stage in enumerate(self.stages)
+        ]
+        for thread in threads:
+            thread.start()
+        try:
+            for result in drain(queues[-1]):
+                yield result
+        except _UpstreamFailure as e:
+            logger.error(f"Pipeline stage {e.failure.stage!r} failed: {e.failure.error}")
+            raise e.failure.error from None
+        finally:
+            # Unblocks every thread still waiting on a queue, e.g. when the caller stopped early
+            stop.set()
+            for thread in threads:
+                thread.join()
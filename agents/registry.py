@@ -0,0 +1,82 @@
+import threading
+import time
+from typing import Callable, Dict, Iterator, List
+
+from phi.agent import Agent
+
+from utils.log import logger
+
+
+class AgentRegistry:
+    """Agents by id, built on first use and then reused for the life of the process.
+
+    Registering an agent only stores its factory, so importing a module that registers
+    agents costs nothing; the model clients, storage and vector db of an agent are created
+    the first time it is asked for. With several API workers, each worker builds its own
+    agents once.
+    """
+
+    def __init__(self):
+        self._factories: Dict[str, Callable[[], Agent]] = {}
+        self._agents: Dict[str, Agent] = {}
+        self._lock = threading.Lock()
+
+    def register(self, agent_id: str, factory: Callable[[], Agent]) -> None:
+        if agent_id in self._factories:
+            raise ValueError(f"Agent {agent_id} is already registered")
+        self._factories[agent_id] = factory
+
+    def ids(self) -> List[str]:
+        return list(self._factories)
+
+    def is_built(self, agent_id: str) -> bool:
+        return agent_id in self._agents
+
+    def get(self, agent_id: str) -> Agent:
+        """Return the agent for `agent_id`, building it if this is the first request for it."""
+        agent = self._agents.get(agent_id)
+        if agent is not None:
+            return agent
+        if agent_id not in self._factories:
+            raise KeyError(f"Unknown agent: {agent_id}")
+        with self._lock:
+            agent = self._agents.get(agent_id)
+            if agent is None:
+                started = time.perf_counter()
+                agent = self._factories[agent_id]()
+                self._agents[agent_id] = agent
+                logger.debug(f"Built agent {agent_id} in {time.perf_counter() - started:.2f}s")
+        return agent
+
+    def all(self) -> List[Agent]:
+        return [self.get(agent_id) for agent_id in self._factories]
+
+    def lazy_list(self) -> "LazyAgentList":
+        return LazyAgentList(self)
+
+
+class LazyAgentList(list):
+    """A list view of a registry that builds the agents when it is first iterated or indexed.
+
+    Lets code that takes a plain `List[Agent]` and only reads it later, such as
+    `phi.playground.Playground`, be set up without building any agent.
+    """
+
+    def __init__(self, registry: AgentRegistry):
+        super().__init__()
+        self.registry = registry
+
+    def __iter__(self) -> Iterator[Agent]:
+        return iter(self.registry.all())
+
+    def __len__(self) -> int:
+        return len(self.registry.ids())
+
+    def __getitem__(self, index):
+        return self.registry.all()[index]
+
+    def __bool__(self) -> bool:
+        return bool(self.registry.ids())
+
+    def __repr__(self) -> str:
+        return f"LazyAgentList({self.registry.ids()})"
@@ -0,0 +1,245 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import lru_cache
+from typing import Any, Callable, Dict, Generic, Iterable, Iterator, Optional, Tuple, TypeVar
+
+from agents.settings import agent_settings
+from utils.log import logger
+
+T = TypeVar("T")
+R = TypeVar("R")
+S = TypeVar("S")
+
+# Marks the end of a chunk's items in `ChunkScheduler.stream`
+_END = object()
+# How often `ChunkScheduler.stream` checks for cancellation while waiting for the next item
+_POLL_SECONDS = 0.1
+
+
+class _Raised:
+    def __init__(self, error: BaseException):
+        self.error = error
+
+
+class TokenBucket:
+    """Thread-safe token bucket that refills continuously at `rate_per_minute`.
+
+    The bucket starts full, so a burst of up to `capacity` units is allowed before callers
+    are throttled down to the steady refill rate.
+    """
+
+    def __init__(
+        self,
+        rate_per_minute: float,
+        capacity: Optional[float] = None,
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], None] = time.sleep,
+    ):
+        if rate_per_minute <= 0:
+            raise ValueError(f"rate_per_minute must be positive, got {rate_per_minute}")
+        self.rate_per_second = rate_per_minute / 60.0
+        self.capacity = float(capacity if capacity is not None else rate_per_minute)
+        self._tokens = self.capacity
+        self._clock = clock
+        self._sleep = sleep
+        self._updated_at = clock()
+        self._lock = threading.Lock()
+
+    def _refill(self) -> None:
+        now = self._clock()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate_per_second)
+        self._updated_at = now
+
+    def acquire(self, amount: float = 1) -> float:
+        """Block until `amount` units are available and take them.
+
+        Requests larger than the bucket capacity are clamped to the capacity so they can
+        still make progress.
+
+        Returns:
+            float: Seconds spent waiting.
+        """
+        amount = min(float(amount), self.capacity)
+        waited = 0.0
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= amount:
+                    self._tokens -= amount
+                    return waited
+                delay = (amount - self._tokens) / self.rate_per_second
+            self._sleep(delay)
+            waited += delay
+
+
+class RateLimiter:
+    """Requests-per-minute and tokens-per-minute limits applied together."""
+
+    def __init__(
+        self,
+        requests_per_minute: Optional[int] = None,
+        tokens_per_minute: Optional[int] = None,
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], None] = time.sleep,
+    ):
+        self.requests = (
+            TokenBucket(requests_per_minute, clock=clock, sleep=sleep) if requests_per_minute else None
+        )
+        self.tokens = TokenBucket(tokens_per_minute, clock=clock, sleep=sleep) if tokens_per_minute else None
+
+    def acquire(self, tokens: int = 0) -> float:
+        """Wait for one request slot and `tokens` tokens. Returns the seconds spent waiting."""
+        waited = 0.0
+        if self.requests is not None:
+            waited += self.requests.acquire(1)
+        if self.tokens is not None and tokens > 0:
+            waited += self.tokens.acquire(tokens)
+        return waited
+
+
+@lru_cache(maxsize=None)
+def shared_rate_limiter() -> RateLimiter:
+    """The rate limiter of this process, built from `agent_settings`.
+
+    The limits are those of the API account, so every scheduler of the process draws from
+    the same buckets instead of each one getting the full budget.
+    """
+    return RateLimiter(
+        requests_per_minute=agent_settings.batch_requests_per_minute,
+        tokens_per_minute=agent_settings.batch_tokens_per_minute,
+    )
+
+
+class ChunkScheduler(Generic[T, R]):
+    """Runs `worker` over chunks on a thread pool with a bounded number of chunks in flight.
+
+    Results are yielded in the original input order. At most `max_pending` chunks are
+    submitted ahead of the next chunk to be yielded, so a slow chunk cannot make the
+    reorder buffer grow without bound.
+    """
+
+    def __init__(
+        self,
+        worker: Callable[[T], R],
+        concurrency: Optional[int] = None,
+        rate_limiter: Optional[RateLimiter] = None,
+        estimate_tokens: Optional[Callable[[T], int]] = None,
+        max_pending: Optional[int] = None,
+    ):
+        self.worker = worker
+        self.concurrency = concurrency or agent_settings.batch_concurrency
+        if self.concurrency < 1:
+            raise ValueError(f"concurrency must be at least 1, got {self.concurrency}")
+        self.rate_limiter = rate_limiter
+        self.estimate_tokens = estimate_tokens
+        self.max_pending = max(max_pending or self.concurrency * 2, self.concurrency)
+
+    @classmethod
+    def from_settings(cls, worker: Callable[[T], R], **kwargs) -> "ChunkScheduler[T, R]":
+        """Build a scheduler using the concurrency from `agent_settings` and the `shared_rate_limiter`."""
+        kwargs.setdefault("concurrency", agent_settings.batch_concurrency)
+        kwargs.setdefault("rate_limiter", shared_rate_limiter())
+        return cls(worker, **kwargs)
+
+    def _run_one(self, chunk: T) -> R:
+        if self.rate_limiter is not None:
+            tokens = self.estimate_tokens(chunk) if self.estimate_tokens is not None else 0
+            waited = self.rate_limiter.acquire(tokens)
+            if waited > 0:
+                logger.debug(f"Rate limited for {waited:.2f}s")
+        return self.worker(chunk)
+
+    def map(self, chunks: Iterable[T], cancel: Optional[threading.Event] = None) -> Iterator[Tuple[int, R]]:
+        """Run all chunks and yield `(index, result)` pairs in input order.
+
+        If a chunk raises, the exception is re-raised when that chunk's turn comes and no
+        further chunks are submitted. Once `cancel` is set, no further chunks are submitted
+        either: chunks that have not started are dropped, and the iterator stops after the
+        running ones have finished.
+        """
+        source = iter(enumerate(chunks))
+        pending: Dict[int, Future] = {}
+        next_index = 0
+        exhausted = False
+
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="chunk") as executor:
+            try:
+                while True:
+                    if cancel is not None and cancel.is_set():
+                        return
+                    while not exhausted and len(pending) < self.max_pending:
+                        item = next(source, None)
+                        if item is None:
+                            exhausted = True
+                            break
+                        index, chunk = item
+                        pending[index] = executor.submit(self._run_one, chunk)
+
+                    if next_index not in pending:
+                        return
+                    result = pending.pop(next_index).result()
+                    yield next_index, result
+                    next_index += 1
+            finally:
+                for future in pending.values():
+                    future.cancel()
+
+    def stream(
+        self: "ChunkScheduler[T, Iterable[S]]", chunks: Iterable[T], cancel: Optional[threading.Event] = None
+    ) -> Iterator[Tuple[int, S]]:
+        """Like `map`, for a worker that yields the results of a chunk one by one.
+
+        Yields `(index, item)` for every item of every chunk, in input order. The items of the
+        oldest unfinished chunk are yielded as soon as the worker produces them, e.g. each
+        record as the model finishes writing it; later chunks run at the same time and their
+        items wait for their turn. Failures and `cancel` behave as in `map`, except that a
+        running chunk stops at its next item once `cancel` is set.
+        """
+        source = iter(enumerate(chunks))
+        pending: Dict[int, Tuple[Future, "queue.Queue[Any]"]] = {}
+        next_index = 0
+        exhausted = False
+
+        def drain(chunk: T, inbox: "queue.Queue[Any]") -> None:
+            try:
+                for item in self._run_one(chunk):
+                    inbox.put(item)
+                    if cancel is not None and cancel.is_set():
+                        break
+            except BaseException as e:
+                inbox.put(_Raised(e))
+            finally:
+                inbox.put(_END)
+
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="chunk") as executor:
+            try:
+                while True:
+                    if cancel is not None and cancel.is_set():
+                        return
+                    while not exhausted and len(pending) < self.max_pending:
+                        item = next(source, None)
+                        if item is None:
+                            exhausted = True
+                            break
+                        index, chunk = item
+                        inbox: "queue.Queue[Any]" = queue.Queue()
+                        pending[index] = (executor.submit(drain, chunk, inbox), inbox)
+
+                    if next_index not in pending:
+                        return
+                    try:
+                        result = pending[next_index][1].get(timeout=_POLL_SECONDS)
+                    except queue.Empty:
+                        continue
+                    if isinstance(result, _Raised):
+                        raise result.error
+                    if result is _END:
+                        del pending[next_index]
+                        next_index += 1
+                        continue
+                    yield next_index, result
+            finally:
+                for future, _ in pending.values():
+                    future.cancel()
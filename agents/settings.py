@@ -13,6 +13,59 @@ class AgentSettings(BaseSettings):
     default_temperature: float = 0
     gpt_4o_mini: str = "gpt-4o-mini"
 
+    # Batch generation: number of chunks kept in flight at once
+    batch_concurrency: int = 4
+    # Provider rate limits shared by all in-flight chunks
+    batch_requests_per_minute: int = 500
+    batch_tokens_per_minute: int = 200000
+    # Token budgets used to pack words into one request, well below default_max_completion_tokens
+    batch_prompt_token_budget: int = 4000
+    batch_completion_token_budget: int = 6000
+    batch_max_items: int = 40
+    # Submit batch runs through the OpenAI Batch API instead of calling the model live
+    batch_offline: bool = False
+    # Hand each card to the next stages (images, writes, progress events) as soon as the model has written it
+    stream_records: bool = True
+    # Chunks buffered between two stages of a generation pipeline before the earlier stage waits
+    pipeline_queue_size: int = 4
+    # Look up an illustrating image for each generated flashcard
+    flashcard_images: bool = False
+
+    # Deck jobs submitted through the API: jobs generated at once, and jobs kept in memory for status/progress
+    deck_job_workers: int = 4
+    deck_jobs_retained: int = 500
+
+    # Response cache: entries expire after the TTL, least recently used ones are evicted past the limit
+    response_cache_ttl_seconds: int = 30 * 24 * 60 * 60
+    response_cache_max_entries: int = 100000
+    # "sqlite" keeps the cache in data/cache, "postgres" shares it between all API workers and runs
+    response_cache_backend: str = "sqlite"
+
+    # Also upsert generated cards into the Postgres deck tables (see db/tables/deck.py) as they are generated
+    deck_database: bool = False
+
+    # Fold near-duplicate input rows together (by embedding similarity) before generating a deck
+    dedupe_inputs: bool = False
+    dedupe_threshold: float = 0.95
+
+    # Example agent knowledge base: "hnsw" or "ivfflat" vector index and its build/search parameters
+    knowledge_index: str = "hnsw"
+    knowledge_hnsw_m: int = 16
+    knowledge_hnsw_ef_construction: int = 200
+    knowledge_ef_search: int = 40
+    knowledge_ivfflat_lists: int = 100
+    knowledge_ivfflat_probes: int = 10
+    # Rows taken from each of the vector and keyword indexes before hybrid re-ranking
+    knowledge_search_candidates: int = 40
+    # Query embeddings and search results kept in memory by each worker
+    knowledge_query_cache_size: int = 1024
+    knowledge_result_cache_ttl_seconds: int = 300
+    # Bulk knowledge base loads: strings per embeddings request, requests in flight and the embedding rate limits
+    knowledge_embed_batch_size: int = 512
+    knowledge_embed_concurrency: int = 4
+    knowledge_embed_requests_per_minute: int = 3000
+    knowledge_embed_tokens_per_minute: int = 1000000
+
 
 # Create an AgentSettings object
 agent_settings = AgentSettings()
@@ -0,0 +1,541 @@
+"""
+Generate several decks at once, split into shards across processes or machines.
+
+The input rows of each deck are partitioned by a stable hash of their key, so a row always
+lands in the same shard and each shard keeps its own deck index and checkpoint next to the
+output (`<output stem>.shard-003-of-008.*`). Shards run on a local process pool, or are
+queued in the `deck_shards` Postgres table and claimed by every node running `work`. Once
+all shards of a deck are done, their records are merged back in input order, so the output
+does not depend on the number of shards or on which worker ran what.
+
+Nodes working on a Postgres queue must see the data directory at the same path.
+
+Usage:
+    python -m agents.sharding run --deck flashcards:data/n3.csv:data/n3.xlsx \\
+        --deck grammars:data/n2_grammar.csv:data/n2_grammar.csv:Japanese:English --shards 8 --processes 4
+    python -m agents.sharding run ... --queue postgres   # on the coordinating node
+    python -m agents.sharding work --processes 4 --poll 30   # on every other node
+"""
+
+import argparse
+import hashlib
+import importlib
+import os
+import socket
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict, dataclass
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple, cast
+
+from agents.checkpoint import item_key
+from agents.deck_diff import DeckIndex
+from agents.deck_format import deck_path, export_deck, write_deck
+from agents.deck_runner import (
+    DeckSpec,
+    generate_deck,
+    metrics_path,
+    prepare_items,
+    read_items,
+    report_repeated_sentences,
+)
+from agents.settings import agent_settings
+from utils.log import logger
+from utils.metrics import metrics
+
+# Deck spec factories by deck kind; any other kind is read as "module:function"
+DECK_KINDS = {
+    "flashcards": "agents.flascard_generator:deck_spec",
+    "grammars": "agents.grammar_generator:deck_spec",
+}
+
+Counts = Dict[str, int]
+
+
+def load_spec(kind: str, name: str, target_language: str, native_language: str, **kwargs) -> DeckSpec:
+    module_name, _, function = DECK_KINDS.get(kind, kind).partition(":")
+    factory = getattr(importlib.import_module(module_name), function)
+    return factory(name, target_language=target_language, native_language=native_language, **kwargs)
+
+
+def shard_of(key: str, shards: int) -> int:
+    """Shard of a row key. Stable across processes and machines, unlike `hash()`."""
+    digest = hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big") % shards
+
+
+def partition(items: Sequence[dict], key_fields: Sequence[str], shards: int) -> List[List[dict]]:
+    """Split rows into `shards` lists by the hash of their first key field, keeping their order."""
+    parts: List[List[dict]] = [[] for _ in range(shards)]
+    for item in items:
+        parts[shard_of(item_key(item, key_fields[:1]), shards)].append(item)
+    return parts
+
+
+def shard_path(output_path: Path, shard: int, shards: int) -> Path:
+    """Prefix of the deck index and checkpoint files of one shard."""
+    return output_path.with_name(f"{output_path.stem}.shard-{shard:03d}-of-{shards:03d}")
+
+
+def add_counts(total: Counts, counts: Counts) -> Counts:
+    for status, count in counts.items():
+        total[status] = total.get(status, 0) + count
+    return total
+
+
+def share_rate_limits(workers: int) -> None:
+    """Give this process its share of the provider rate limits when `workers` processes call the model."""
+    if workers > 1:
+        agent_settings.batch_requests_per_minute = max(1, agent_settings.batch_requests_per_minute // workers)
+        agent_settings.batch_tokens_per_minute = max(1, agent_settings.batch_tokens_per_minute // workers)
+
+
+@dataclass
+class DeckRequest:
+    """A deck to generate: its kind (see `DECK_KINDS`), input and output files and language pair."""
+
+    kind: str
+    input_path: str
+    output_path: str
+    target_language: str = "Japanese"
+    native_language: str = "Vietnamese"
+
+    @classmethod
+    def parse(cls, value: str) -> "DeckRequest":
+        """Parse `kind:input:output[:target language:native language]`."""
+        parts = value.split(":")
+        if len(parts) not in (3, 5):
+            raise ValueError(f"Expected kind:input:output[:target:native], got {value!r}")
+        return cls(*parts)
+
+    @property
+    def name(self) -> str:
+        return Path(self.output_path).stem
+
+
+@dataclass
+class ShardTask:
+    """Everything a worker needs to generate one shard of a deck; plain data, so it can be queued."""
+
+    kind: str
+    name: str
+    target_language: str
+    native_language: str
+    shard: int
+    shards: int
+    path: str
+    items: List[dict]
+    use_response_cache: bool = True
+
+    def spec(self) -> DeckSpec:
+        kwargs: Dict[str, Any] = {}
+        if self.use_response_cache:
+            from agents.cache import open_response_cache
+
+            kwargs["response_cache"] = open_response_cache()
+        return load_spec(self.kind, self.name, self.target_language, self.native_language, **kwargs)
+
+
+def run_shard(task: ShardTask) -> Counts:
+    logger.info(f"Generating shard {task.shard + 1}/{task.shards} of {task.name}: {len(task.items)} rows")
+    return generate_deck(task.spec(), task.items, task.path)
+
+
+def _run_shard_in_pool(task: ShardTask) -> Tuple[Counts, Dict[str, Any]]:
+    # Pool processes are reused across shards, so only what this shard recorded is sent back
+    started = metrics.snapshot()
+    counts = run_shard(task)
+    return counts, metrics.since(started).snapshot()
+
+
+@dataclass
+class DeckPlan:
+    request: DeckRequest
+    spec: DeckSpec
+    items: List[dict]
+    tasks: List[ShardTask]
+    embedder: Any = None
+
+
+def plan_deck(request: DeckRequest, shards: int, use_response_cache: bool = True) -> DeckPlan:
+    """Read and dedupe the input of a deck and cut it into shard tasks."""
+    spec = load_spec(request.kind, request.name, request.target_language, request.native_language)
+    items, embedder = prepare_items(read_items(request.input_path, spec.key_fields), spec.key_fields)
+    output_path = Path(request.output_path).resolve()
+    tasks = [
+        ShardTask(
+            kind=request.kind,
+            name=request.name,
+            target_language=request.target_language,
+            native_language=request.native_language,
+            shard=shard,
+            shards=shards,
+            path=str(shard_path(output_path, shard, shards)),
+            items=part,
+            use_response_cache=use_response_cache,
+        )
+        for shard, part in enumerate(partition(items, spec.key_fields, shards))
+    ]
+    return DeckPlan(request, spec, items, tasks, embedder)
+
+
+def merge_shards(plan: DeckPlan) -> int:
+    """Write the records of all shards to the deck file in input order, then export it.
+
+    Returns:
+        int: Number of records written.
+    """
+    records = {}
+    for task in plan.tasks:
+        index = DeckIndex(f"{task.path}.index.sqlite")
+        try:
+            records.update(index.records_by_key(plan.spec.record_type))
+        finally:
+            index.close()
+
+    def batches(batch_size: int = 1000):
+        batch = []
+        for item in plan.items:
+            # A row repeated in the input has one record, written where the row first appears
+            record = records.pop(item_key(item, plan.spec.key_fields), None)
+            if record is not None:
+                batch.append(record)
+                if len(batch) >= batch_size:
+                    yield batch
+                    batch = []
+        yield batch
+
+    output_path = Path(plan.request.output_path)
+    deck_file = deck_path(output_path)
+    written = write_deck(deck_file, batches(), plan.spec.record_type)
+    export_deck(deck_file, output_path, media_store=plan.spec.media_store)
+    logger.info(f"Merged {len(plan.tasks)} shards: {written} {plan.spec.kind} saved to {deck_file}")
+    if plan.embedder is not None:
+        report_repeated_sentences(plan.spec, deck_file, plan.embedder)
+    return written
+
+
+def write_run_summaries(plans: Sequence[DeckPlan], started: Dict[str, Any], **run: Any) -> None:
+    """Write the metrics recorded since `started` next to the output of every deck of the run.
+
+    The decks of a run share their processes, so each summary covers the whole run.
+    """
+    run_metrics = metrics.since(started)
+    for plan in plans:
+        run_metrics.write_summary(metrics_path(plan.request.output_path), **run)
+
+
+def run_local(
+    requests: Sequence[DeckRequest], shards: int, processes: int, use_response_cache: bool = True
+) -> Dict[str, Counts]:
+    """Generate the decks with all their shards on a pool of `processes` processes.
+
+    The batch rate limits are split evenly between the processes. With one process the
+    shards run one after the other in this process. The metrics of every process are
+    summarized next to each output (see `write_run_summaries`).
+
+    Returns:
+        Dict[str, Counts]: Row counts per status, by output path.
+    """
+    started = metrics.snapshot()
+    plans = [plan_deck(request, shards, use_response_cache) for request in requests]
+    totals: Dict[str, Counts] = {plan.request.output_path: {} for plan in plans}
+    jobs = [(plan.request.output_path, task) for plan in plans for task in plan.tasks]
+    if processes <= 1:
+        for output, task in jobs:
+            add_counts(totals[output], run_shard(task))
+    else:
+        with ProcessPoolExecutor(
+            max_workers=processes, initializer=share_rate_limits, initargs=(processes,)
+        ) as executor:
+            futures = [(output, executor.submit(_run_shard_in_pool, task)) for output, task in jobs]
+            for output, future in futures:
+                counts, shard_metrics = future.result()
+                add_counts(totals[output], counts)
+                metrics.merge(shard_metrics)
+    for plan in plans:
+        merge_shards(plan)
+    write_run_summaries(plans, started, decks=totals, shards=shards, processes=processes)
+    return totals
+
+
+class ShardQueue:
+    """Work queue of deck shards in the `deck_shards` table, shared by the workers of every node.
+
+    Workers claim the oldest pending shard with `SELECT ... FOR UPDATE SKIP LOCKED`, so no
+    two workers get the same shard and none waits on another's lock. A claimed shard is
+    leased for `lease_seconds` and the lease is renewed while the worker is busy; a shard
+    whose lease ran out because its worker died is claimed again and resumes from its
+    checkpoint.
+    """
+
+    def __init__(self, engine: Optional[Any] = None, lease_seconds: float = 600.0):
+        from sqlalchemy import Table
+
+        from db.tables import DeckShard
+
+        if engine is None:
+            from db.session import get_db_engine
+
+            engine = get_db_engine()
+        self.engine = engine
+        self.table = cast(Table, DeckShard.__table__)
+        self.lease_seconds = lease_seconds
+
+    def _now(self) -> datetime:
+        return datetime.now(timezone.utc)
+
+    def enqueue(self, run_id: str, output: str, tasks: Sequence[ShardTask]) -> None:
+        rows = [
+            {"run_id": run_id, "output": output, "shard": t.shard, "shards": t.shards, "task": asdict(t)}
+            for t in tasks
+        ]
+        if rows:
+            with self.engine.begin() as connection:
+                connection.execute(self.table.insert(), rows)
+
+    def claim(self, worker: str) -> Optional[Tuple[int, ShardTask]]:
+        """Take the oldest shard that is pending or whose lease expired, or None if there is none."""
+        from sqlalchemy import and_, or_, select
+
+        t = self.table
+        now = self._now()
+        with self.engine.begin() as connection:
+            row = connection.execute(
+                select(t.c.id, t.c.task)
+                .where(
+                    or_(t.c.status == "pending", and_(t.c.status == "running", t.c.lease_expires_at < now))
+                )
+                .order_by(t.c.id)
+                .limit(1)
+                .with_for_update(skip_locked=True)
+            ).first()
+            if row is None:
+                return None
+            connection.execute(
+                t.update()
+                .where(t.c.id == row.id)
+                .values(
+                    status="running",
+                    worker=worker,
+                    attempts=t.c.attempts + 1,
+                    lease_expires_at=now + timedelta(seconds=self.lease_seconds),
+                    updated_at=now,
+                )
+            )
+        return row.id, ShardTask(**row.task)
+
+    def _update(self, shard_id: int, worker: str, **values) -> None:
+        t = self.table
+        with self.engine.begin() as connection:
+            connection.execute(
+                t.update()
+                .where(t.c.id == shard_id, t.c.worker == worker)
+                .values(updated_at=self._now(), **values)
+            )
+
+    def renew(self, shard_id: int, worker: str) -> None:
+        self._update(shard_id, worker, lease_expires_at=self._now() + timedelta(seconds=self.lease_seconds))
+
+    def complete(self, shard_id: int, worker: str, counts: Counts) -> None:
+        self._update(shard_id, worker, status="done", counts=counts, lease_expires_at=None)
+
+    def fail(self, shard_id: int, worker: str, error: str) -> None:
+        self._update(shard_id, worker, status="failed", error=error, lease_expires_at=None)
+
+    def statuses(self, run_id: str) -> Counts:
+        from sqlalchemy import func, select
+
+        t = self.table
+        with self.engine.connect() as connection:
+            rows = connection.execute(
+                select(t.c.status, func.count()).where(t.c.run_id == run_id).group_by(t.c.status)
+            ).all()
+        return {status: count for status, count in rows}
+
+    def counts(self, run_id: str) -> Dict[str, Counts]:
+        """Row counts of the finished shards of a run, summed by output."""
+        from sqlalchemy import select
+
+        t = self.table
+        totals: Dict[str, Counts] = {}
+        with self.engine.connect() as connection:
+            for output, counts in connection.execute(
+                select(t.c.output, t.c.counts).where(t.c.run_id == run_id, t.c.counts.is_not(None))
+            ):
+                add_counts(totals.setdefault(output, {}), counts)
+        return totals
+
+    def work(
+        self,
+        worker: str,
+        run: Callable[[ShardTask], Counts] = run_shard,
+        poll_interval: Optional[float] = None,
+        sleep: Callable[[float], None] = time.sleep,
+    ) -> int:
+        """Claim and run shards until the queue is empty, or forever when `poll_interval` is set.
+
+        Returns:
+            int: Number of shards this worker finished.
+        """
+        finished = 0
+        while True:
+            claimed = self.claim(worker)
+            if claimed is None:
+                if poll_interval is None:
+                    return finished
+                sleep(poll_interval)
+                continue
+            shard_id, task = claimed
+            stop = threading.Event()
+
+            def heartbeat(shard_id: int = shard_id) -> None:
+                while not stop.wait(self.lease_seconds / 3):
+                    self.renew(shard_id, worker)
+
+            renewer = threading.Thread(target=heartbeat, name="shard-lease", daemon=True)
+            renewer.start()
+            try:
+                self.complete(shard_id, worker, run(task))
+                finished += 1
+            except Exception as e:
+                logger.exception(f"Shard {task.shard + 1}/{task.shards} of {task.name} failed")
+                self.fail(shard_id, worker, f"{type(e).__name__}: {e}")
+            finally:
+                stop.set()
+                renewer.join()
+
+    def wait(
+        self, run_id: str, poll_interval: float = 10.0, sleep: Callable[[float], None] = time.sleep
+    ) -> Counts:
+        """Block until no shard of the run is pending or running, and return the shard counts per status."""
+        while True:
+            statuses = self.statuses(run_id)
+            if not statuses.get("pending") and not statuses.get("running"):
+                return statuses
+            sleep(poll_interval)
+
+
+def worker_name() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def _work_process(
+    rate_share: int, lease_seconds: float, poll_interval: Optional[float]
+) -> Tuple[int, Dict[str, Any]]:
+    share_rate_limits(rate_share)
+    finished = ShardQueue(lease_seconds=lease_seconds).work(worker_name(), poll_interval=poll_interval)
+    return finished, metrics.snapshot()
+
+
+def work(
+    processes: int,
+    rate_share: Optional[int] = None,
+    lease_seconds: float = 600.0,
+    poll_interval: Optional[float] = None,
+) -> int:
+    """Run `processes` queue workers on this node. `rate_share` is the number of workers over all nodes.
+
+    The metrics of the worker processes are merged into this process's.
+
+    Returns:
+        int: Number of shards finished.
+    """
+    args = (rate_share or processes, lease_seconds, poll_interval)
+    if processes <= 1:
+        share_rate_limits(args[0])
+        return ShardQueue(lease_seconds=lease_seconds).work(worker_name(), poll_interval=poll_interval)
+    finished = 0
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        for future in [executor.submit(_work_process, *args) for _ in range(processes)]:
+            shards_done, worker_metrics = future.result()
+            finished += shards_done
+            metrics.merge(worker_metrics)
+    return finished
+
+
+def run_queued(
+    requests: Sequence[DeckRequest],
+    shards: int,
+    processes: int,
+    rate_share: Optional[int] = None,
+    lease_seconds: float = 600.0,
+    use_response_cache: bool = True,
+    queue: Optional[ShardQueue] = None,
+) -> Dict[str, Counts]:
+    """Queue the shards of the decks in Postgres, work on them here too, and merge once every node is done.
+
+    The metrics summaries next to the outputs only cover this node: the other nodes export
+    theirs from their own process.
+
+    Returns:
+        Dict[str, Counts]: Row counts per status, by output path.
+    """
+    queue = queue or ShardQueue(lease_seconds=lease_seconds)
+    started = metrics.snapshot()
+    run_id = uuid.uuid4().hex
+    plans = [plan_deck(request, shards, use_response_cache) for request in requests]
+    for plan in plans:
+        queue.enqueue(run_id, plan.request.output_path, plan.tasks)
+    logger.info(f"Queued run {run_id}: {sum(len(plan.tasks) for plan in plans)} shards")
+
+    if processes > 0:
+        work(processes, rate_share, lease_seconds)
+    statuses = queue.wait(run_id)
+    if statuses.get("failed"):
+        logger.warning(
+            f"{statuses['failed']} shards of run {run_id} failed; their rows keep their previous cards"
+        )
+    for plan in plans:
+        merge_shards(plan)
+    totals = queue.counts(run_id)
+    write_run_summaries(plans, started, run_id=run_id, decks=totals, shards=shards, processes=processes)
+    return totals
+
+
+def main(argv: Optional[Sequence[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+    run_parser = commands.add_parser("run", help="Generate decks")
+    run_parser.add_argument(
+        "--deck",
+        action="append",
+        required=True,
+        type=DeckRequest.parse,
+        help="kind:input:output[:target language:native language], repeatable",
+    )
+    run_parser.add_argument("--shards", type=int, default=8)
+    run_parser.add_argument("--queue", choices=("local", "postgres"), default="local")
+    run_parser.add_argument("--no-response-cache", action="store_true")
+    work_parser = commands.add_parser("work", help="Work on the shards queued in Postgres")
+    work_parser.add_argument(
+        "--poll", type=float, default=None, help="Wait for new shards instead of exiting"
+    )
+    for command in (run_parser, work_parser):
+        command.add_argument("--processes", type=int, default=os.cpu_count() or 1)
+        command.add_argument(
+            "--rate-share", type=int, default=None, help="Workers over all nodes sharing the rate limits"
+        )
+        command.add_argument("--lease-seconds", type=float, default=600.0)
+    args = parser.parse_args(argv)
+
+    if args.command == "work":
+        print(f"Finished {work(args.processes, args.rate_share, args.lease_seconds, args.poll)} shards")
+        return
+    use_cache = not args.no_response_cache
+    if args.queue == "postgres":
+        totals = run_queued(
+            args.deck, args.shards, args.processes, args.rate_share, args.lease_seconds, use_cache
+        )
+    else:
+        totals = run_local(args.deck, args.shards, args.processes, use_cache)
+    for output, counts in totals.items():
+        print(f"{output}: {counts}")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,75 @@
+import threading
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Generic, Hashable, TypeVar
+
+from phi.agent import Agent
+
+T = TypeVar("T")
+
+
+class SingleFlight(Generic[T]):
+    """Coalesces concurrent calls that share a key into one call.
+
+    The first caller for a key runs the function; callers arriving with the same key while
+    it is still running wait for it and receive the same result, or the same exception.
+    Nothing is remembered once the call returns, so a later call runs again (pair this with
+    a cache for that).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._in_flight: Dict[Hashable, "Future[T]"] = {}
+        self.calls = 0
+        self.shared = 0
+
+    def do(self, key: Hashable, fn: Callable[[], T]) -> T:
+        with self._lock:
+            waiting = self._in_flight.get(key)
+            if waiting is None:
+                future: "Future[T]" = Future()
+                self._in_flight[key] = future
+                self.calls += 1
+            else:
+                self.shared += 1
+        if waiting is not None:
+            return waiting.result()
+
+        try:
+            result = fn()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+
+    def stats(self) -> Dict[str, int]:
+        return {"calls": self.calls, "shared": self.shared}
+
+
+# Shared by every copy of every `SingleFlightAgent`; keys include the agent's scope
+_agent_flight: SingleFlight[Any] = SingleFlight()
+
+
+class SingleFlightAgent(Agent):
+    """An `Agent` whose concurrent non-streaming runs of the same message share one model call.
+
+    Meant for agents without storage or history, such as the generators served in the
+    playground, where any copy of the agent answers a message the same way. Every caller
+    receives the same (read-only) `RunResponse`. Streaming runs and runs with images or
+    explicit messages go to the model as usual.
+    """
+
+    def run(self, message=None, *, stream=False, **kwargs):
+        if stream or not isinstance(message, str) or kwargs.get("images") or kwargs.get("messages"):
+            return super().run(message, stream=stream, **kwargs)
+        # Imported here: agents.cache imports this module
+        from agents.cache import agent_scope, normalize_text
+
+        key = (agent_scope(self), normalize_text(message))
+        return _agent_flight.do(
+            key, lambda: super(SingleFlightAgent, self).run(message, stream=False, **kwargs)
+        )
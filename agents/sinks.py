@@ -0,0 +1,402 @@
+import csv
+import json
+import os
+from pathlib import Path
+from typing import Any, Iterable, List, Mapping, Optional, Sequence, TextIO, TypeVar, Union
+
+from pydantic import BaseModel
+
+from utils.log import logger
+from utils.metrics import metrics
+
+Row = Mapping[str, Any]
+SinkT = TypeVar("SinkT", bound="RowSink")
+
+
+def records_to_rows(records: Iterable[Union[BaseModel, Row]]) -> List[dict]:
+    """Convert pydantic records (e.g. `Flashcard`, `Grammar`) to plain row dicts."""
+    return [r.model_dump() if isinstance(r, BaseModel) else dict(r) for r in records]
+
+
+def _fsync(file) -> None:
+    file.flush()
+    os.fsync(file.fileno())
+
+
+class RowSink:
+    """Append-only destination for generated rows.
+
+    Each call to `write` costs O(rows written), regardless of how much is already in the
+    output. Sinks are context managers; leaving the block finalizes the output even when
+    the block raised, so rows written before a failure are kept.
+    """
+
+    def __init__(self, path: Union[str, Path, None], columns: Sequence[str]):
+        # None for sinks that do not write a file (see `DbSink`)
+        self.path: Optional[Path] = Path(path) if path is not None else None
+        self.columns = list(columns)
+        self.rows_written = 0
+
+    def write(self, rows: Iterable[Union[BaseModel, Row]], items: Optional[Sequence[Row]] = None) -> int:
+        """Append `rows`.
+
+        `items` are the input rows the rows were generated from, in the same order. Sinks
+        that key their rows on the input (see `DbSink`) use them; the others ignore them.
+        """
+        rows = records_to_rows(rows)
+        if items is not None and len(items) != len(rows):
+            raise ValueError(f"Got {len(items)} input rows for {len(rows)} rows")
+        if rows:
+            with metrics.time(f"sink.{type(self).__name__}"):
+                if items is None:
+                    self._write(rows)
+                else:
+                    self._write_generated(rows, items)
+            self.rows_written += len(rows)
+        return len(rows)
+
+    def _write(self, rows: List[dict]) -> None:
+        raise NotImplementedError
+
+    def _write_generated(self, rows: List[dict], items: Sequence[Row]) -> None:
+        self._write(rows)
+
+    def position(self) -> Optional[int]:
+        """How far the output on disk goes, for `truncate`; None when rewriting rows is harmless (upserts)."""
+        return None
+
+    def truncate(self, position: int) -> None:
+        """Cut the output back to an earlier `position()`, e.g. after a crash."""
+        raise NotImplementedError
+
+    def close(self) -> None:
+        pass
+
+    def __enter__(self: SinkT) -> SinkT:
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.close()
+
+
+class FileSink(RowSink):
+    """A sink writing to the file at `path`."""
+
+    path: Path
+
+    def __init__(self, path: Union[str, Path], columns: Sequence[str]):
+        super().__init__(path, columns)
+
+
+class _AppendFileSink(FileSink):
+    """A sink appending to one text file, whose position is its size in bytes."""
+
+    _file: TextIO
+
+    def position(self) -> Optional[int]:
+        # Every write is fsynced, so the size on disk is exactly what has been written
+        return os.fstat(self._file.fileno()).st_size
+
+    def truncate(self, position: int) -> None:
+        self._file.flush()
+        os.ftruncate(self._file.fileno(), position)
+        _fsync(self._file)
+
+    def close(self) -> None:
+        if not self._file.closed:
+            self._file.close()
+
+
+class CsvSink(_AppendFileSink):
+    """Appends rows to a CSV file, writing the header only when the file is new or empty."""
+
+    def __init__(self, path: Union[str, Path], columns: Sequence[str]):
+        super().__init__(path, columns)
+        is_new = not self.path.exists() or self.path.stat().st_size == 0
+        if not is_new:
+            # Keep the column order of the file we are appending to
+            with open(self.path, "r", encoding="utf-8", newline="") as f:
+                header = next(csv.reader(f), None)
+            if header:
+                self.columns = header
+        self._file = open(self.path, "a", encoding="utf-8", newline="")
+        self._writer = csv.DictWriter(self._file, fieldnames=self.columns, extrasaction="ignore")
+        if is_new:
+            self._writer.writeheader()
+            _fsync(self._file)
+
+    def _write(self, rows: List[dict]) -> None:
+        self._writer.writerows(rows)
+        _fsync(self._file)
+
+
+class JsonlSink(_AppendFileSink):
+    """Appends one JSON object per line."""
+
+    def __init__(self, path: Union[str, Path], columns: Sequence[str]):
+        super().__init__(path, columns)
+        self._file = open(self.path, "a", encoding="utf-8")
+
+    def _write(self, rows: List[dict]) -> None:
+        for row in rows:
+            self._file.write(json.dumps({c: row.get(c) for c in self.columns}, ensure_ascii=False) + "\n")
+        _fsync(self._file)
+
+
+class XlsxSink(FileSink):
+    """Writes an .xlsx workbook once, at close, from a crash-safe JSONL journal.
+
+    Rows are appended to `<path>.journal.jsonl` as they arrive. `close` streams any
+    existing workbook rows plus the journal into a write-only openpyxl workbook, swaps it
+    into place and removes the journal. If a previous run died before closing, its journal
+    is still on disk and is picked up by the next sink opened on the same path.
+    """
+
+    def __init__(self, path: Union[str, Path], columns: Sequence[str]):
+        super().__init__(path, columns)
+        self.journal_path = self.path.with_name(self.path.name + ".journal.jsonl")
+        if self.journal_path.exists():
+            logger.warning(f"Recovering unfinished rows from {self.journal_path}")
+        self._journal = JsonlSink(self.journal_path, self.columns)
+        self._closed = False
+
+    def _write(self, rows: List[dict]) -> None:
+        self._journal.write(rows)
+
+    def position(self) -> Optional[int]:
+        # Rows of an unfinished run are only in the journal until `close`
+        return self._journal.position()
+
+    def truncate(self, position: int) -> None:
+        self._journal.truncate(position)
+
+    def close(self) -> None:
+        if self._closed:
+            return
+        self._closed = True
+        self._journal.close()
+        self._finalize()
+
+    def _finalize(self) -> None:
+        from openpyxl import Workbook, load_workbook
+
+        workbook = Workbook(write_only=True)
+        sheet = workbook.create_sheet()
+        columns = self.columns
+        existing = None
+        if self.path.exists():
+            existing = load_workbook(self.path, read_only=True)
+            existing_rows = existing.active.iter_rows(values_only=True)
+            header = next(existing_rows, None)
+            if header:
+                columns = [str(c) for c in header]
+        sheet.append(columns)
+        if existing is not None:
+            for values in existing_rows:
+                sheet.append(list(values))
+            existing.close()
+        with open(self.journal_path, "r", encoding="utf-8") as journal:
+            for line in journal:
+                if line.strip():
+                    row = json.loads(line)
+                    sheet.append([row.get(c) for c in columns])
+
+        tmp_path = self.path.with_name(self.path.name + ".tmp")
+        workbook.save(tmp_path)
+        os.replace(tmp_path, self.path)
+        self.journal_path.unlink()
+
+
+class ParquetSink(FileSink):
+    """Writes rows to a Parquet file, one row group per `write`.
+
+    Parquet files cannot be appended to in place, so rows go to `<path>.tmp` and `close`
+    swaps it into place. The row groups of an existing file at `path` are copied over
+    first, so opening a sink on an existing file appends to it like the other sinks.
+    Columns are strings unless a pyarrow `schema` is given.
+    """
+
+    def __init__(self, path: Union[str, Path], columns: Sequence[str], schema: Optional[Any] = None):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        super().__init__(path, columns)
+        existing = pq.ParquetFile(self.path) if self.path.exists() else None
+        if schema is None:
+            schema = (
+                existing.schema_arrow
+                if existing is not None
+                else pa.schema([(c, pa.string()) for c in self.columns])
+            )
+        self.schema = schema
+        self.columns = list(schema.names)
+        self.tmp_path = self.path.with_name(self.path.name + ".tmp")
+        self._writer = pq.ParquetWriter(self.tmp_path, schema, use_dictionary=True, compression="zstd")
+        if existing is not None:
+            for index in range(existing.num_row_groups):
+                self._writer.write_table(existing.read_row_group(index).cast(schema))
+            existing.close()
+        self._closed = False
+
+    def _write(self, rows: List[dict]) -> None:
+        import pyarrow as pa
+
+        values = [{c: row.get(c) for c in self.columns} for row in rows]
+        self._writer.write_table(pa.Table.from_pylist(values, schema=self.schema))
+
+    def close(self) -> None:
+        if self._closed:
+            return
+        self._closed = True
+        self._writer.close()
+        os.replace(self.tmp_path, self.path)
+
+
+class DbSink(RowSink):
+    """Upserts rows into the deck tables (see db/tables/deck.py) instead of a file.
+
+    Each `write` is one transaction: the cards, the words they were generated for and any
+    local media they reference are upserted in bulk, keyed by deck and row key. The row key
+    is that of the input row (see `agents.checkpoint.item_key`), so regenerating a row
+    replaces its card rather than adding a second one, and each sense of a word keeps its
+    own card whatever word the model wrote back.
+    """
+
+    # Table and key field of each deck kind
+    KINDS = {"flashcards": ("flashcards", "word"), "grammars": ("grammars", "grammar")}
+
+    def __init__(
+        self,
+        deck_name: str,
+        kind: str = "flashcards",
+        columns: Optional[Sequence[str]] = None,
+        engine: Optional[Any] = None,
+        batch_size: int = 1000,
+        key_fields: Optional[Sequence[str]] = None,
+    ):
+        from db.tables import Base
+        from db.upsert import get_or_create_deck
+
+        if kind not in self.KINDS:
+            raise ValueError(f"Unsupported deck kind: {kind}")
+        table_name, self.key_field = self.KINDS[kind]
+        self.key_fields = list(key_fields) if key_fields is not None else [self.key_field, "meaning"]
+        self.table = Base.metadata.tables[f"public.{table_name}"]
+        self.words_table = Base.metadata.tables["public.words"]
+        self.media_table = Base.metadata.tables["public.media"]
+        self.normalized_field = f"normalized_{self.key_field}"
+
+        super().__init__(
+            None,
+            columns
+            if columns is not None
+            else [
+                c.name
+                for c in self.table.c
+                if c.name
+                not in ("id", "deck_id", "row_key", self.normalized_field, "created_at", "updated_at")
+            ],
+        )
+        self.deck_name = deck_name
+        self.batch_size = batch_size
+        if engine is None:
+            from db.session import get_db_engine
+
+            engine = get_db_engine()
+        self.engine = engine
+        with self.engine.begin() as connection:
+            self.deck_id = get_or_create_deck(connection, deck_name, kind)
+
+    def _write(self, rows: List[dict]) -> None:
+        # Without the input rows, the key fields of the records themselves are the row key
+        self._write_generated(rows, rows)
+
+    def _write_generated(self, rows: List[dict], items: Sequence[Row]) -> None:
+        from agents.cache import normalize_text
+        from agents.checkpoint import item_key
+        from db.upsert import bulk_upsert
+
+        cards, words, media = {}, {}, {}
+        for row, item in zip(rows, items):
+            key = item_key(dict(item), self.key_fields)
+            # A repeated row within one statement would conflict with itself, the last one wins
+            cards[key] = {
+                "deck_id": self.deck_id,
+                "row_key": key,
+                self.normalized_field: normalize_text(row[self.key_field]),
+                **{c: row.get(c) for c in self.columns if c in self.table.c},
+            }
+            words[key] = {
+                "deck_id": self.deck_id,
+                "row_key": key,
+                "word": item[self.key_fields[0]],
+                "normalized_word": normalize_text(item[self.key_fields[0]]),
+                "meaning": item.get("meaning", ""),
+            }
+            image = row.get("image_url")
+            if image and "://" not in image:
+                # Thumbnails of the local media store are named by their content hash
+                media[image] = {"name": image}
+
+        with self.engine.begin() as connection:
+            bulk_upsert(
+                connection,
+                self.words_table,
+                list(words.values()),
+                ["deck_id", "row_key"],
+                batch_size=self.batch_size,
+            )
+            bulk_upsert(
+                connection,
+                self.table,
+                list(cards.values()),
+                ["deck_id", "row_key"],
+                batch_size=self.batch_size,
+            )
+            bulk_upsert(connection, self.media_table, list(media.values()), ["name"], update_columns=())
+
+    def delete(self, keys: Iterable[str]) -> int:
+        """Remove the cards and words of the given row keys (e.g. `DeckDiff.removed`)."""
+        keys = list(keys)
+        if not keys:
+            return 0
+        deleted = 0
+        with self.engine.begin() as connection:
+            for start in range(0, len(keys), self.batch_size):
+                batch = keys[start : start + self.batch_size]
+                result = connection.execute(
+                    self.table.delete().where(
+                        self.table.c.deck_id == self.deck_id, self.table.c.row_key.in_(batch)
+                    )
+                )
+                deleted += result.rowcount
+                connection.execute(
+                    self.words_table.delete().where(
+                        self.words_table.c.deck_id == self.deck_id, self.words_table.c.row_key.in_(batch)
+                    )
+                )
+        return deleted
+
+
+def open_sink(
+    path: Union[str, Path], columns: Sequence[str], format: Optional[str] = None, schema: Optional[Any] = None
+) -> RowSink:
+    """Open an append-only sink, choosing the format from `format` or the file suffix.
+
+    `schema` is the pyarrow schema of Parquet output (see `agents.deck_format.arrow_schema`).
+    """
+    format = (format or Path(path).suffix.lstrip(".")).lower()
+    if format == "csv":
+        return CsvSink(path, columns)
+    if format in ("jsonl", "ndjson"):
+        return JsonlSink(path, columns)
+    if format == "xlsx":
+        return XlsxSink(path, columns)
+    if format == "parquet":
+        return ParquetSink(path, columns, schema=schema)
+    if format == "apkg":
+        # An .apkg is a zip written once on close and cannot be appended to across runs
+        raise ValueError(
+            "Anki packages are export-only: write the deck to another format and use export_deck"
+        )
+    raise ValueError(f"Unsupported sink format: {format}")
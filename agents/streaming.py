@@ -0,0 +1,176 @@
+from typing import Any, Dict, Generic, Iterator, List, Optional, Type, TypeVar
+
+from phi.agent import Agent
+from phi.model.openai import OpenAIChat
+from pydantic import BaseModel
+
+from agents.chunking import IncompleteResponseError
+from utils.metrics import metrics
+
+RecordT = TypeVar("RecordT", bound=BaseModel)
+
+
+class JsonArrayStreamParser(Generic[RecordT]):
+    """Incremental parser for `{"<array_key>": [{...}, {...}]}` arriving in arbitrary pieces.
+
+    `feed` returns each array element as a validated `record_type` as soon as its closing
+    brace has arrived. Only the text of the element currently being received is buffered,
+    so memory stays at the size of one record rather than the whole response.
+    """
+
+    def __init__(self, array_key: str, record_type: Type[RecordT]):
+        self.array_key = array_key
+        self.record_type = record_type
+        self.finished = False
+        self.records_parsed = 0
+        self._buffer = ""
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._string_start: Optional[int] = None
+        self._last_key: Optional[str] = None
+        self._array_depth: Optional[int] = None
+        self._object_start: Optional[int] = None
+
+    def feed(self, text: str) -> List[RecordT]:
+        buf = self._buffer + text
+        records: List[RecordT] = []
+        i = self._pos
+        while i < len(buf):
+            ch = buf[i]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                    if self._depth == 1 and self._array_depth is None and self._string_start is not None:
+                        self._last_key = buf[self._string_start : i]
+                    self._string_start = None
+            elif ch == '"':
+                self._in_string = True
+                self._string_start = i + 1
+            elif ch == "[" or ch == "{":
+                if ch == "[" and self._depth == 1 and self._array_depth is None and not self.finished:
+                    if self._last_key == self.array_key:
+                        self._array_depth = self._depth + 1
+                elif ch == "{" and self._array_depth is not None and self._depth == self._array_depth:
+                    self._object_start = i
+                self._depth += 1
+            elif ch == "]" or ch == "}":
+                self._depth -= 1
+                if self._array_depth is not None:
+                    if ch == "}" and self._depth == self._array_depth and self._object_start is not None:
+                        records.append(self.record_type.model_validate_json(buf[self._object_start : i + 1]))
+                        self.records_parsed += 1
+                        self._object_start = None
+                    elif ch == "]" and self._depth == self._array_depth - 1:
+                        self._array_depth = None
+                        self.finished = True
+            i += 1
+
+        # Drop everything that no longer belongs to an open record or key
+        cut = i
+        if self._object_start is not None:
+            cut = self._object_start
+        elif self._string_start is not None:
+            cut = self._string_start
+        self._buffer = buf[cut:]
+        self._pos = i - cut
+        if self._object_start is not None:
+            self._object_start -= cut
+        if self._string_start is not None:
+            self._string_start -= cut
+        return records
+
+
+def _strict_schema(schema: Any) -> Any:
+    # Structured outputs require closed objects with every property listed as required
+    if isinstance(schema, list):
+        return [_strict_schema(s) for s in schema]
+    if not isinstance(schema, dict):
+        return schema
+    schema = {k: _strict_schema(v) for k, v in schema.items() if not (k == "default" and v is None)}
+    if schema.get("type") == "object":
+        schema["additionalProperties"] = False
+        schema["required"] = list(schema.get("properties", {}))
+    return schema
+
+
+def response_format(response_model: Type[BaseModel]) -> Dict[str, Any]:
+    """The `response_format` of a strict structured-output request for `response_model`."""
+    return {
+        "type": "json_schema",
+        "json_schema": {
+            "name": response_model.__name__,
+            "schema": _strict_schema(response_model.model_json_schema()),
+            "strict": True,
+        },
+    }
+
+
+def openai_model(agent: Agent) -> OpenAIChat:
+    """The OpenAI chat model of `agent`, whose requests are rendered by hand here."""
+    if not isinstance(agent.model, OpenAIChat):
+        raise TypeError(f"Agent {agent.name} needs an OpenAIChat model, got {type(agent.model).__name__}")
+    return agent.model
+
+
+def render_messages(agent: Agent, prompt: str) -> List[Dict[str, Any]]:
+    """Render the system and user messages `agent` would send for `prompt`."""
+    agent.update_model()
+    messages = []
+    system_message = agent.get_system_message()
+    if system_message is not None:
+        messages.append(system_message.to_dict())
+    messages.append({"role": "user", "content": prompt})
+    return messages
+
+
+def stream_structured(
+    agent: Agent,
+    prompt: str,
+    array_key: str,
+    record_type: Type[RecordT],
+) -> Iterator[RecordT]:
+    """Run `prompt` on `agent`'s OpenAI model with streaming structured output.
+
+    Yields each record of `agent.response_model`'s `array_key` list as soon as it is
+    complete. Raises `IncompleteResponseError` after the last complete record if the
+    response was cut off. The token usage, sent in the last chunk of the stream, is
+    recorded in the metrics.
+    """
+    if agent.response_model is None:
+        raise ValueError(f"Agent {agent.name} has no response_model to stream")
+    messages = render_messages(agent, prompt)
+    model = openai_model(agent)
+    request_params = {
+        k: v for k, v in model.request_kwargs.items() if k not in ("response_format", "stream_options")
+    }
+    stream = model.get_client().chat.completions.create(
+        model=model.id,
+        messages=messages,  # type: ignore
+        response_format=response_format(agent.response_model),  # type: ignore
+        stream=True,
+        stream_options={"include_usage": True},
+        **request_params,
+    )
+
+    parser = JsonArrayStreamParser(array_key, record_type)
+    finish_reason = None
+    for chunk in stream:
+        if chunk.usage is not None:
+            metrics.record_llm_usage(model.id, chunk.usage.prompt_tokens, chunk.usage.completion_tokens)
+        if not chunk.choices:
+            continue
+        choice = chunk.choices[0]
+        if choice.delta.content:
+            yield from parser.feed(choice.delta.content)
+        finish_reason = choice.finish_reason or finish_reason
+
+    if finish_reason == "length" or not parser.finished:
+        raise IncompleteResponseError(
+            f"Stream ended ({finish_reason}) after {parser.records_parsed} complete {record_type.__name__} records"
+        )
@@ -2,6 +2,7 @@ from fastapi import FastAPI
 from starlette.middleware.cors import CORSMiddleware
 
 from api.settings import api_settings
+from api.routes.metrics import metrics_router
 from api.routes.v1_router import v1_router
 
 
@@ -24,6 +25,9 @@ def create_app() -> FastAPI:
     # Add v1 router
     app.include_router(v1_router)
 
+    # Add Prometheus metrics at the root, where scrapers look for them
+    app.include_router(metrics_router)
+
     # Add Middlewares
     app.add_middleware(
         CORSMiddleware,
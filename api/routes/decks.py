@@ -0,0 +1,153 @@
+import csv
+import io
+import json
+from enum import Enum
+from functools import lru_cache
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+from fastapi import APIRouter, File, Form, Header, HTTPException, UploadFile
+from fastapi.responses import StreamingResponse
+
+from agents.deck_jobs import DeckJob, DeckJobQueue
+from agents.settings import agent_settings
+
+######################################################
+## Router for deck generation jobs
+######################################################
+
+decks_router = APIRouter(prefix="/decks", tags=["Decks"])
+
+
+class DeckKind(str, Enum):
+    flashcards = "flashcards"
+    grammars = "grammars"
+
+
+# Field holding the word (or grammar point) in the uploaded rows, followed by its meaning
+KEY_FIELDS = {
+    DeckKind.flashcards: ("word", "meaning"),
+    DeckKind.grammars: ("grammar", "meaning"),
+}
+
+
+@lru_cache
+def get_deck_job_queue() -> DeckJobQueue:
+    """The job queue of this worker, created on the first deck request."""
+    return DeckJobQueue()
+
+
+@lru_cache
+def get_generator(kind: DeckKind, target_language: str, native_language: str) -> Any:
+    """Build a generator once per worker and language pair; generators are safe to share between jobs."""
+    from agents.cache import open_response_cache
+
+    response_cache = open_response_cache()
+    if kind == DeckKind.flashcards:
+        from agents.flascard_generator import FlashcardGenerator
+
+        return FlashcardGenerator(target_language, native_language, response_cache=response_cache)
+
+    from agents.grammar_generator import GrammarGenerator
+
+    return GrammarGenerator(target_language, native_language, response_cache=response_cache)
+
+
+def job_options(kind: DeckKind) -> Dict[str, Any]:
+    """Token packing and post-processing for a job, matching the command line scripts."""
+    from agents.chunking import TokenPacker
+
+    if kind == DeckKind.flashcards:
+        from agents.flascard_generator import attach_images, format_word
+
+        return {
+            "packer": TokenPacker(format_word, model_id=agent_settings.gpt_4o_mini),
+            "postprocess": attach_images if agent_settings.flashcard_images else None,
+        }
+
+    from agents.grammar_generator import format_grammar
+
+    return {"packer": TokenPacker(format_grammar, model_id=agent_settings.gpt_4)}
+
+
+def parse_word_list(text: str, key_fields: tuple) -> List[dict]:
+    """Parse an uploaded `word,meaning` list (the format of data/new-grammar.csv), one row per line."""
+    items = []
+    for line_number, row in enumerate(csv.reader(io.StringIO(text)), start=1):
+        if not row or not any(cell.strip() for cell in row):
+            continue
+        if len(row) < len(key_fields):
+            raise HTTPException(
+                status_code=400, detail=f"Line {line_number}: expected {', '.join(key_fields)}"
+            )
+        items.append({field: cell.strip() for field, cell in zip(key_fields, row)})
+    if not items:
+        raise HTTPException(status_code=400, detail="The uploaded word list is empty")
+    return items
+
+
+def get_job_or_404(job_id: str) -> DeckJob:
+    job = get_deck_job_queue().get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Deck job {job_id} not found")
+    return job
+
+
+@decks_router.post("", status_code=202)
+def create_deck(
+    file: UploadFile = File(..., description="CSV word list, one `word,meaning` row per line"),
+    kind: DeckKind = Form(DeckKind.flashcards),
+    target_language: str = Form("Japanese"),
+    native_language: str = Form("Vietnamese"),
+):
+    """Enqueue a deck generation job and return immediately; follow it at `/decks/{id}/events`"""
+
+    # A plain function runs on the threadpool, so building a generator on first use does not stall the event loop
+    text = file.file.read().decode("utf-8-sig")
+    key_fields = KEY_FIELDS[kind]
+    items = parse_word_list(text, key_fields)
+    generator = get_generator(kind, target_language, native_language)
+    job = get_deck_job_queue().submit(
+        kind.value,
+        items,
+        generator.generate,
+        record_key_field=key_fields[0],
+        key_fields=key_fields,
+        stream=generator.stream if agent_settings.stream_records else None,
+        **job_options(kind),
+    )
+    return job.summary()
+
+
+@decks_router.get("/{job_id}")
+def get_deck(job_id: str, include_records: bool = False):
+    """Status of a deck job, optionally with the cards generated so far"""
+
+    job = get_job_or_404(job_id)
+    summary = job.summary()
+    if include_records:
+        summary["records"] = list(job.records)
+    return summary
+
+
+async def event_stream(job: DeckJob, after: int) -> AsyncIterator[str]:
+    async for event in job.subscribe(after=after):
+        if event is None:
+            # Comment line that keeps proxies from closing an idle connection
+            yield ": keepalive\n\n"
+            continue
+        yield f"id: {event.id}\nevent: {event.event}\ndata: {json.dumps(event.data, ensure_ascii=False)}\n\n"
+
+
+@decks_router.get("/{job_id}/events")
+async def stream_deck_events(job_id: str, last_event_id: Optional[int] = Header(None)):
+    """Server-sent events with the job status and each card as soon as it is generated
+
+    Reconnecting clients send `Last-Event-ID` and only receive the events they missed.
+    """
+
+    job = get_job_or_404(job_id)
+    return StreamingResponse(
+        event_stream(job, last_event_id or 0),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
@@ -19,3 +19,17 @@ def get_health():
         "path": "/health",
         "utc": current_utc_str(),
     }
+
+
+@health_check_router.get("/health/db-pool")
+def get_db_pool_health():
+    """Connection pool usage of this worker: connection counts, overflow and checkout waits"""
+    from db.session import pool_statuses
+
+    return {
+        "status": "success",
+        "router": "health",
+        "path": "/health/db-pool",
+        "utc": current_utc_str(),
+        "pools": pool_statuses(),
+    }
@@ -1,22 +1,47 @@
+import threading
 from os import getenv
+
+from phi.agent import Agent
 from phi.playground import Playground
 
-from agents.example import get_example_agent
-from agents.grammar_generator import GrammarGenerator
-from agents.flascard_generator import FlashcardGenerator
+from agents.registry import AgentRegistry
+
 ######################################################
 ## Router for the agent playground
 ######################################################
 
-example_agent = get_example_agent(debug_mode=True)
-grammar_generator_agent = (GrammarGenerator(debug_mode=True)).grammar_agent
-flashcard_generator_agent = (FlashcardGenerator(debug_mode=True)).related_sentence_agent
+# Agents are built on the first playground request, not when the API starts.
+# Each factory imports its own module so those imports are deferred too.
+
+
+def build_example_agent() -> Agent:
+    from agents.example import get_example_agent
+
+    return get_example_agent(debug_mode=True)
+
+
+def build_grammar_generator_agent() -> Agent:
+    from agents.grammar_generator import GrammarGenerator
+
+    return GrammarGenerator(debug_mode=True).grammar_agent
+
+
+def build_flashcard_generator_agent() -> Agent:
+    from agents.flascard_generator import FlashcardGenerator
+
+    return FlashcardGenerator(debug_mode=True).related_sentence_agent
+
+
+agent_registry = AgentRegistry()
+agent_registry.register("example-agent", build_example_agent)
+agent_registry.register("grammar-generator", build_grammar_generator_agent)
+agent_registry.register("flashcard-generator", build_flashcard_generator_agent)
 
 # Create a playground instance
-playground = Playground(agents=[example_agent, grammar_generator_agent, flashcard_generator_agent])
+playground = Playground(agents=agent_registry.lazy_list())
 
-# Log the playground endpoint with phidata.app
+# Log the playground endpoint with phidata.app, without holding up startup on the network call
 if getenv("RUNTIME_ENV") == "dev":
-    playground.create_endpoint("http://localhost:8000")
+    threading.Thread(target=playground.create_endpoint, args=("http://localhost:8000",), daemon=True).start()
 
 playground_router = playground.get_router()
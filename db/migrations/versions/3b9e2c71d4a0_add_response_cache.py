@@ -0,0 +1,53 @@
+"""Add response_cache table
+
+Revision ID: 3b9e2c71d4a0
+Revises:
+Create Date: 2026-10-18 09:12:44.512733
+
+"""
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = "3b9e2c71d4a0"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "response_cache",
+        sa.Column("key", sa.String(length=64), nullable=False),
+        sa.Column("record_type", sa.String(), nullable=False),
+        sa.Column("value", postgresql.JSONB(astext_type=sa.Text()), nullable=False),
+        sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.text("now()"), nullable=False),
+        sa.Column(
+            "last_used_at", sa.DateTime(timezone=True), server_default=sa.text("now()"), nullable=False
+        ),
+        sa.PrimaryKeyConstraint("key"),
+        schema="public",
+    )
+    op.create_index(
+        op.f("ix_public_response_cache_created_at"),
+        "response_cache",
+        ["created_at"],
+        unique=False,
+        schema="public",
+    )
+    op.create_index(
+        op.f("ix_public_response_cache_last_used_at"),
+        "response_cache",
+        ["last_used_at"],
+        unique=False,
+        schema="public",
+    )
+
+
+def downgrade() -> None:
+    op.drop_index(op.f("ix_public_response_cache_last_used_at"), table_name="response_cache", schema="public")
+    op.drop_index(op.f("ix_public_response_cache_created_at"), table_name="response_cache", schema="public")
+    op.drop_table("response_cache", schema="public")
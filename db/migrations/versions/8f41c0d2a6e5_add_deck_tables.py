@@ -0,0 +1,104 @@
+"""Add deck, word, flashcard, grammar and media tables
+
+Revision ID: 8f41c0d2a6e5
+Revises: 3b9e2c71d4a0
+Create Date: 2026-10-18 14:03:27.118402
+
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "8f41c0d2a6e5"
+down_revision = "3b9e2c71d4a0"
+branch_labels = None
+depends_on = None
+
+
+def card_columns(key: str) -> list:
+    return [
+        sa.Column("id", sa.BigInteger(), autoincrement=True, nullable=False),
+        sa.Column("deck_id", sa.BigInteger(), nullable=False),
+        sa.Column("row_key", sa.Text(), nullable=False),
+        sa.Column(key, sa.Text(), nullable=False),
+        sa.Column(f"normalized_{key}", sa.Text(), nullable=False),
+        sa.Column("meaning", sa.Text(), nullable=False),
+        sa.Column("example_sentences_1", sa.Text(), nullable=False),
+        sa.Column("meaning_example_sentences_1", sa.Text(), nullable=False),
+        sa.Column("example_sentences_2", sa.Text(), nullable=False),
+        sa.Column("meaning_example_sentences_2", sa.Text(), nullable=False),
+        sa.Column("image_url", sa.Text(), nullable=True),
+        sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.text("now()"), nullable=False),
+        sa.Column("updated_at", sa.DateTime(timezone=True), server_default=sa.text("now()"), nullable=False),
+        sa.ForeignKeyConstraint(["deck_id"], ["public.decks.id"], ondelete="CASCADE"),
+        sa.PrimaryKeyConstraint("id"),
+    ]
+
+
+def upgrade() -> None:
+    op.create_table(
+        "decks",
+        sa.Column("id", sa.BigInteger(), autoincrement=True, nullable=False),
+        sa.Column("name", sa.String(), nullable=False),
+        sa.Column("kind", sa.String(length=32), nullable=False),
+        sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.text("now()"), nullable=False),
+        sa.Column("updated_at", sa.DateTime(timezone=True), server_default=sa.text("now()"), nullable=False),
+        sa.PrimaryKeyConstraint("id"),
+        sa.UniqueConstraint("name"),
+        schema="public",
+    )
+    op.create_table(
+        "media",
+        sa.Column("id", sa.BigInteger(), autoincrement=True, nullable=False),
+        sa.Column("name", sa.String(), nullable=False),
+        sa.Column("source_url", sa.Text(), nullable=True),
+        sa.Column("size_bytes", sa.BigInteger(), nullable=True),
+        sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.text("now()"), nullable=False),
+        sa.PrimaryKeyConstraint("id"),
+        sa.UniqueConstraint("name"),
+        schema="public",
+    )
+    op.create_table(
+        "words",
+        sa.Column("id", sa.BigInteger(), autoincrement=True, nullable=False),
+        sa.Column("deck_id", sa.BigInteger(), nullable=False),
+        sa.Column("row_key", sa.Text(), nullable=False),
+        sa.Column("word", sa.Text(), nullable=False),
+        sa.Column("normalized_word", sa.Text(), nullable=False),
+        sa.Column("meaning", sa.Text(), nullable=False),
+        sa.Column("position", sa.Integer(), nullable=True),
+        sa.Column("updated_at", sa.DateTime(timezone=True), server_default=sa.text("now()"), nullable=False),
+        sa.ForeignKeyConstraint(["deck_id"], ["public.decks.id"], ondelete="CASCADE"),
+        sa.PrimaryKeyConstraint("id"),
+        schema="public",
+    )
+    op.create_index("uq_words_deck_id_row_key", "words", ["deck_id", "row_key"], unique=True, schema="public")
+    op.create_table("flashcards", *card_columns("word"), schema="public")
+    op.create_index(
+        "uq_flashcards_deck_id_row_key", "flashcards", ["deck_id", "row_key"], unique=True, schema="public"
+    )
+    op.create_index(
+        "ix_flashcards_normalized_word", "flashcards", ["normalized_word"], unique=False, schema="public"
+    )
+    op.create_table("grammars", *card_columns("grammar"), schema="public")
+    op.create_index(
+        "uq_grammars_deck_id_row_key", "grammars", ["deck_id", "row_key"], unique=True, schema="public"
+    )
+    op.create_index(
+        "ix_grammars_normalized_grammar", "grammars", ["normalized_grammar"], unique=False, schema="public"
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_grammars_normalized_grammar", table_name="grammars", schema="public")
+    op.drop_index("uq_grammars_deck_id_row_key", table_name="grammars", schema="public")
+    op.drop_table("grammars", schema="public")
+    op.drop_index("ix_flashcards_normalized_word", table_name="flashcards", schema="public")
+    op.drop_index("uq_flashcards_deck_id_row_key", table_name="flashcards", schema="public")
+    op.drop_table("flashcards", schema="public")
+    op.drop_index("uq_words_deck_id_row_key", table_name="words", schema="public")
+    op.drop_table("words", schema="public")
+    op.drop_table("media", schema="public")
+    op.drop_table("decks", schema="public")
@@ -0,0 +1,56 @@
+"""Add the deck shard work queue
+
+Revision ID: c52e7a9b13f4
+Revises: 8f41c0d2a6e5
+Create Date: 2026-10-18 16:41:09.532117
+
+"""
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = "c52e7a9b13f4"
+down_revision = "8f41c0d2a6e5"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "deck_shards",
+        sa.Column("id", sa.BigInteger(), autoincrement=True, nullable=False),
+        sa.Column("run_id", sa.String(length=32), nullable=False),
+        sa.Column("output", sa.Text(), nullable=False),
+        sa.Column("shard", sa.Integer(), nullable=False),
+        sa.Column("shards", sa.Integer(), nullable=False),
+        sa.Column("task", postgresql.JSONB(astext_type=sa.Text()), nullable=False),
+        sa.Column("status", sa.String(length=16), server_default="pending", nullable=False),
+        sa.Column("worker", sa.String(), nullable=True),
+        sa.Column("attempts", sa.Integer(), server_default="0", nullable=False),
+        sa.Column("lease_expires_at", sa.DateTime(timezone=True), nullable=True),
+        sa.Column("counts", postgresql.JSONB(astext_type=sa.Text()), nullable=True),
+        sa.Column("error", sa.Text(), nullable=True),
+        sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.text("now()"), nullable=False),
+        sa.Column("updated_at", sa.DateTime(timezone=True), server_default=sa.text("now()"), nullable=False),
+        sa.PrimaryKeyConstraint("id"),
+        schema="public",
+    )
+    op.create_index(
+        "uq_deck_shards_run_id_output_shard",
+        "deck_shards",
+        ["run_id", "output", "shard"],
+        unique=True,
+        schema="public",
+    )
+    op.create_index(
+        "ix_deck_shards_status_id", "deck_shards", ["status", "id"], unique=False, schema="public"
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_deck_shards_status_id", table_name="deck_shards", schema="public")
+    op.drop_index("uq_deck_shards_run_id_output_shard", table_name="deck_shards", schema="public")
+    op.drop_table("deck_shards", schema="public")
@@ -1,17 +1,152 @@
-from typing import Generator
+import threading
+import time
+from functools import lru_cache
+from typing import Any, AsyncGenerator, Dict, Generator, Optional, cast
 
-from sqlalchemy.engine import Engine, create_engine
+from sqlalchemy.engine import Engine, create_engine, make_url
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
 
 from db.settings import db_settings
 
-# Create SQLAlchemy Engine using a database URL
-db_url: str = db_settings.get_db_url()
-db_engine: Engine = create_engine(db_url, pool_pre_ping=True)
+# The database url, engines and session factories are created on first use rather than at import,
+# so processes that never touch the database (and API workers before their first query) skip that cost.
 
-# Create a SessionLocal class
-# https://fastapi.tiangolo.com/tutorial/sql-databases/#create-a-sessionlocal-class
-SessionLocal: sessionmaker[Session] = sessionmaker(autocommit=False, autoflush=False, bind=db_engine)
+
+class PoolMetrics:
+    """Checkout wait times of a connection pool, recorded by the `Timed*QueuePool` classes."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+
+    def record(self, waited: float, timed_out: bool) -> None:
+        with self._lock:
+            if timed_out:
+                self.timeouts += 1
+            else:
+                self.checkouts += 1
+            self.wait_seconds_total += waited
+            self.wait_seconds_max = max(self.wait_seconds_max, waited)
+
+    def snapshot(self) -> Dict[str, float]:
+        with self._lock:
+            return {
+                "checkouts": self.checkouts,
+                "checkout_timeouts": self.timeouts,
+                "checkout_wait_seconds_total": self.wait_seconds_total,
+                "checkout_wait_seconds_max": self.wait_seconds_max,
+            }
+
+
+class TimedQueuePool(QueuePool):
+    """QueuePool that records how long each checkout waited for a free connection."""
+
+    metrics: PoolMetrics
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.metrics = PoolMetrics()
+
+    def recreate(self) -> "TimedQueuePool":
+        pool = cast(TimedQueuePool, super().recreate())
+        pool.metrics = self.metrics
+        return pool
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except Exception:
+            self.metrics.record(time.perf_counter() - started, timed_out=True)
+            raise
+        self.metrics.record(time.perf_counter() - started, timed_out=False)
+        return connection
+
+
+class TimedAsyncQueuePool(TimedQueuePool, AsyncAdaptedQueuePool):
+    """`TimedQueuePool` for the async engine."""
+
+
+def pool_kwargs(url: str, async_engine: bool = False) -> Dict[str, Any]:
+    """Pool options from `db_settings`. In-memory SQLite (used in tests) keeps its default pool."""
+    if make_url(url).get_backend_name() == "sqlite" and make_url(url).database in (None, "", ":memory:"):
+        return {}
+    return {
+        "poolclass": TimedAsyncQueuePool if async_engine else TimedQueuePool,
+        "pool_size": db_settings.db_pool_size,
+        "max_overflow": db_settings.db_max_overflow,
+        "pool_timeout": db_settings.db_pool_timeout,
+        "pool_recycle": db_settings.db_pool_recycle,
+        # Reuse the most recently returned connection so idle ones can be recycled
+        "pool_use_lifo": True,
+    }
+
+
+def create_db_engine(url: str, **kwargs) -> Engine:
+    """Create a sync Engine with the pool settings from `db_settings`."""
+    return create_engine(url, pool_pre_ping=True, **{**pool_kwargs(url), **kwargs})
+
+
+def create_async_db_engine(url: str, **kwargs) -> AsyncEngine:
+    """Create an AsyncEngine with the pool settings from `db_settings`."""
+    return create_async_engine(url, pool_pre_ping=True, **{**pool_kwargs(url, async_engine=True), **kwargs})
+
+
+@lru_cache
+def get_db_url() -> str:
+    """Resolve the database URL once per process."""
+    return db_settings.get_db_url()
+
+
+@lru_cache
+def get_async_db_url() -> str:
+    """The database URL with the async driver."""
+    url = make_url(get_db_url())
+    if url.get_backend_name() == "postgresql":
+        url = url.set(drivername=db_settings.db_async_driver)
+    return url.render_as_string(hide_password=False)
+
+
+@lru_cache
+def get_db_engine() -> Engine:
+    """The Engine shared by everything in this process that talks to the database."""
+    return create_db_engine(get_db_url())
+
+
+@lru_cache
+def get_async_db_engine() -> AsyncEngine:
+    """The AsyncEngine of this process, created only if an async dependency is used."""
+    return create_async_db_engine(get_async_db_url())
+
+
+@lru_cache
+def get_session_local() -> "sessionmaker[Session]":
+    """Create the SessionLocal class once per process.
+
+    https://fastapi.tiangolo.com/tutorial/sql-databases/#create-a-sessionlocal-class
+    """
+    return sessionmaker(autocommit=False, autoflush=False, bind=get_db_engine())
+
+
+@lru_cache
+def get_async_session_local() -> "async_sessionmaker[AsyncSession]":
+    return async_sessionmaker(autoflush=False, expire_on_commit=False, bind=get_async_db_engine())
+
+
+def __getattr__(name: str) -> Any:
+    # Keep `from db.session import db_url, db_engine, SessionLocal` working, resolved lazily
+    if name == "db_url":
+        return get_db_url()
+    if name == "db_engine":
+        return get_db_engine()
+    if name == "SessionLocal":
+        return get_session_local()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 def get_db() -> Generator[Session, None, None]:
@@ -21,8 +156,46 @@ def get_db() -> Generator[Session, None, None]:
     Yields:
         Session: An SQLAlchemy database session.
     """
-    db: Session = SessionLocal()
+    db: Session = get_session_local()()
     try:
         yield db
     finally:
         db.close()
+
+
+async def get_async_db() -> AsyncGenerator[AsyncSession, None]:
+    """
+    Dependency to get an async database session.
+
+    Yields:
+        AsyncSession: An SQLAlchemy async database session.
+    """
+    async with get_async_session_local()() as db:
+        yield db
+
+
+def pool_status(engine: Any) -> Optional[Dict[str, float]]:
+    """Connection counts and checkout waits of an engine's pool, or None for pools without them."""
+    pool = engine.pool
+    if not isinstance(pool, QueuePool):
+        return None
+    status: Dict[str, float] = {
+        "size": pool.size(),
+        "checked_out": pool.checkedout(),
+        "checked_in": pool.checkedin(),
+        "overflow": max(pool.overflow(), 0),
+        "max_overflow": pool._max_overflow,
+    }
+    if isinstance(pool, TimedQueuePool):
+        status.update(pool.metrics.snapshot())
+    return status
+
+
+def pool_statuses() -> Dict[str, Optional[Dict[str, float]]]:
+    """Pool status of the engines this process has created so far, without creating any."""
+    statuses = {}
+    if get_db_engine.cache_info().currsize:
+        statuses["sync"] = pool_status(get_db_engine())
+    if get_async_db_engine.cache_info().currsize:
+        statuses["async"] = pool_status(get_async_db_engine().sync_engine)
+    return statuses
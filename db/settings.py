@@ -19,6 +19,15 @@ class DbSettings(BaseSettings):
     db_pass: Optional[str] = None
     db_database: Optional[str] = None
     db_driver: str = "postgresql+psycopg"
+    # Driver used by the async engine; psycopg 3 supports both
+    db_async_driver: str = "postgresql+psycopg"
+    # Connection pool of each worker process. Every API worker, agent storage and knowledge base in a
+    # process share it, so a deployment opens at most workers * (db_pool_size + db_max_overflow) connections
+    db_pool_size: int = 5
+    db_max_overflow: int = 5
+    # Seconds to wait for a free connection before giving up, and to keep a connection before replacing it
+    db_pool_timeout: float = 30
+    db_pool_recycle: int = 1800
     # Create/Upgrade database on startup using alembic
     migrate_db: bool = False
 
@@ -1 +1,4 @@
 from db.tables.base import Base
+from db.tables.response_cache import ResponseCacheEntry
+from db.tables.deck import Deck, FlashcardEntry, GrammarEntry, MediaEntry, Word
+from db.tables.deck_shard import DeckShard
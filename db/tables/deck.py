@@ -0,0 +1,101 @@
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy import BigInteger, DateTime, ForeignKey, Index, Integer, String, Text, func
+from sqlalchemy.orm import Mapped, mapped_column
+
+from db.tables.base import Base
+
+# SQLite only generates ids for INTEGER primary keys, which lets tests run the tables on it
+Id = BigInteger().with_variant(Integer, "sqlite")
+
+
+class Deck(Base):
+    """A named deck of flashcards or grammar cards."""
+
+    __tablename__ = "decks"
+
+    id: Mapped[int] = mapped_column(Id, primary_key=True, autoincrement=True)
+    name: Mapped[str] = mapped_column(String, nullable=False, unique=True)
+    kind: Mapped[str] = mapped_column(String(32), nullable=False)
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now())
+    updated_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), server_default=func.now(), onupdate=func.now()
+    )
+
+
+class Word(Base):
+    """An input row of a deck: the word (or grammar point) and the meaning it was given."""
+
+    __tablename__ = "words"
+    __table_args__ = (Index("uq_words_deck_id_row_key", "deck_id", "row_key", unique=True),)
+
+    id: Mapped[int] = mapped_column(Id, primary_key=True, autoincrement=True)
+    deck_id: Mapped[int] = mapped_column(ForeignKey("public.decks.id", ondelete="CASCADE"), nullable=False)
+    # The normalized key fields of the input row, e.g. word and meaning (see agents/checkpoint.py)
+    row_key: Mapped[str] = mapped_column(Text, nullable=False)
+    word: Mapped[str] = mapped_column(Text, nullable=False)
+    normalized_word: Mapped[str] = mapped_column(Text, nullable=False)
+    meaning: Mapped[str] = mapped_column(Text, nullable=False)
+    position: Mapped[Optional[int]] = mapped_column(Integer)
+    updated_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now())
+
+
+class FlashcardEntry(Base):
+    """A generated flashcard, one per input row (word and meaning) of a deck."""
+
+    __tablename__ = "flashcards"
+    __table_args__ = (
+        Index("uq_flashcards_deck_id_row_key", "deck_id", "row_key", unique=True),
+        Index("ix_flashcards_normalized_word", "normalized_word"),
+    )
+
+    id: Mapped[int] = mapped_column(Id, primary_key=True, autoincrement=True)
+    deck_id: Mapped[int] = mapped_column(ForeignKey("public.decks.id", ondelete="CASCADE"), nullable=False)
+    row_key: Mapped[str] = mapped_column(Text, nullable=False)
+    word: Mapped[str] = mapped_column(Text, nullable=False)
+    normalized_word: Mapped[str] = mapped_column(Text, nullable=False)
+    meaning: Mapped[str] = mapped_column(Text, nullable=False)
+    example_sentences_1: Mapped[str] = mapped_column(Text, nullable=False)
+    meaning_example_sentences_1: Mapped[str] = mapped_column(Text, nullable=False)
+    example_sentences_2: Mapped[str] = mapped_column(Text, nullable=False)
+    meaning_example_sentences_2: Mapped[str] = mapped_column(Text, nullable=False)
+    image_url: Mapped[Optional[str]] = mapped_column(Text)
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now())
+    updated_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now())
+
+
+class GrammarEntry(Base):
+    """A generated grammar card, one per input row (grammar point and meaning) of a deck."""
+
+    __tablename__ = "grammars"
+    __table_args__ = (
+        Index("uq_grammars_deck_id_row_key", "deck_id", "row_key", unique=True),
+        Index("ix_grammars_normalized_grammar", "normalized_grammar"),
+    )
+
+    id: Mapped[int] = mapped_column(Id, primary_key=True, autoincrement=True)
+    deck_id: Mapped[int] = mapped_column(ForeignKey("public.decks.id", ondelete="CASCADE"), nullable=False)
+    row_key: Mapped[str] = mapped_column(Text, nullable=False)
+    grammar: Mapped[str] = mapped_column(Text, nullable=False)
+    normalized_grammar: Mapped[str] = mapped_column(Text, nullable=False)
+    meaning: Mapped[str] = mapped_column(Text, nullable=False)
+    example_sentences_1: Mapped[str] = mapped_column(Text, nullable=False)
+    meaning_example_sentences_1: Mapped[str] = mapped_column(Text, nullable=False)
+    example_sentences_2: Mapped[str] = mapped_column(Text, nullable=False)
+    meaning_example_sentences_2: Mapped[str] = mapped_column(Text, nullable=False)
+    image_url: Mapped[Optional[str]] = mapped_column(Text)
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now())
+    updated_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now())
+
+
+class MediaEntry(Base):
+    """A file of the local media store (see tools/media_store.py), named by its content hash."""
+
+    __tablename__ = "media"
+
+    id: Mapped[int] = mapped_column(Id, primary_key=True, autoincrement=True)
+    name: Mapped[str] = mapped_column(String, nullable=False, unique=True)
+    source_url: Mapped[Optional[str]] = mapped_column(Text)
+    size_bytes: Mapped[Optional[int]] = mapped_column(BigInteger)
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now())
@@ -0,0 +1,35 @@
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy import JSON, DateTime, Index, Integer, String, Text, func
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.orm import Mapped, mapped_column
+
+from db.tables.base import Base
+from db.tables.deck import Id
+
+
+class DeckShard(Base):
+    """One shard of a sharded deck run, queued for whichever worker claims it first (see agents/sharding.py)."""
+
+    __tablename__ = "deck_shards"
+    __table_args__ = (
+        Index("uq_deck_shards_run_id_output_shard", "run_id", "output", "shard", unique=True),
+        Index("ix_deck_shards_status_id", "status", "id"),
+    )
+
+    id: Mapped[int] = mapped_column(Id, primary_key=True, autoincrement=True)
+    run_id: Mapped[str] = mapped_column(String(32), nullable=False)
+    output: Mapped[str] = mapped_column(Text, nullable=False)
+    shard: Mapped[int] = mapped_column(Integer, nullable=False)
+    shards: Mapped[int] = mapped_column(Integer, nullable=False)
+    # The `ShardTask`: deck kind, language pair, input rows and checkpoint path
+    task: Mapped[dict] = mapped_column(JSON().with_variant(JSONB, "postgresql"), nullable=False)
+    status: Mapped[str] = mapped_column(String(16), nullable=False, server_default="pending")
+    worker: Mapped[Optional[str]] = mapped_column(String)
+    attempts: Mapped[int] = mapped_column(Integer, nullable=False, server_default="0")
+    lease_expires_at: Mapped[Optional[datetime]] = mapped_column(DateTime(timezone=True))
+    counts: Mapped[Optional[dict]] = mapped_column(JSON().with_variant(JSONB, "postgresql"))
+    error: Mapped[Optional[str]] = mapped_column(Text)
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now())
+    updated_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now())
@@ -0,0 +1,81 @@
+from typing import Iterator, List, Optional, Sequence, cast
+
+from sqlalchemy import Table, func, select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import Connection
+
+from db.tables.deck import Deck
+
+# Postgres refuses statements with more bind parameters than fit in a 16-bit count
+MAX_BIND_PARAMETERS = 65535
+
+
+def _insert(connection: Connection, table: Table):
+    if connection.dialect.name == "postgresql":
+        return postgresql.insert(table)
+    if connection.dialect.name == "sqlite":
+        return sqlite.insert(table)
+    raise ValueError(f"Upserts are not supported on {connection.dialect.name}")
+
+
+def _batches(rows: List[dict], batch_size: int) -> Iterator[List[dict]]:
+    for start in range(0, len(rows), batch_size):
+        yield rows[start : start + batch_size]
+
+
+def bulk_upsert(
+    connection: Connection,
+    table: Table,
+    rows: Sequence[dict],
+    index_elements: Sequence[str],
+    update_columns: Optional[Sequence[str]] = None,
+    batch_size: int = 1000,
+) -> int:
+    """Insert rows, updating the existing row wherever one conflicts on `index_elements`.
+
+    Each batch is sent as a single multi-row `INSERT ... ON CONFLICT` statement, so the cost
+    is one round-trip per batch whatever the number of rows. Every row must have the same keys.
+
+    Args:
+        connection: Connection to run the statements on, inside the caller's transaction.
+        table: Table to write to.
+        rows: Column values of each row.
+        index_elements: Columns of the unique index that identifies a row.
+        update_columns: Columns overwritten on conflict; defaults to every inserted column outside
+            the index. `updated_at`, when the table has it, is always set to the current time.
+            An empty sequence leaves existing rows untouched.
+        batch_size: Maximum rows per statement, lowered if needed to stay under the bind parameter limit.
+
+    Returns:
+        int: Number of rows sent.
+    """
+    rows = list(rows)
+    if not rows:
+        return 0
+    columns = list(rows[0])
+    if update_columns is None:
+        update_columns = [c for c in columns if c not in index_elements]
+    batch_size = max(1, min(batch_size, MAX_BIND_PARAMETERS // len(columns)))
+
+    for batch in _batches(rows, batch_size):
+        statement = _insert(connection, table).values(batch)
+        updates = {c: statement.excluded[c] for c in update_columns}
+        if updates and "updated_at" in table.c:
+            updates["updated_at"] = func.now()
+        if updates:
+            statement = statement.on_conflict_do_update(index_elements=list(index_elements), set_=updates)
+        else:
+            statement = statement.on_conflict_do_nothing(index_elements=list(index_elements))
+        connection.execute(statement)
+    return len(rows)
+
+
+def get_or_create_deck(connection: Connection, name: str, kind: str) -> int:
+    """Id of the deck called `name`, creating it if it does not exist yet."""
+    decks = cast(Table, Deck.__table__)
+    connection.execute(
+        _insert(connection, decks)
+        .values(name=name, kind=kind)
+        .on_conflict_do_nothing(index_elements=["name"])
+    )
+    return connection.execute(select(decks.c.id).where(decks.c.name == name)).scalar_one()
@@ -0,0 +1,158 @@
+"""
+Measure recall and latency of the knowledge base vector index for a range of parameters.
+
+Loads a synthetic corpus of clustered unit vectors into a scratch table, computes the exact
+nearest neighbors of each query in numpy, then builds every HNSW (m, ef_construction) and
+IVFFlat (lists) configuration and reports recall@k and query latency for each ef_search or
+probes value. Pick the cheapest row that reaches the recall you need and set the matching
+`knowledge_*` agent settings.
+
+Usage: python scripts/benchmark_knowledge.py [--rows 20000] [--dim 256] [--queries 200] [--k 10]
+"""
+
+import argparse
+import statistics
+import sys
+import time
+from pathlib import Path
+from typing import List
+
+import numpy as np
+from sqlalchemy import text
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from db.session import get_db_engine  # noqa: E402
+
+TABLE = "ai.knowledge_index_benchmark"
+
+
+def int_list(value: str) -> List[int]:
+    return [int(v) for v in value.split(",") if v]
+
+
+def synthetic_corpus(rows: int, dim: int, queries: int, clusters: int, seed: int):
+    """Clustered unit vectors, like embeddings of a corpus with a few topics, and queries near them."""
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dim)).astype(np.float32)
+    corpus = centers[rng.integers(clusters, size=rows)] + 0.6 * rng.standard_normal((rows, dim)).astype(
+        np.float32
+    )
+    probes = centers[rng.integers(clusters, size=queries)] + 0.6 * rng.standard_normal((queries, dim)).astype(
+        np.float32
+    )
+    corpus /= np.linalg.norm(corpus, axis=1, keepdims=True)
+    probes /= np.linalg.norm(probes, axis=1, keepdims=True)
+    return corpus, probes
+
+
+def vector_literal(vector: np.ndarray) -> str:
+    return "[" + ",".join(f"{x:.6f}" for x in vector) + "]"
+
+
+def load(engine, corpus: np.ndarray) -> None:
+    with engine.begin() as conn:
+        conn.execute(text("CREATE EXTENSION IF NOT EXISTS vector"))
+        conn.execute(text("CREATE SCHEMA IF NOT EXISTS ai"))
+        conn.execute(text(f"DROP TABLE IF EXISTS {TABLE}"))
+        conn.execute(
+            text(
+                f"CREATE UNLOGGED TABLE {TABLE} (id integer PRIMARY KEY, embedding vector({corpus.shape[1]}))"
+            )
+        )
+    raw = engine.raw_connection()
+    try:
+        with raw.cursor() as cur, cur.copy(f"COPY {TABLE} (id, embedding) FROM STDIN") as copy:
+            for i, vector in enumerate(corpus):
+                copy.write_row((i, vector_literal(vector)))
+        raw.commit()
+    finally:
+        raw.close()
+
+
+def build_index(engine, using: str, options: str) -> float:
+    started = time.perf_counter()
+    with engine.begin() as conn:
+        conn.execute(text("DROP INDEX IF EXISTS ai.knowledge_index_benchmark_embedding"))
+        conn.execute(text("SET LOCAL maintenance_work_mem = '1GB'"))
+        conn.execute(
+            text(
+                f"CREATE INDEX knowledge_index_benchmark_embedding ON {TABLE} "
+                f"USING {using} (embedding vector_cosine_ops) WITH ({options})"
+            )
+        )
+        conn.execute(text(f"ANALYZE {TABLE}"))
+    return time.perf_counter() - started
+
+
+def measure(engine, setting: str, value: int, queries: np.ndarray, truth: np.ndarray, k: int) -> dict:
+    latencies, hits = [], 0
+    with engine.connect() as conn:
+        conn.execute(text(f"SET LOCAL {setting} = {int(value)}"))
+        statement = text(f"SELECT id FROM {TABLE} ORDER BY embedding <=> CAST(:q AS vector) LIMIT :k")
+        for query, expected in zip(queries, truth):
+            started = time.perf_counter()
+            found = conn.execute(statement, {"q": vector_literal(query), "k": k}).scalars().all()
+            latencies.append(time.perf_counter() - started)
+            hits += len(set(found) & set(expected.tolist()))
+        conn.rollback()
+    latencies.sort()
+    return {
+        "recall": hits / (len(queries) * k),
+        "p50_ms": 1000 * statistics.median(latencies),
+        "p95_ms": 1000 * latencies[int(0.95 * (len(latencies) - 1))],
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, default=20000)
+    parser.add_argument("--dim", type=int, default=256)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--clusters", type=int, default=50)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--hnsw-m", type=int_list, default=[8, 16, 32])
+    parser.add_argument("--ef-construction", type=int_list, default=[64, 200])
+    parser.add_argument("--ef-search", type=int_list, default=[10, 20, 40, 80, 160])
+    parser.add_argument("--ivfflat-lists", type=int_list, default=[50, 100, 200])
+    parser.add_argument("--probes", type=int_list, default=[1, 5, 10, 20])
+    parser.add_argument("--keep-table", action="store_true", help="Leave the scratch table in place")
+    args = parser.parse_args()
+
+    corpus, queries = synthetic_corpus(args.rows, args.dim, args.queries, args.clusters, args.seed)
+    truth = np.argsort(-(queries @ corpus.T), axis=1)[:, : args.k]
+    engine = get_db_engine()
+    started = time.perf_counter()
+    load(engine, corpus)
+    print(f"Loaded {args.rows} x {args.dim} vectors in {time.perf_counter() - started:.1f}s")
+
+    print(f"{'index':<34} {'search':<16} {'recall@' + str(args.k):>10} {'p50 ms':>8} {'p95 ms':>8}")
+    try:
+        for m in args.hnsw_m:
+            for ef_construction in args.ef_construction:
+                build = build_index(engine, "hnsw", f"m = {m}, ef_construction = {ef_construction}")
+                label = f"hnsw m={m} efc={ef_construction} ({build:.0f}s)"
+                for ef_search in args.ef_search:
+                    r = measure(engine, "hnsw.ef_search", ef_search, queries, truth, args.k)
+                    print(
+                        f"{label:<34} {'ef_search=' + str(ef_search):<16} "
+                        f"{r['recall']:>10.3f} {r['p50_ms']:>8.2f} {r['p95_ms']:>8.2f}"
+                    )
+        for lists in args.ivfflat_lists:
+            build = build_index(engine, "ivfflat", f"lists = {lists}")
+            label = f"ivfflat lists={lists} ({build:.0f}s)"
+            for probes in args.probes:
+                r = measure(engine, "ivfflat.probes", probes, queries, truth, args.k)
+                print(
+                    f"{label:<34} {'probes=' + str(probes):<16} "
+                    f"{r['recall']:>10.3f} {r['p50_ms']:>8.2f} {r['p95_ms']:>8.2f}"
+                )
+    finally:
+        if not args.keep_table:
+            with engine.begin() as conn:
+                conn.execute(text(f"DROP TABLE IF EXISTS {TABLE}"))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+"""
+Measure API cold start: import-to-ready time of a fresh worker process.
+
+Each run starts a new interpreter, imports `api.main`, serves `/v1/health` and then the
+first playground request (which builds the agents). Reports the median over all runs.
+
+Usage: python scripts/benchmark_startup.py [--runs 5]
+"""
+
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+
+PROBE = """
+import json, time
+started = time.perf_counter()
+from api.main import app
+imported = time.perf_counter()
+from fastapi.testclient import TestClient
+client = TestClient(app)
+assert client.get("/v1/health").status_code == 200
+ready = time.perf_counter()
+client.get("/v1/playground/agents/get")
+first_agents = time.perf_counter()
+print(json.dumps({
+    "import": imported - started,
+    "ready": ready - started,
+    "first_playground_request": first_agents - ready,
+}))
+"""
+
+
+def run_once() -> dict:
+    result = subprocess.run(
+        [sys.executable, "-c", PROBE], cwd=REPO_ROOT, capture_output=True, text=True, check=True
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    samples = [run_once() for _ in range(args.runs)]
+    for metric in samples[0]:
+        values = [s[metric] for s in samples]
+        print(
+            f"{metric:>26}: median {statistics.median(values):.3f}s (min {min(values):.3f}s, max {max(values):.3f}s)"
+        )
+
+
+if __name__ == "__main__":
+    main()
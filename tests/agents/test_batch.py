@@ -0,0 +1,181 @@
+import json
+import re
+import threading
+
+import pytest
+
+from agents.batch import LocalBatchBackend, OfflineBatchRunner, parse_batch_output
+from agents.cache import ResponseCache
+from agents.checkpoint import JobManifest
+from agents.flascard_generator import Flashcard, FlashcardGenerator, FlashcardList, build_prompt
+from agents.sinks import JsonlSink
+from agents.streaming import openai_model
+
+KEY_FIELDS = ("word", "meaning")
+
+
+def stub_model(body):
+    """Answers a rendered flashcard request the way the model would, without network."""
+    prompt = body["messages"][-1]["content"]
+    cards = [
+        Flashcard(
+            word=word,
+            meaning=meaning,
+            example_sentences_1=f"{word} 1",
+            meaning_example_sentences_1="m1",
+            example_sentences_2=f"{word} 2",
+            meaning_example_sentences_2="m2",
+        )
+        for word, meaning in re.findall(r"Word: (.+?) - Meaning: (.+)", prompt)
+    ]
+    if any(card.word == "broken" for card in cards):
+        return '{"flashcards": [{"word": '
+    return FlashcardList(flashcards=cards).model_dump_json()
+
+
+def test_offline_run_through_local_backend(tmp_path):
+    words = [{"word": f"w{i}", "meaning": f"m{i}"} for i in range(23)] + [{"word": "broken", "meaning": "x"}]
+    manifest = JobManifest(tmp_path / "job.sqlite")
+    manifest.add_items(words, KEY_FIELDS)
+    agent = FlashcardGenerator("Japanese", "Vietnamese").related_sentence_agent
+    runner = OfflineBatchRunner(
+        manifest,
+        agent,
+        build_prompt,
+        array_key="flashcards",
+        record_key_field="word",
+        key_fields=KEY_FIELDS,
+        backend=LocalBatchBackend(tmp_path / "backend", stub_model),
+        workdir=tmp_path / "work",
+        chunk_size=10,
+        poll_interval=0.01,
+    )
+
+    with JsonlSink(tmp_path / "out.jsonl", list(Flashcard.model_fields)) as sink:
+        counts = runner.run(sink)
+
+    # The chunk holding the unparseable response fails as a whole and can be retried later
+    assert counts["done"] == 20 and counts["failed"] == 4
+    written = [json.loads(line)["word"] for line in (tmp_path / "out.jsonl").read_text().splitlines()]
+    assert written == [f"w{i}" for i in range(20)]
+
+    (input_file,) = (tmp_path / "work").glob("*.requests.jsonl")
+    request = json.loads(input_file.read_text().splitlines()[0])
+    assert request["url"] == "/v1/chat/completions"
+    assert request["body"]["model"] == openai_model(agent).id
+    assert request["body"]["response_format"]["type"] == "json_schema"
+    assert request["body"]["messages"][0]["role"] == "system"
+
+
+def test_parse_batch_output_reports_truncation(tmp_path):
+    path = tmp_path / "results.jsonl"
+    path.write_text(
+        json.dumps(
+            {
+                "custom_id": "chunk-0",
+                "response": {
+                    "status_code": 200,
+                    "body": {"choices": [{"finish_reason": "length", "message": {"content": "{"}}]},
+                },
+                "error": None,
+            }
+        )
+    )
+
+    results = parse_batch_output(path, FlashcardList, "flashcards")
+
+    assert type(results["chunk-0"]).__name__ == "IncompleteResponseError"
+
+
+def test_rerun_waits_for_the_batch_submitted_before_a_crash(tmp_path):
+    words = [{"word": f"w{i}", "meaning": f"m{i}"} for i in range(5)]
+    manifest = JobManifest(tmp_path / "job.sqlite")
+    manifest.add_items(words, KEY_FIELDS)
+    agent = FlashcardGenerator("Japanese", "Vietnamese").related_sentence_agent
+    answer = threading.Event()
+
+    def slow_model(body):
+        answer.wait()
+        return stub_model(body)
+
+    submitted = []
+
+    class CountingBackend(LocalBatchBackend):
+        def submit(self, input_path):
+            submitted.append(input_path)
+            return super().submit(input_path)
+
+    backend = CountingBackend(tmp_path / "backend", slow_model)
+
+    def runner(timeout):
+        return OfflineBatchRunner(
+            manifest,
+            agent,
+            build_prompt,
+            array_key="flashcards",
+            record_key_field="word",
+            key_fields=KEY_FIELDS,
+            backend=backend,
+            workdir=tmp_path / "work",
+            chunk_size=2,
+            poll_interval=0.01,
+            timeout=timeout,
+        )
+
+    # The first run gives up while the batch is still in progress
+    with pytest.raises(TimeoutError):
+        runner(timeout=0).run(None)
+    answer.set()
+    assert runner(timeout=10).run(None)["done"] == 5
+    assert len(submitted) == 1
+    assert manifest.submitted_batch() is None
+
+
+def test_cached_rows_skip_the_batch_and_every_row_is_postprocessed(tmp_path):
+    words = [{"word": f"w{i}", "meaning": f"m{i}"} for i in range(4)]
+    manifest = JobManifest(tmp_path / "job.sqlite")
+    manifest.add_items(words, KEY_FIELDS)
+    agent = FlashcardGenerator("Japanese", "Vietnamese").related_sentence_agent
+    cache = ResponseCache(tmp_path / "cache.sqlite")
+    (cached,) = FlashcardList.model_validate_json(
+        stub_model({"messages": [{"content": build_prompt(words[:1])}]})
+    ).flashcards
+    cache.put_many({cache.make_key("scope", "w0", "m0"): cached})
+    requested = []
+
+    def counting_model(body):
+        requested.append(body["messages"][-1]["content"])
+        return stub_model(body)
+
+    def add_images(cards):
+        for card in cards:
+            card.image_url = f"{card.word}.jpg"
+
+    runner = OfflineBatchRunner(
+        manifest,
+        agent,
+        build_prompt,
+        array_key="flashcards",
+        record_key_field="word",
+        key_fields=KEY_FIELDS,
+        backend=LocalBatchBackend(tmp_path / "backend", counting_model),
+        workdir=tmp_path / "work",
+        poll_interval=0.01,
+        postprocess=add_images,
+        response_cache=cache,
+        cache_scope="scope",
+        record_type=Flashcard,
+    )
+
+    with JsonlSink(tmp_path / "out.jsonl", list(Flashcard.model_fields)) as sink:
+        assert runner.run(sink)["done"] == 4
+
+    assert len(requested) == 1 and "w0" not in requested[0]
+    rows = [json.loads(line) for line in (tmp_path / "out.jsonl").read_text().splitlines()]
+    assert sorted((row["word"], row["image_url"]) for row in rows) == [
+        (f"w{i}", f"w{i}.jpg") for i in range(4)
+    ]
+    # Records of the batch are cached for the next run, without the images added afterwards
+    fresh = cache.get_many([cache.make_key("scope", "w3", "m3")], Flashcard)
+    assert [card.image_url for card in fresh.values()] == [None]
+    cache.close()
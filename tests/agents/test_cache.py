@@ -0,0 +1,137 @@
+import time
+
+from agents.cache import ResponseCache, run_cached, stream_cached
+from agents.flascard_generator import Flashcard
+
+
+def make_card(word: str) -> Flashcard:
+    return Flashcard(
+        word=word,
+        meaning=f"{word} meaning",
+        example_sentences_1="s1",
+        meaning_example_sentences_1="m1",
+        example_sentences_2="s2",
+        meaning_example_sentences_2="m2",
+    )
+
+
+class StubGenerator:
+    def __init__(self):
+        self.requested = []
+
+    def __call__(self, items):
+        self.requested.extend(item["word"] for item in items)
+        return [make_card(item["word"]) for item in items]
+
+
+def run(cache, stub, words, scope="scope"):
+    items = [{"word": w, "meaning": "m"} for w in words]
+    return run_cached(cache, scope, items, ("word", "meaning"), Flashcard, "word", stub)
+
+
+def test_rerun_is_served_from_cache(tmp_path):
+    cache = ResponseCache(tmp_path / "cache.sqlite")
+    stub = StubGenerator()
+
+    run(cache, stub, ["見ます", "探します"])
+    result = run(cache, stub, ["探します", "見ます", "捜します"])
+
+    assert [c.word for c in result] == ["探します", "見ます", "捜します"]
+    assert stub.requested == ["見ます", "探します", "捜します"]
+    assert cache.stats()["hits"] == 2
+    assert cache.stats()["misses"] == 3
+
+
+def test_scope_and_normalization(tmp_path):
+    cache = ResponseCache(tmp_path / "cache.sqlite")
+    stub = StubGenerator()
+
+    run(cache, stub, ["Word"])
+    run(cache, stub, [" word "])
+    run(cache, stub, ["word"], scope="other-model")
+
+    assert stub.requested == ["Word", "word"]
+
+
+def test_ttl_and_lru_eviction(tmp_path):
+    cache = ResponseCache(tmp_path / "cache.sqlite", ttl_seconds=3600, max_entries=2)
+    stub = StubGenerator()
+
+    run(cache, stub, ["a", "b"])
+    time.sleep(0.01)
+    run(cache, stub, ["a"])  # touch "a" so "b" is least recently used
+    time.sleep(0.01)
+    run(cache, stub, ["c"])
+    run(cache, stub, ["a", "b"])
+    assert stub.requested == ["a", "b", "c", "b"]
+
+    expired = ResponseCache(tmp_path / "cache.sqlite", ttl_seconds=0)
+    time.sleep(0.01)
+    run(expired, stub, ["a"])
+    assert stub.requested[-1] == "a"
+
+
+def test_puts_keep_a_running_entry_count(tmp_path):
+    cache = ResponseCache(tmp_path / "cache.sqlite", max_entries=3, evict_interval=3600)
+    cache.put_many({"a": make_card("a"), "b": make_card("b")})
+    cache.put_many({"b": make_card("b")})  # replacing an entry does not add one
+    assert cache._entries == 2
+
+    cache.put_many({"c": make_card("c"), "d": make_card("d")})
+    (count,) = cache._conn.execute("SELECT COUNT(*) FROM responses").fetchone()
+    assert cache._entries == count == 3
+    cache.close()
+
+    # Reopening counts the entries already on disk
+    assert ResponseCache(tmp_path / "cache.sqlite")._entries == 3
+
+
+def test_records_are_matched_by_word_not_position(tmp_path):
+    cache = ResponseCache(tmp_path / "cache.sqlite")
+
+    def reordered(items):
+        # The model swaps the two cards and renames the third one
+        cards = [make_card(item["word"]) for item in items]
+        cards[2] = make_card("別の単語")
+        return [cards[1], cards[0], cards[2]]
+
+    result = run(cache, reordered, ["見ます", "探します", "捜します"])
+    assert [c.word for c in result] == ["見ます", "探します", "別の単語"]
+
+    stub = StubGenerator()
+    result = run(cache, stub, ["見ます", "探します", "捜します"])
+    assert [c.word for c in result] == ["見ます", "探します", "捜します"]
+    # Only the renamed card was left out of the cache
+    assert stub.requested == ["捜します"]
+
+
+def test_streamed_records_are_cached_as_they_arrive(tmp_path):
+    cache = ResponseCache(tmp_path / "cache.sqlite")
+    run(cache, StubGenerator(), ["見ます"])
+    items = [{"word": w, "meaning": "m"} for w in ["探します", "見ます", "捜します"]]
+    streamed = []
+
+    def stream(todo):
+        for item in todo:
+            streamed.append(item["word"])
+            yield make_card(item["word"])
+            if item["word"] == "探します":
+                raise ValueError("stream cut off")
+
+    records = stream_cached(cache, "scope", items, ("word", "meaning"), Flashcard, "word", stream)
+    # The cached card comes first, then each streamed one as soon as it is yielded
+    assert next(records).word == "見ます"
+    assert next(records).word == "探します"
+    try:
+        next(records)
+    except ValueError:
+        pass
+    assert streamed == ["探します"]
+
+    stub = StubGenerator()
+    assert [c.word for c in run(cache, stub, ["探します", "見ます", "捜します"])] == [
+        "探します",
+        "見ます",
+        "捜します",
+    ]
+    assert stub.requested == ["捜します"]
@@ -0,0 +1,147 @@
+import json
+import time
+
+import pytest
+
+from agents.checkpoint import JobManifest, JobRunner, WordStatus
+from agents.flascard_generator import Flashcard
+from agents.scheduler import ChunkScheduler
+from agents.sinks import JsonlSink
+
+KEY_FIELDS = ("word", "meaning")
+
+
+def make_card(word: str) -> Flashcard:
+    return Flashcard(
+        word=word,
+        meaning="m",
+        example_sentences_1="s1",
+        meaning_example_sentences_1="m1",
+        example_sentences_2="s2",
+        meaning_example_sentences_2="m2",
+    )
+
+
+def make_runner(manifest, generate, **kwargs):
+    return JobRunner(
+        manifest,
+        generate,
+        record_key_field="word",
+        key_fields=KEY_FIELDS,
+        chunk_size=4,
+        base_delay=0,
+        scheduler_factory=lambda worker: ChunkScheduler(worker, concurrency=2),
+        sleep=lambda seconds: None,
+        **kwargs,
+    )
+
+
+def test_bad_row_is_isolated_by_splitting(tmp_path):
+    calls = []
+
+    def generate(items):
+        calls.append([i["word"] for i in items])
+        if any(i["word"] == "bad" for i in items):
+            raise ValueError("truncated response")
+        return [make_card(i["word"]) for i in items]
+
+    manifest = JobManifest(tmp_path / "job.sqlite")
+    manifest.add_items([{"word": w, "meaning": "m"} for w in ["a", "b", "bad", "c", "d"]], KEY_FIELDS)
+    with JsonlSink(tmp_path / "out.jsonl", list(Flashcard.model_fields)) as sink:
+        counts = make_runner(manifest, generate, max_attempts=3).run(sink)
+
+    assert counts["done"] == 4 and counts["failed"] == 1
+    assert calls[0] == ["a", "b", "bad", "c"]
+    assert ["a", "b"] in calls and ["bad"] in calls
+    assert sink.rows_written == 4
+
+
+def test_resume_only_runs_unfinished_rows(tmp_path):
+    words = [{"word": f"w{i}", "meaning": "m"} for i in range(10)]
+    manifest = JobManifest(tmp_path / "job.sqlite")
+    manifest.add_items(words, KEY_FIELDS)
+    # Simulate a crash: three rows finished, one was in flight
+    states = manifest.remaining()
+    manifest.mark(states[:3], WordStatus.done)
+    manifest.mark(states[3:4], WordStatus.in_flight)
+    manifest.close()
+
+    seen: list[str] = []
+
+    def generate(items):
+        seen.extend(i["word"] for i in items)
+        return [make_card(i["word"]) for i in items]
+
+    resumed = JobManifest(tmp_path / "job.sqlite")
+    assert resumed.add_items(words, KEY_FIELDS) == 0
+    with JsonlSink(tmp_path / "out.jsonl", list(Flashcard.model_fields)) as sink:
+        counts = make_runner(resumed, generate).run(sink)
+
+    assert seen == [f"w{i}" for i in range(3, 10)]
+    assert counts["done"] == 10
+
+
+def test_rows_written_before_a_crash_are_not_written_twice(tmp_path):
+    words = [{"word": f"w{i}", "meaning": "m"} for i in range(8)]
+    manifest = JobManifest(tmp_path / "job.sqlite")
+    manifest.add_items(words, KEY_FIELDS)
+    chunks = []
+
+    def crash_on_second_chunk(done):
+        # Runs after the chunk is in the sink but before it is checkpointed as done
+        chunks.append(done)
+        if len(chunks) == 2:
+            raise KeyboardInterrupt
+
+    def generate(items):
+        return [make_card(i["word"]) for i in reversed(items)]
+
+    out = tmp_path / "out.jsonl"
+    with pytest.raises(KeyboardInterrupt):
+        with JsonlSink(out, list(Flashcard.model_fields)) as sink:
+            make_runner(manifest, generate, on_done=crash_on_second_chunk).run(sink)
+    assert len(out.read_text().splitlines()) == 8
+
+    with JsonlSink(out, list(Flashcard.model_fields)) as sink:
+        assert make_runner(manifest, generate).run(sink)["done"] == 8
+    written = [json.loads(line)["word"] for line in out.read_text().splitlines()]
+    assert written == [f"w{i}" for i in range(8)]
+
+
+def test_streamed_records_are_written_before_their_chunk_finishes(tmp_path):
+    words = [{"word": w, "meaning": "m"} for w in ["a", "b", "c", "d", "e"]]
+    manifest = JobManifest(tmp_path / "job.sqlite")
+    manifest.add_items(words, KEY_FIELDS)
+    written: list[str] = []
+    retried = []
+
+    def stream(items):
+        for item in items:
+            if item["word"] == "c":
+                # The stream is cut off: "c" and "d" are retried through generate
+                raise ValueError("stream ended early")
+            # Every earlier record has been written while this one is still being generated
+            earlier = [i["word"] for i in words[: words.index(item)]]
+            deadline = time.monotonic() + 1
+            while written != earlier and time.monotonic() < deadline:
+                time.sleep(0.005)
+            assert written == earlier
+            yield make_card(item["word"])
+
+    def generate(items):
+        retried.append([i["word"] for i in items])
+        return [make_card(i["word"]) for i in items]
+
+    runner = make_runner(
+        manifest,
+        generate,
+        stream=stream,
+        on_done=lambda done: written.extend(state.item["word"] for state, _ in done),
+    )
+    with JsonlSink(tmp_path / "out.jsonl", list(Flashcard.model_fields)) as sink:
+        counts = runner.run(sink)
+
+    assert counts["done"] == 5
+    assert written == ["a", "b", "c", "d", "e"]
+    assert retried == [["c"], ["d"]]
+    assert sink.rows_written == 5
@@ -0,0 +1,37 @@
+from agents.chunking import IncompleteResponseError, TokenPacker
+
+
+def make_packer(**kwargs):
+    # One token per character keeps the arithmetic obvious
+    return TokenPacker(
+        lambda item: item["word"],
+        count_tokens=len,
+        completion_overhead=0,
+        completion_ratio=1.0,
+        **kwargs,
+    )
+
+
+def test_packs_up_to_budget():
+    packer = make_packer(prompt_budget=1000, completion_budget=10, max_items=100)
+    items = [{"word": w} for w in ["aaaa", "bbb", "cc", "dddddddddddd", "e"]]
+
+    batches = packer.pack(items)
+
+    assert [[i["word"] for i in b] for b in batches] == [["aaaa", "bbb", "cc"], ["dddddddddddd"], ["e"]]
+
+
+def test_budget_shrinks_on_truncation_and_recovers():
+    packer = make_packer(prompt_budget=1000, completion_budget=8, max_items=100)
+    items = [{"word": "aa"} for _ in range(8)]
+
+    assert [len(b) for b in packer.pack(items)] == [4, 4]
+    packer.record_failure(IncompleteResponseError("truncated"))
+    assert [len(b) for b in packer.pack(items)] == [2, 2, 2, 2]
+
+    packer.record_failure(RuntimeError("network"))  # not a size failure
+    assert packer.completion_budget == 4
+
+    for _ in range(5):
+        packer.record_success()
+    assert packer.completion_budget == 8
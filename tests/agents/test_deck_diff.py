@@ -0,0 +1,99 @@
+import csv
+
+from agents.checkpoint import JobManifest, JobRunner
+from agents.deck_diff import DeckIndex
+from agents.flascard_generator import Flashcard
+from agents.scheduler import ChunkScheduler
+
+KEY_FIELDS = ("word", "meaning")
+
+
+def run_deck(tmp_path, words, config="v1"):
+    generated: list[str] = []
+
+    def generate(items):
+        generated.extend(i["word"] for i in items)
+        return [
+            Flashcard(
+                word=i["word"],
+                meaning=i["meaning"],
+                example_sentences_1=f"{i['word']} ({config})",
+                meaning_example_sentences_1="m1",
+                example_sentences_2="s2",
+                meaning_example_sentences_2="m2",
+            )
+            for i in items
+        ]
+
+    index = DeckIndex(tmp_path / "deck.index.sqlite")
+    diff = index.update(words, KEY_FIELDS, config=config)
+    manifest = JobManifest(tmp_path / "deck.job.sqlite")
+    manifest.requeue(index.pending(), KEY_FIELDS)
+    runner = JobRunner(
+        manifest,
+        generate,
+        record_key_field="word",
+        key_fields=KEY_FIELDS,
+        chunk_size=50,
+        scheduler_factory=lambda worker: ChunkScheduler(worker, concurrency=2),
+        on_done=index.store,
+    )
+    runner.run(None)
+    index.export(tmp_path / "deck.csv", Flashcard)
+    index.close()
+    manifest.close()
+    with open(tmp_path / "deck.csv", encoding="utf-8") as f:
+        rows = list(csv.DictReader(f))
+    return diff, generated, rows
+
+
+def test_only_added_and_changed_rows_are_regenerated(tmp_path):
+    words = [{"word": f"w{i}", "meaning": "m"} for i in range(1000)]
+    diff, generated, rows = run_deck(tmp_path, words)
+    assert len(diff.added) == 1000 and len(generated) == 1000 and len(rows) == 1000
+
+    edited = [dict(w) for w in words]
+    edited[10]["meaning"] = "new meaning"
+    edited[20]["word"] = "renamed"
+    del edited[30]
+    edited.insert(0, {"word": "first", "meaning": "m"})
+    diff, generated, rows = run_deck(tmp_path, edited)
+
+    # An edited meaning is a change of the same word; an edited word makes a new row and removes the old one
+    assert (len(diff.added), len(diff.changed), len(diff.removed), diff.unchanged) == (2, 1, 2, 997)
+    assert diff.renamed == {"w10\x1fm": "w10\x1fnew meaning"}
+    assert sorted(generated) == ["first", "renamed", "w10"]
+    assert [r["word"] for r in rows] == [w["word"] for w in edited]
+    assert rows[11]["meaning"] == "new meaning"
+
+
+def test_config_change_regenerates_everything(tmp_path):
+    words = [{"word": f"w{i}", "meaning": "m"} for i in range(5)]
+    run_deck(tmp_path, words, config="v1")
+    diff, generated, rows = run_deck(tmp_path, words, config="v2")
+    assert len(diff.changed) == 5 and len(generated) == 5
+    assert rows[0]["example_sentences_1"] == "w0 (v2)"
+
+    diff, generated, _ = run_deck(tmp_path, words, config="v2")
+    assert diff.unchanged == 5 and generated == []
+
+
+def test_senses_of_a_homograph_are_separate_rows(tmp_path):
+    words = [{"word": "やります", "meaning": "làm"}, {"word": "やります", "meaning": "cho"}]
+    diff, generated, rows = run_deck(tmp_path, words)
+    assert len(diff.added) == 2 and generated == ["やります", "やります"]
+    assert [r["meaning"] for r in rows] == ["làm", "cho"]
+
+
+def test_an_edited_sense_keeps_its_record_until_regenerated(tmp_path):
+    words = [{"word": "やります", "meaning": "làm"}, {"word": "やります", "meaning": "cho"}]
+    run_deck(tmp_path, words)
+
+    index = DeckIndex(tmp_path / "deck.index.sqlite")
+    edited = [words[0], {"word": "やります", "meaning": "tặng"}]
+    diff = index.update(edited, KEY_FIELDS, config="v1")
+    assert diff.changed == ["やります\x1ftặng"] and diff.renamed == {"やります\x1fcho": "やります\x1ftặng"}
+    assert diff.added == [] and diff.removed == []
+    assert index.pending() == [edited[1]]
+    assert [r.meaning for batch in index.records(Flashcard) for r in batch] == ["làm", "cho"]
+    index.close()
@@ -0,0 +1,80 @@
+import csv
+import zipfile
+
+import httpx
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from agents.deck_diff import DeckIndex
+from agents.deck_format import arrow_schema, deck_path, export_deck, iter_deck, read_deck, write_deck
+from agents.flascard_generator import Flashcard
+from agents.grammar_generator import Grammar
+from tools.media_store import MediaStore
+
+
+def card(word, image_url=None):
+    return Flashcard(
+        word=word,
+        meaning=f"nghĩa {word}",
+        example_sentences_1=f"{word}です。",
+        meaning_example_sentences_1="câu 1",
+        example_sentences_2=f"{word}があります。",
+        meaning_example_sentences_2="câu 2",
+        image_url=image_url,
+    )
+
+
+def test_schema_follows_the_record_fields():
+    schema = arrow_schema(Flashcard)
+    assert schema.names == list(Flashcard.model_fields)
+    assert schema.field("word").type == pa.string() and not schema.field("word").nullable
+    assert schema.field("image_url").nullable
+    assert schema.metadata[b"record_type"] == b"Flashcard"
+    assert arrow_schema(Grammar).names[0] == "grammar"
+    assert deck_path("data/new-grammar.xlsx").name == "new-grammar.parquet"
+
+
+def test_deck_round_trips_through_parquet_and_exports(tmp_path):
+    path = tmp_path / "deck.parquet"
+    batches = [[card("猫", "abc.jpg"), card("犬")], [card("鳥")]]
+    assert write_deck(path, iter(batches), Flashcard) == 3
+
+    parquet_file = pq.ParquetFile(path)
+    assert parquet_file.num_row_groups == 2
+    assert parquet_file.schema_arrow.equals(arrow_schema(Flashcard))
+    # Every column is dictionary encoded
+    assert "RLE_DICTIONARY" in parquet_file.metadata.row_group(0).column(1).encodings
+
+    assert read_deck(path, columns=["word"]).column("word").to_pylist() == ["猫", "犬", "鳥"]
+    assert [c for batch in iter_deck(path, Flashcard, batch_size=2) for c in batch] == [
+        card("猫", "abc.jpg"),
+        card("犬"),
+        card("鳥"),
+    ]
+
+    assert export_deck(path, tmp_path / "deck.csv") == 3
+    with open(tmp_path / "deck.csv", encoding="utf-8", newline="") as f:
+        rows = list(csv.DictReader(f))
+    assert list(rows[0]) == list(Flashcard.model_fields)
+    assert rows[1]["word"] == "犬" and rows[1]["image_url"] == ""
+
+
+def test_apkg_export_packs_the_media_the_deck_references(tmp_path):
+    store = MediaStore(root=tmp_path / "media", client=httpx.Client())
+    store.path_for("abc.jpg").parent.mkdir(parents=True)
+    store.path_for("abc.jpg").write_bytes(b"jpeg bytes")
+    path = deck_path(tmp_path / "deck.apkg")
+    write_deck(path, iter([[card("猫", "abc.jpg"), card("犬")]]), Flashcard)
+
+    assert export_deck(path, tmp_path / "deck.apkg", media_store=store) == 2
+    with zipfile.ZipFile(tmp_path / "deck.apkg") as apkg:
+        assert apkg.read("0") == b"jpeg bytes"
+    store.close()
+
+
+def test_deck_index_exports_parquet_with_the_canonical_schema(tmp_path):
+    index = DeckIndex(tmp_path / "deck.index.sqlite")
+    index.update([{"word": "猫", "meaning": "mèo"}], ("word", "meaning"), config="v1")
+    assert index.export(tmp_path / "deck.parquet", Flashcard) == 0
+    assert read_deck(tmp_path / "deck.parquet").schema.equals(arrow_schema(Flashcard))
+    index.close()
@@ -0,0 +1,83 @@
+import numpy as np
+
+from agents.dedupe import EmbeddingCache, Embedder, LshIndex, dedupe_items, repeated_sentences
+
+
+def char_embed(texts):
+    """Bag-of-characters vectors: strings sharing most characters are close."""
+    vectors = np.zeros((len(texts), 256), dtype=np.float32)
+    for row, text in enumerate(texts):
+        for char in text:
+            vectors[row, ord(char) % 256] += 1
+    return vectors
+
+
+class CountingEmbed:
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, texts):
+        self.calls.append(list(texts))
+        return char_embed(texts)
+
+
+def test_embedder_embeds_each_unique_string_once(tmp_path):
+    embed_fn = CountingEmbed()
+    cache = EmbeddingCache(tmp_path / "embeddings.sqlite")
+    embedder = Embedder(model_id="m", cache=cache, batch_size=2, embed_fn=embed_fn)
+
+    vectors = embedder.embed(["探す", "ＡＢＣ", "abc", "探す", "猫"])
+    assert vectors.shape == (5, 256)
+    assert np.allclose(np.linalg.norm(vectors, axis=1), 1)
+    assert np.array_equal(vectors[1], vectors[2])
+    assert [len(call) for call in embed_fn.calls] == [2, 1]
+
+    # A second embedder on the same cache file calls the model only for new strings
+    again = Embedder(model_id="m", cache=EmbeddingCache(tmp_path / "embeddings.sqlite"), embed_fn=embed_fn)
+    assert np.array_equal(again.embed(["猫", "犬"])[0], vectors[4])
+    assert embed_fn.calls[-1] == ["犬"]
+
+
+def test_lsh_index_finds_the_close_pairs_the_exact_search_finds():
+    rng = np.random.default_rng(1)
+    base = rng.standard_normal((300, 32)).astype(np.float32)
+    noisy = base[:50] + 0.05 * rng.standard_normal((50, 32)).astype(np.float32)
+    vectors = np.vstack([base, noisy])
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+
+    exact = LshIndex(exact_below=10**6).pairs(vectors, 0.95)
+    approximate = LshIndex(bits=6, tables=12, exact_below=0).pairs(vectors, 0.95)
+    assert {(a, b) for a, b, _ in exact} == {(i, 300 + i) for i in range(50)}
+    assert len(approximate) >= 0.9 * len(exact)
+    assert all(s >= 0.95 for _, _, s in approximate)
+
+
+def test_dedupe_items_merges_variants_and_skips_reference_rows():
+    embedder = Embedder(model_id="m", embed_fn=char_embed)
+    items = [
+        {"word": "探します、捜します", "meaning": "tìm kiếm"},
+        {"word": "時間に遅れます", "meaning": "chậm"},
+        {"word": "探します、 捜します", "meaning": "tìm"},
+        {"word": "男性", "meaning": "đàn ông"},
+    ]
+    reference = [{"word": "男性", "meaning": "đàn ông"}]
+
+    result = dedupe_items(items, ("word", "meaning"), embedder, threshold=0.9, reference=reference)
+    assert [row["word"] for row in result.items] == ["探します、捜します", "時間に遅れます"]
+    assert result.items[0]["meaning"] == "tìm kiếm; tìm"
+    assert result.merged == {"探します、捜します": [items[2]]}
+    assert result.skipped == [items[3]]
+    assert result.summary() == "2 kept, 1 merged, 1 skipped"
+
+
+def test_repeated_sentences_pairs_records_across_fields():
+    embedder = Embedder(model_id="m", embed_fn=char_embed)
+    records = [
+        {"example_sentences_1": "毎朝コーヒーを飲みます。", "example_sentences_2": "犬が好きです。"},
+        {"example_sentences_1": "駅まで歩きます。", "example_sentences_2": "毎朝コーヒーを飲みます!"},
+        {"example_sentences_1": "雨が降っています。", "example_sentences_2": ""},
+    ]
+    pairs = repeated_sentences(
+        records, ("example_sentences_1", "example_sentences_2"), embedder, threshold=0.9
+    )
+    assert [(i, j) for i, j, _ in pairs] == [(0, 1)]
@@ -0,0 +1,106 @@
+from types import SimpleNamespace
+
+from phi.document import Document
+from phi.embedder.base import Embedder
+from phi.vectordb.pgvector import HNSW, SearchType
+from sqlalchemy import create_engine
+from sqlalchemy.dialects import postgresql
+
+from agents.knowledge import QueryCache, TunedPgVector
+
+
+class CountingEmbedder(Embedder):
+    dimensions: int = 3
+    calls: int = 0
+
+    def get_embedding(self, text):
+        self.calls += 1
+        return [0.1, 0.2, 0.3]
+
+
+def make_vector_db(**kwargs):
+    # Nothing connects: the engine is only used to build statements here
+    engine = create_engine("postgresql+psycopg://ai:ai@localhost:5432/ai")
+    return TunedPgVector(
+        table_name="kb",
+        db_engine=engine,
+        embedder=CountingEmbedder(),
+        search_type=SearchType.hybrid,
+        vector_index=HNSW(ef_search=40),
+        **kwargs,
+    )
+
+
+def test_query_cache_evicts_least_recently_used_and_expired_entries(monkeypatch):
+    cache = QueryCache(maxsize=2, ttl_seconds=10)
+    now = [100.0]
+    monkeypatch.setattr("agents.knowledge.time.monotonic", lambda: now[0])
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1
+    cache.put("c", 3)
+    assert cache.get("b") is None and cache.get("a") == 1 and cache.get("c") == 3
+
+    now[0] += 11
+    assert cache.get("a") is None
+    assert cache.stats()["hits"] == 3 and cache.stats()["misses"] == 2
+
+
+def test_hybrid_search_reranks_candidates_from_both_indexes():
+    vector_db = make_vector_db(candidates=25)
+    statements = []
+
+    def execute(stmt, kind):
+        statements.append(stmt)
+        return []
+
+    vector_db._execute = execute
+    vector_db.hybrid_search("探す", limit=3)
+
+    sql = str(statements[0].compile(dialect=postgresql.dialect()))
+    assert "UNION" in sql
+    assert "ORDER BY ai.kb.embedding <=>" in sql
+    assert "ai.kb.content_tsv @@ websearch_to_tsquery" in sql
+    assert "to_tsvector" not in sql
+    assert "ai.kb.embedding," not in sql.split("FROM")[0]
+    assert "content_tsv" in vector_db.table.c
+
+
+def test_search_results_and_embeddings_are_cached_until_documents_change(monkeypatch):
+    vector_db = make_vector_db()
+    calls = []
+
+    def execute(stmt, kind):
+        calls.append(kind)
+        return [Document(id="1", content="探す: tìm kiếm")]
+
+    vector_db._execute = execute
+    assert vector_db.search("探す")[0].content == "探す: tìm kiếm"
+    assert vector_db.search("探す")[0].content == "探す: tìm kiếm"
+    assert calls == ["Hybrid"]
+
+    monkeypatch.setattr("phi.vectordb.pgvector.PgVector.upsert", lambda self, documents: None)
+    vector_db.upsert([Document(content="捜す")])
+    vector_db.search("探す")
+    vector_db.search("探す", limit=10)
+    assert calls == ["Hybrid"] * 3
+    # The query was embedded once and reused by every search
+    assert vector_db.embedder.calls == 1
+
+
+def test_tables_without_the_tsvector_column_get_it_on_create(monkeypatch):
+    vector_db = make_vector_db()
+    inspected, migrated = [], []
+    columns = [{"name": "id"}, {"name": "content"}]
+
+    def get_columns(table_name, schema=None):
+        inspected.append(table_name)
+        return columns
+
+    monkeypatch.setattr("phi.vectordb.pgvector.PgVector.create", lambda self: None)
+    monkeypatch.setattr("agents.knowledge.inspect", lambda engine: SimpleNamespace(get_columns=get_columns))
+    vector_db._create_gin_index = lambda: migrated.append(True)
+
+    vector_db.create()
+    vector_db.create()
+    assert migrated == [True] and inspected == ["kb"]
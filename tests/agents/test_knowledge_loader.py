@@ -0,0 +1,91 @@
+from types import SimpleNamespace
+
+from openpyxl import Workbook
+
+from agents.knowledge_loader import KnowledgeLoader, read_rows
+
+
+class FakeVectorDb:
+    def __init__(self):
+        self.embedder = SimpleNamespace(model="text-embedding-3-small")
+        self.table = SimpleNamespace(fullname="ai.kb")
+        self.created = 0
+
+    def create(self):
+        self.created += 1
+
+
+class MemoryLoader(KnowledgeLoader):
+    """Keeps the table in a dict instead of Postgres."""
+
+    def __init__(self, **kwargs):
+        self.embedded = []
+        self.writes = []
+        self.stored = {}
+        super().__init__(FakeVectorDb(), embed_fn=self.embed, read_batch_size=2, **kwargs)
+
+    def embed(self, texts):
+        self.embedded.append(list(texts))
+        return [[float(len(t)), 0.0] for t in texts]
+
+    def existing_hashes(self, ids):
+        return {i: self.stored[i][4] for i in ids if i in self.stored}
+
+    def write(self, rows, embeddings):
+        self.writes.append(len(rows))
+        for row in rows:
+            self.stored[row[0]] = row
+
+    def delete_missing(self, source, keep):
+        stale = [i for i, row in self.stored.items() if row[1] == source and i not in keep]
+        for doc_id in stale:
+            del self.stored[doc_id]
+        return len(stale)
+
+
+def write_csv(path, rows):
+    path.write_text("word,meaning\n" + "".join(f"{w},{m}\n" for w, m in rows), encoding="utf-8")
+
+
+def test_read_rows_streams_csv_and_xlsx_in_batches(tmp_path):
+    write_csv(tmp_path / "words.csv", [("言葉", "từ"), ("探す", "tìm"), ("猫", "mèo")])
+    assert [len(b) for b in read_rows(tmp_path / "words.csv", batch_size=2)] == [2, 1]
+
+    workbook = Workbook()
+    workbook.active.append(["Kanji", "Meaning"])
+    workbook.active.append(["男性", "đàn ông"])
+    workbook.save(tmp_path / "words.xlsx")
+    assert list(read_rows(tmp_path / "words.xlsx")) == [[{"Kanji": "男性", "Meaning": "đàn ông"}]]
+
+
+def test_load_embeds_in_batches_and_reload_skips_unchanged_rows(tmp_path):
+    path = tmp_path / "flashcards.csv"
+    write_csv(path, [("言葉", "từ"), ("探す", "tìm"), ("猫", "mèo"), ("犬", "chó"), ("言葉", "từ")])
+    loader = MemoryLoader(embed_batch_size=3, concurrency=2, write_batch_size=3)
+
+    assert loader.load(path) == {"rows": 4, "unchanged": 0, "written": 4, "deleted": 0}
+    assert [len(batch) for batch in loader.embedded] == [3, 1]
+    assert loader.writes == [3, 1]
+    assert loader.vector_db.created == 1
+    documents = {row[2] for row in loader.stored.values()}
+    assert "word: 言葉\nmeaning: từ" in documents
+
+    # Edit one meaning: only that row is embedded again, and its old document is deleted
+    write_csv(path, [("言葉", "từ ngữ"), ("探す", "tìm"), ("猫", "mèo"), ("犬", "chó")])
+    loader.embedded.clear()
+    assert loader.load(path) == {"rows": 4, "unchanged": 3, "written": 1, "deleted": 1}
+    assert loader.embedded == [["word: 言葉\nmeaning: từ ngữ"]]
+    assert len(loader.stored) == 4
+    assert {row[3]["source"] for row in loader.stored.values()} == {"flashcards"}
+
+
+def test_each_sense_of_a_word_is_its_own_document(tmp_path):
+    path = tmp_path / "flashcards.csv"
+    write_csv(path, [("やります", "làm"), ("やります", "cho")])
+    loader = MemoryLoader()
+
+    assert loader.load(path)["written"] == 2
+    assert sorted(row[2] for row in loader.stored.values()) == [
+        "word: やります\nmeaning: cho",
+        "word: やります\nmeaning: làm",
+    ]
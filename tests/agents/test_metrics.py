@@ -0,0 +1,103 @@
+import json
+
+import pytest
+
+from agents.cache import ResponseCache, run_cached
+from agents.checkpoint import JobManifest, JobRunner
+from agents.flascard_generator import Flashcard
+from utils.metrics import MetricsRegistry, estimate_cost, metrics, record_run_usage
+
+
+class FakeResponse:
+    metrics = {"input_tokens": [1200, 800], "output_tokens": [300, 200]}
+
+
+def test_summary_reports_latency_tokens_cost_and_the_slowest_stage():
+    registry = MetricsRegistry(buckets=(0.1, 1.0, 10.0))
+    for seconds in (0.05, 0.5, 0.5, 5.0):
+        registry.observe("stage_seconds", seconds, stage="generate")
+    registry.observe("stage_seconds", 0.02, stage="sink.CsvSink")
+    with pytest.raises(ValueError):
+        with registry.time("image_search"):
+            raise ValueError("quota")
+    registry.record_llm_usage("gpt-4o-mini-2024-07-18", 1_000_000, 100_000)
+    registry.record_cache("responses", hits=3, misses=1)
+    registry.inc("retries_total", 2, stage="generate")
+
+    summary = registry.summary()
+    assert summary["hot_stage"] == "generate"
+    assert summary["stages"]["generate"]["calls"] == 4
+    assert summary["stages"]["generate"]["seconds_p50"] == 1.0
+    assert summary["stages"]["generate"]["seconds_p95"] == 5.0
+    assert summary["stages"]["image_search"]["errors"] == 1
+    assert summary["tokens"] == {"gpt-4o-mini-2024-07-18": {"prompt": 1_000_000, "completion": 100_000}}
+    assert summary["cost_usd"]["total"] == pytest.approx(0.15 + 0.06)
+    assert summary["retries"] == {"generate": 2}
+    assert summary["caches"]["responses"]["hit_rate"] == 0.75
+
+
+def test_costs_follow_the_longest_matching_model_price():
+    assert estimate_cost("gpt-4o", 1_000_000, 0) == 2.50
+    assert estimate_cost("gpt-4o-mini", 1_000_000, 0) == 0.15
+    assert estimate_cost("some-local-model", 1_000_000, 1_000_000) == 0.0
+
+
+def test_a_run_summary_only_covers_what_happened_since_the_snapshot(tmp_path):
+    registry = MetricsRegistry()
+    registry.inc("retries_total", 5, stage="generate")
+    registry.observe("stage_seconds", 1.0, stage="generate")
+    started = registry.snapshot()
+    registry.observe("stage_seconds", 2.0, stage="generate")
+
+    # A worker process sends back its own snapshot
+    worker = MetricsRegistry()
+    worker.observe("stage_seconds", 3.0, stage="generate")
+    registry.merge(json.loads(json.dumps(worker.snapshot())))
+
+    written = registry.since(started).write_summary(tmp_path / "n3.metrics.json", deck="n3")
+    assert json.loads((tmp_path / "n3.metrics.json").read_text()) == written
+    assert written["run"] == {"deck": "n3"}
+    assert written["stages"]["generate"]["calls"] == 2
+    assert written["stages"]["generate"]["seconds_total"] == 5.0
+    assert written["retries"] == {}
+    # The registry itself keeps counting for Prometheus
+    assert registry.summary()["stages"]["generate"]["calls"] == 3
+
+
+def test_generation_records_cache_hits_retries_and_tokens(tmp_path):
+    metrics.reset()
+    cache = ResponseCache(tmp_path / "responses.sqlite")
+    card = Flashcard(
+        word="猫",
+        meaning="con mèo",
+        example_sentences_1="s1",
+        meaning_example_sentences_1="m1",
+        example_sentences_2="s2",
+        meaning_example_sentences_2="m2",
+    )
+    item = {"word": "猫", "meaning": "con mèo"}
+    for _ in range(2):
+        run_cached(cache, "scope", [item], ("word", "meaning"), Flashcard, "word", lambda items: [card])
+    record_run_usage("gpt-4o", FakeResponse())
+
+    attempts = []
+
+    def flaky(items):
+        attempts.append(items)
+        if len(attempts) == 1:
+            raise TimeoutError("timed out")
+        return [card]
+
+    manifest = JobManifest(tmp_path / "job.sqlite")
+    manifest.requeue([item], key_fields=("word", "meaning"))
+    JobRunner(
+        manifest, flaky, record_key_field="word", key_fields=("word", "meaning"), sleep=lambda s: None
+    ).run(None)
+    manifest.close()
+
+    summary = metrics.summary()
+    assert summary["caches"]["responses"] == {"hits": 1, "misses": 1, "hit_rate": 0.5}
+    assert summary["retries"] == {"generate": 1}
+    assert summary["tokens"]["gpt-4o"] == {"prompt": 2000, "completion": 500}
+
+    metrics.reset()
@@ -0,0 +1,152 @@
+import json
+import threading
+import time
+
+import pyarrow.parquet as pq
+import pytest
+
+from agents.deck_runner import DeckSpec, read_items, run_deck
+from agents.flascard_generator import Flashcard
+from agents.pipeline import Pipeline, Stage
+
+
+def test_stages_run_concurrently_and_keep_the_source_order():
+    active, peak = set(), {}
+    lock = threading.Lock()
+
+    def slow(name, delay):
+        def fn(item):
+            with lock:
+                active.add(name)
+                peak[name] = len(active)
+            time.sleep(delay(item))
+            with lock:
+                active.discard(name)
+            return item
+
+        return fn
+
+    pipeline = Pipeline(
+        [
+            Stage.map("generate", slow("generate", lambda i: 0.01 * (i % 3)), workers=3),
+            Stage.map("enrich", slow("enrich", lambda i: 0.01)),
+            Stage.map("double", lambda i: i * 2),
+        ],
+        queue_size=2,
+    )
+    assert list(pipeline.run(range(20))) == [i * 2 for i in range(20)]
+    assert pipeline.counts == {"generate": 20, "enrich": 20, "double": 20}
+    # The enrichment ran while the model stage was busy with later items
+    assert max(peak.values()) == 2
+
+
+def test_bounded_queues_hold_back_the_source():
+    produced = []
+
+    def source():
+        for i in range(100):
+            produced.append(i)
+            yield i
+
+    results = Pipeline([Stage.map("identity", lambda i: i)], queue_size=2).run(source())
+    assert next(results) == 0
+    time.sleep(0.05)
+    # Two queues of two items plus one held by each thread, not the whole source
+    assert len(produced) <= 8
+    results.close()
+
+
+def test_a_failing_stage_stops_the_pipeline():
+    def fail_on_three(i):
+        if i == 3:
+            raise ValueError("bad item")
+        return i
+
+    pipeline = Pipeline([Stage.map("check", fail_on_three), Stage.map("after", lambda i: i)], queue_size=1)
+    seen = []
+    with pytest.raises(ValueError, match="bad item"):
+        for result in pipeline.run(range(1000)):
+            seen.append(result)
+    assert seen == [0, 1, 2]
+
+
+def test_no_stage_is_working_once_a_failed_run_returns():
+    calls = []
+
+    def generate(i):
+        time.sleep(0.02)
+        calls.append(i)
+        return i
+
+    def check(i):
+        if i == 2:
+            raise ValueError("bad item")
+        return i
+
+    pipeline = Pipeline([Stage.map("generate", generate, workers=4), Stage.map("check", check)], queue_size=1)
+    with pytest.raises(ValueError, match="bad item"):
+        list(pipeline.run(range(1000)))
+    finished = len(calls)
+    time.sleep(0.1)
+    assert len(calls) == finished < 20
+
+
+def card(item):
+    return Flashcard(
+        word=item["word"],
+        meaning=item["meaning"],
+        example_sentences_1=f"{item['word']}です。",
+        meaning_example_sentences_1="câu 1",
+        example_sentences_2=f"{item['word']}があります。",
+        meaning_example_sentences_2="câu 2",
+    )
+
+
+def add_images(cards):
+    for c in cards:
+        c.image_url = f"{c.word}.jpg"
+
+
+def test_run_deck_generates_only_new_rows_and_exports_from_the_parquet_deck(tmp_path):
+    source = tmp_path / "words.csv"
+    source.write_text('word,meaning\n猫,"con mèo, mèo"\n犬,chó\n,trống\n', encoding="utf-8")
+    assert read_items(source, ("word", "meaning")) == [
+        {"word": "猫", "meaning": "con mèo, mèo"},
+        {"word": "犬", "meaning": "chó"},
+    ]
+
+    generated: list[str] = []
+
+    def generate(items):
+        generated.extend(i["word"] for i in items)
+        return [card(i) for i in items]
+
+    spec = DeckSpec(
+        name="words",
+        kind="flashcards",
+        record_type=Flashcard,
+        key_fields=("word", "meaning"),
+        generate=generate,
+        agent=None,
+        build_prompt=lambda chunk, offset: "",
+        format_item=lambda item: f"{item['word']}\n",
+        array_key="flashcards",
+        model_id="gpt-4o-mini",
+        config="v1",
+        postprocess=add_images,
+    )
+    output = tmp_path / "words.xlsx"
+    assert run_deck(spec, source, output)["done"] == 2
+    assert output.exists()
+    table = pq.read_table(tmp_path / "words.parquet")
+    assert table.column("image_url").to_pylist() == ["猫.jpg", "犬.jpg"]
+    summary = json.loads((tmp_path / "words.metrics.json").read_text(encoding="utf-8"))
+    assert summary["run"]["counts"]["done"] == 2
+    assert summary["stages"]["postprocess"]["calls"] == 1
+    assert summary["stages"]["sink.ParquetSink"]["calls"] >= 1
+
+    source.write_text('word,meaning\n猫,"con mèo, mèo"\n鳥,chim\n', encoding="utf-8")
+    generated.clear()
+    run_deck(spec, source, output)
+    assert generated == ["鳥"]
+    assert pq.read_table(tmp_path / "words.parquet").column("word").to_pylist() == ["猫", "鳥"]
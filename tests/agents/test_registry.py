@@ -0,0 +1,40 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from phi.agent import Agent
+
+from agents.registry import AgentRegistry
+
+
+def test_agents_are_built_once_on_first_use():
+    built = []
+
+    def factory(name):
+        def build():
+            built.append(name)
+            return Agent(name=name)
+
+        return build
+
+    registry = AgentRegistry()
+    registry.register("a", factory("a"))
+    registry.register("b", factory("b"))
+    agents = registry.lazy_list()
+
+    assert built == [] and len(agents) == 2 and not registry.is_built("a")
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        results = list(executor.map(registry.get, ["a"] * 8))
+    assert built == ["a"] and all(agent is results[0] for agent in results)
+
+    assert [agent.name for agent in agents] == ["a", "b"]
+    assert agents[1] is registry.get("b")
+    assert built == ["a", "b"]
+
+
+def test_unknown_and_duplicate_ids():
+    registry = AgentRegistry()
+    registry.register("a", Agent)
+    with pytest.raises(ValueError):
+        registry.register("a", Agent)
+    with pytest.raises(KeyError):
+        registry.get("missing")
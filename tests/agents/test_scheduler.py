@@ -0,0 +1,132 @@
+import random
+import threading
+import time
+
+import pytest
+
+from agents.scheduler import ChunkScheduler, RateLimiter, TokenBucket, shared_rate_limiter
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float) -> None:
+        self.now += seconds
+
+
+def stub_model(chunk):
+    """Stands in for an OpenAI call: sleeps, then echoes the words back."""
+    time.sleep(random.uniform(0.01, 0.05))
+    return [word.upper() for word in chunk]
+
+
+def test_results_keep_input_order():
+    chunks = [[f"w{i}a", f"w{i}b"] for i in range(20)]
+    scheduler = ChunkScheduler(stub_model, concurrency=5)
+
+    results = list(scheduler.map(chunks))
+
+    assert [index for index, _ in results] == list(range(20))
+    assert [result for _, result in results] == [[word.upper() for word in chunk] for chunk in chunks]
+
+
+def test_concurrency_is_bounded():
+    in_flight = 0
+    peak = 0
+    lock = threading.Lock()
+
+    def worker(chunk):
+        nonlocal in_flight, peak
+        with lock:
+            in_flight += 1
+            peak = max(peak, in_flight)
+        time.sleep(0.02)
+        with lock:
+            in_flight -= 1
+        return chunk
+
+    started = time.monotonic()
+    list(ChunkScheduler(worker, concurrency=4).map(range(16)))
+    elapsed = time.monotonic() - started
+
+    assert peak == 4
+    # 16 chunks of 20ms on 4 workers is ~80ms, far below the 320ms sequential run
+    assert elapsed < 0.25
+
+
+def test_worker_error_is_raised_in_order():
+    def worker(chunk):
+        if chunk == 3:
+            raise RuntimeError("boom")
+        return chunk
+
+    seen = []
+    with pytest.raises(RuntimeError, match="boom"):
+        for index, result in ChunkScheduler(worker, concurrency=2).map(range(10)):
+            seen.append(result)
+
+    assert seen == [0, 1, 2]
+
+
+def test_streamed_items_of_the_oldest_chunk_come_out_before_it_finishes():
+    release = threading.Event()
+
+    def worker(chunk):
+        yield f"{chunk}a"
+        if chunk == 0:
+            # The first item is handed on while the rest of the chunk is still being produced
+            assert release.wait(1)
+        yield f"{chunk}b"
+
+    items = ChunkScheduler(worker, concurrency=2).stream(range(3))
+    assert next(items) == (0, "0a")
+    release.set()
+    assert list(items) == [(0, "0b"), (1, "1a"), (1, "1b"), (2, "2a"), (2, "2b")]
+
+
+def test_streamed_worker_error_is_raised_in_order():
+    def worker(chunk):
+        yield chunk
+        if chunk == 1:
+            raise RuntimeError("boom")
+
+    seen = []
+    with pytest.raises(RuntimeError, match="boom"):
+        for _, item in ChunkScheduler(worker, concurrency=2).stream(range(4)):
+            seen.append(item)
+
+    assert seen == [0, 1]
+
+
+def test_token_bucket_throttles_after_burst():
+    clock = FakeClock()
+    bucket = TokenBucket(rate_per_minute=60, capacity=2, clock=clock, sleep=clock.sleep)
+
+    assert bucket.acquire() == 0
+    assert bucket.acquire() == 0
+    assert bucket.acquire() == pytest.approx(1.0)
+    assert clock.now == pytest.approx(1.0)
+
+
+def test_rate_limiter_applies_token_budget():
+    clock = FakeClock()
+    limiter = RateLimiter(requests_per_minute=600, tokens_per_minute=6000, clock=clock, sleep=clock.sleep)
+
+    limiter.acquire(tokens=6000)
+    waited = limiter.acquire(tokens=3000)
+
+    # 3000 tokens at 100 tokens/s
+    assert waited == pytest.approx(30.0)
+
+
+def test_schedulers_from_settings_share_one_rate_limiter():
+    def worker(chunk: int) -> int:
+        return chunk
+
+    first = ChunkScheduler.from_settings(worker)
+    second = ChunkScheduler.from_settings(worker, concurrency=1)
+    assert first.rate_limiter is second.rate_limiter is shared_rate_limiter()
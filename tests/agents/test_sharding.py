@@ -0,0 +1,130 @@
+from datetime import timedelta
+from typing import cast
+
+import pyarrow.parquet as pq
+import pytest
+from sqlalchemy import Table, create_engine
+
+from agents.deck_runner import DeckSpec
+from agents.flascard_generator import Flashcard
+from agents.sharding import DeckRequest, ShardQueue, ShardTask, partition, run_local, shard_of
+from db.tables import DeckShard
+
+GENERATED: list[str] = []
+
+
+def fake_spec(name, target_language, native_language, response_cache=None):
+    def generate(items):
+        GENERATED.extend(i["word"] for i in items)
+        return [
+            Flashcard(
+                word=i["word"],
+                meaning=i["meaning"],
+                example_sentences_1=f"{i['word']} ({target_language})",
+                meaning_example_sentences_1=native_language,
+                example_sentences_2="s2",
+                meaning_example_sentences_2="m2",
+            )
+            for i in items
+        ]
+
+    return DeckSpec(
+        name=name,
+        kind="flashcards",
+        record_type=Flashcard,
+        key_fields=("word", "meaning"),
+        generate=generate,
+        agent=None,
+        build_prompt=lambda chunk, offset: "",
+        format_item=lambda item: f"{item['word']}\n",
+        array_key="flashcards",
+        model_id="gpt-4o-mini",
+        config=f"{target_language}:{native_language}",
+    )
+
+
+def test_partition_is_stable_and_keeps_the_input_order():
+    keys = [f"単語{i}" for i in range(2000)]
+    assert [shard_of(k, 4) for k in keys] == [shard_of(k, 4) for k in keys]
+    parts = partition([{"word": k} for k in keys], ("word",), 4)
+    assert all(400 < len(part) < 600 for part in parts)
+    assert [item["word"] for item in parts[0]] == sorted(
+        (item["word"] for item in parts[0]), key=lambda w: int(w[2:])
+    )
+    # Keys are normalized first, so spacing variants of a word land in the same shard
+    assert len(partition([{"word": " 猫 "}, {"word": "猫"}], ("word",), 8)[shard_of("猫", 8)]) == 2
+
+
+def test_merged_output_does_not_depend_on_the_number_of_shards(tmp_path):
+    source = tmp_path / "n3.csv"
+    source.write_text("word,meaning\n" + "".join(f"単語{i},nghĩa {i}\n" for i in range(30)), encoding="utf-8")
+    kind = f"{__name__}:fake_spec"
+
+    outputs = {}
+    for shards in (1, 4):
+        output = tmp_path / f"n3_{shards}.csv"
+        request = DeckRequest(kind, str(source), str(output), "Japanese", "English")
+        totals = run_local([request], shards=shards, processes=1, use_response_cache=False)
+        assert totals[str(output)]["done"] == 30
+        outputs[shards] = pq.read_table(output.with_suffix(".parquet"))
+    assert outputs[1].equals(outputs[4])
+    assert outputs[4].column("word").to_pylist()[:3] == ["単語0", "単語1", "単語2"]
+    assert outputs[4].column("example_sentences_1").to_pylist()[0] == "単語0 (Japanese)"
+
+    # Rerunning only regenerates the rows that changed, whichever shard they are in
+    source.write_text("word,meaning\n" + "".join(f"単語{i},nghĩa {i}\n" for i in range(31)), encoding="utf-8")
+    GENERATED.clear()
+    request = DeckRequest(kind, str(source), str(tmp_path / "n3_4.csv"), "Japanese", "English")
+    run_local([request], shards=4, processes=1, use_response_cache=False)
+    assert GENERATED == ["単語30"]
+
+
+def test_repeated_input_rows_are_merged_once(tmp_path):
+    source = tmp_path / "n3.csv"
+    source.write_text("word,meaning\n単語0,nghĩa 0\n単語1,nghĩa 1\n単語0,nghĩa 0\n", encoding="utf-8")
+    output = tmp_path / "n3.csv.out.csv"
+    request = DeckRequest(f"{__name__}:fake_spec", str(source), str(output), "Japanese", "English")
+    run_local([request], shards=2, processes=1, use_response_cache=False)
+    assert pq.read_table(output.with_suffix(".parquet")).column("word").to_pylist() == ["単語0", "単語1"]
+
+
+@pytest.fixture
+def queue():
+    engine = create_engine("sqlite://").execution_options(schema_translate_map={"public": None})
+    cast(Table, DeckShard.__table__).create(engine)
+    yield ShardQueue(engine, lease_seconds=60)
+    engine.dispose()
+
+
+def task(shard, shards=3):
+    return ShardTask("flashcards", "n3", "Japanese", "Vietnamese", shard, shards, f"/tmp/n3.{shard}", [])
+
+
+def test_queue_hands_each_shard_to_one_worker(queue):
+    queue.enqueue("run", "n3.csv", [task(i) for i in range(3)])
+    first, second = queue.claim("a"), queue.claim("b")
+    assert first[1].shard == 0 and second[1].shard == 1
+    assert queue.statuses("run") == {"running": 2, "pending": 1}
+
+    # A shard whose worker stopped renewing its lease is claimed again
+    queue._now = lambda: ShardQueue._now(queue) + timedelta(seconds=120)
+    assert queue.claim("c")[1].shard == 0
+
+    queue.complete(second[0], "b", {"done": 4, "failed": 1})
+    # The worker that lost its lease can no longer finish the shard
+    queue.fail(first[0], "a", "too late")
+    assert queue.statuses("run") == {"running": 1, "pending": 1, "done": 1}
+    assert queue.counts("run") == {"n3.csv": {"done": 4, "failed": 1}}
+
+
+def test_workers_drain_the_queue_and_record_failures(queue):
+    queue.enqueue("run", "n3.csv", [task(i) for i in range(3)])
+
+    def run(shard_task):
+        if shard_task.shard == 1:
+            raise RuntimeError("provider down")
+        return {"done": shard_task.shard + 1}
+
+    assert queue.work("worker", run=run) == 2
+    assert queue.wait("run", sleep=lambda s: None) == {"done": 2, "failed": 1}
+    assert queue.counts("run") == {"n3.csv": {"done": 4}}
@@ -0,0 +1,137 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from phi.agent import Agent, RunResponse
+
+from agents.cache import ResponseCache, run_cached
+from agents.flascard_generator import Flashcard, FlashcardGenerator, FlashcardList
+from agents.singleflight import SingleFlight, SingleFlightAgent
+
+
+def test_concurrent_calls_share_one_execution():
+    flight: SingleFlight[str] = SingleFlight()
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def slow():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return "result"
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        leader = executor.submit(flight.do, "key", slow)
+        started.wait(5)
+        followers = [executor.submit(flight.do, "key", slow) for _ in range(7)]
+        time.sleep(0.05)
+        release.set()
+        results = [leader.result()] + [f.result() for f in followers]
+
+    assert results == ["result"] * 8
+    assert calls == [1]
+    assert flight.stats() == {"calls": 1, "shared": 7}
+    # Nothing is remembered after the call finished
+    assert flight.do("key", lambda: "again") == "again"
+
+
+def test_errors_reach_every_waiter():
+    flight: SingleFlight[str] = SingleFlight()
+    release = threading.Event()
+
+    def failing():
+        release.wait(5)
+        raise RuntimeError("upstream down")
+
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        futures = [executor.submit(flight.do, "key", failing) for _ in range(3)]
+        time.sleep(0.05)
+        release.set()
+        for future in futures:
+            with pytest.raises(RuntimeError, match="upstream down"):
+                future.result()
+
+
+def test_flashcard_run_coalesces_and_caches(monkeypatch):
+    calls = []
+
+    class FakeAgent:
+        def run(self, word, stream=False):
+            calls.append(word)
+            time.sleep(0.1)
+            card = Flashcard(
+                word=word.strip(),
+                meaning="xem",
+                example_sentences_1="s1",
+                meaning_example_sentences_1="m1",
+                example_sentences_2="s2",
+                meaning_example_sentences_2="m2",
+            )
+            return RunResponse(content=FlashcardList(flashcards=[card]))
+
+    monkeypatch.setattr(FlashcardGenerator, "_agent_for_thread", lambda self: FakeAgent())
+    generator = FlashcardGenerator("Japanese", "Vietnamese", response_cache=ResponseCache(":memory:"))
+
+    with ThreadPoolExecutor(max_workers=6) as executor:
+        responses = list(executor.map(generator.run, ["見ます", " 見ます", "見ます "] * 2))
+    assert len(calls) == 1
+    contents = [r.content for r in responses]
+    assert all(isinstance(c, FlashcardList) and c.flashcards[0].word == "見ます" for c in contents)
+
+    cached = generator.run("見ます")
+    assert len(calls) == 1
+    assert cached.content == responses[0].content
+
+
+def test_identical_chunks_in_flight_share_one_generation(tmp_path):
+    cache = ResponseCache(tmp_path / "cache.sqlite")
+    flight: SingleFlight = SingleFlight()
+    chunk = [{"word": "見ます", "meaning": "xem"}, {"word": "探します", "meaning": "tìm"}]
+    calls = []
+
+    def run(items):
+        calls.append(len(items))
+        time.sleep(0.1)
+        return [
+            Flashcard(
+                word=i["word"],
+                meaning=i["meaning"],
+                example_sentences_1="s1",
+                meaning_example_sentences_1="m1",
+                example_sentences_2="s2",
+                meaning_example_sentences_2="m2",
+            )
+            for i in items
+        ]
+
+    def generate(_):
+        return run_cached(cache, "scope", chunk, ("word", "meaning"), Flashcard, "word", run, flight=flight)
+
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        results = list(executor.map(generate, range(3)))
+    assert calls == [2]
+    assert results[0] == results[1] == results[2]
+    # Each caller can post-process its own records
+    assert results[0][0] is not results[1][0]
+
+
+def test_playground_agent_coalesces_identical_messages(monkeypatch):
+    calls = []
+
+    def run(self, message=None, *, stream=False, **kwargs):
+        calls.append((message, stream))
+        time.sleep(0.1)
+        return RunResponse(content=f"answer to {message}")
+
+    monkeypatch.setattr(Agent, "run", run)
+    agent = SingleFlightAgent(name="generator", instructions=["Write sentences"])
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        responses = list(executor.map(lambda copy: copy.run("見ます"), [agent.deep_copy() for _ in range(4)]))
+    assert calls == [("見ます", False)]
+    assert {r.content for r in responses} == {"answer to 見ます"}
+
+    agent.run("見ます", stream=True)
+    assert calls[-1] == ("見ます", True)
@@ -0,0 +1,64 @@
+import csv
+import json
+
+from openpyxl import load_workbook
+
+from agents.sinks import CsvSink, JsonlSink, ParquetSink, XlsxSink, open_sink
+
+COLUMNS = ["word", "meaning"]
+
+
+def test_csv_sink_appends_without_repeating_header(tmp_path):
+    path = tmp_path / "out.csv"
+    with CsvSink(path, COLUMNS) as sink:
+        sink.write([{"word": "見ます", "meaning": "xem"}])
+    with CsvSink(path, COLUMNS) as sink:
+        sink.write([{"word": "探します", "meaning": "tìm"}])
+
+    with open(path, encoding="utf-8", newline="") as f:
+        rows = list(csv.reader(f))
+    assert rows == [COLUMNS, ["見ます", "xem"], ["探します", "tìm"]]
+
+
+def test_jsonl_sink_keeps_only_known_columns(tmp_path):
+    path = tmp_path / "out.jsonl"
+    with open_sink(path, COLUMNS) as sink:
+        assert isinstance(sink, JsonlSink)
+        sink.write([{"word": "a", "meaning": "b", "extra": 1}])
+
+    assert [json.loads(line) for line in path.read_text().splitlines()] == [{"word": "a", "meaning": "b"}]
+
+
+def test_xlsx_sink_finalizes_existing_rows_and_recovers_journal(tmp_path):
+    path = tmp_path / "out.xlsx"
+    with XlsxSink(path, COLUMNS) as sink:
+        sink.write([{"word": "a", "meaning": "1"}])
+
+    # Simulate a crash: rows reach the journal but the sink is never closed
+    crashed = XlsxSink(path, COLUMNS)
+    crashed.write([{"word": "b", "meaning": "2"}])
+    crashed._journal.close()
+
+    with XlsxSink(path, COLUMNS) as sink:
+        sink.write([{"word": "c", "meaning": "3"}])
+
+    rows = list(load_workbook(path, read_only=True).active.iter_rows(values_only=True))
+    assert rows == [("word", "meaning"), ("a", "1"), ("b", "2"), ("c", "3")]
+    assert not sink.journal_path.exists()
+
+
+def test_parquet_sink_appends_row_groups_to_an_existing_file(tmp_path):
+    import pyarrow.parquet as pq
+
+    path = tmp_path / "out.parquet"
+    with open_sink(path, COLUMNS) as sink:
+        assert isinstance(sink, ParquetSink)
+        sink.write([{"word": "見ます", "meaning": "xem"}])
+        sink.write([{"word": "探します", "meaning": "tìm"}])
+    with ParquetSink(path, COLUMNS) as sink:
+        sink.write([{"word": "猫", "meaning": None}])
+
+    parquet_file = pq.ParquetFile(path)
+    assert parquet_file.num_row_groups == 3
+    assert parquet_file.read().to_pylist()[-1] == {"word": "猫", "meaning": None}
+    assert not (tmp_path / "out.parquet.tmp").exists()
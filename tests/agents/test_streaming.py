@@ -0,0 +1,93 @@
+import json
+from types import SimpleNamespace
+
+import pytest
+from phi.model.openai import OpenAIChat
+
+from agents.flascard_generator import Flashcard, FlashcardGenerator, FlashcardList
+from agents.streaming import JsonArrayStreamParser, openai_model, response_format, stream_structured
+from utils.metrics import metrics
+
+
+def make_card(word: str) -> Flashcard:
+    return Flashcard(
+        word=word,
+        meaning='has "quotes", {braces} and [brackets]',
+        example_sentences_1="s1 \\ backslash",
+        meaning_example_sentences_1="m1",
+        example_sentences_2="s2",
+        meaning_example_sentences_2="m2",
+    )
+
+
+@pytest.mark.parametrize("piece_size", [1, 3, 17, 10_000])
+def test_records_emitted_as_each_closes(piece_size):
+    cards = [make_card(w) for w in ["見ます", "探します", "捜します"]]
+    text = FlashcardList(flashcards=cards).model_dump_json(indent=2)
+    parser = JsonArrayStreamParser("flashcards", Flashcard)
+
+    emitted_at = []
+    records = []
+    for start in range(0, len(text), piece_size):
+        new = parser.feed(text[start : start + piece_size])
+        records.extend(new)
+        emitted_at.extend([start + piece_size] * len(new))
+
+    assert records == cards
+    assert parser.finished
+    if piece_size == 1:
+        # The first card is available long before the response is complete
+        assert emitted_at[0] < len(text) / 2
+
+
+def test_other_keys_and_truncation():
+    text = json.dumps({"note": ["{not a card}"], "flashcards": [make_card("a").model_dump(), {"word": "b"}]})
+    parser = JsonArrayStreamParser("flashcards", Flashcard)
+    truncated = text[: text.index('{"word": "b"') + 5]
+
+    records = parser.feed(truncated)
+
+    assert [r.word for r in records] == ["a"]
+    assert not parser.finished
+
+
+def test_response_format_is_a_strict_schema():
+    json_schema = response_format(FlashcardList)["json_schema"]
+    assert json_schema["name"] == "FlashcardList" and json_schema["strict"]
+    card = json_schema["schema"]["$defs"]["Flashcard"]
+    assert card["additionalProperties"] is False
+    # Optional fields are still listed as required, with null allowed and no default
+    assert "image_url" in card["required"]
+    assert "default" not in card["properties"]["image_url"]
+
+
+def test_stream_records_usage_from_the_final_chunk(monkeypatch):
+    text = FlashcardList(flashcards=[make_card("見ます")]).model_dump_json()
+    chunks = [
+        SimpleNamespace(
+            usage=None, choices=[SimpleNamespace(delta=SimpleNamespace(content=text), finish_reason=None)]
+        ),
+        SimpleNamespace(
+            usage=None, choices=[SimpleNamespace(delta=SimpleNamespace(content=None), finish_reason="stop")]
+        ),
+        SimpleNamespace(usage=SimpleNamespace(prompt_tokens=120, completion_tokens=80), choices=[]),
+    ]
+    requests = []
+
+    def create(**kwargs):
+        requests.append(kwargs)
+        return iter(chunks)
+
+    client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+    monkeypatch.setattr(OpenAIChat, "get_client", lambda self: client)
+    agent = FlashcardGenerator("Japanese", "Vietnamese").related_sentence_agent
+    before = metrics.snapshot()
+
+    records = list(stream_structured(agent, "prompt", "flashcards", Flashcard))
+
+    assert [r.word for r in records] == ["見ます"]
+    assert requests[0]["stream_options"] == {"include_usage": True}
+    assert metrics.since(before).summary()["tokens"][openai_model(agent).id] == {
+        "prompt": 120,
+        "completion": 80,
+    }
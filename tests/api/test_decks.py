@@ -0,0 +1,81 @@
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+
+from agents.flascard_generator import Flashcard
+from api.main import app
+from api.routes import decks
+
+
+class FakeGenerator:
+    def generate(self, chunk, offset=0):
+        return [
+            Flashcard(
+                word=item["word"],
+                meaning=item["meaning"],
+                example_sentences_1="s1",
+                meaning_example_sentences_1="m1",
+                example_sentences_2="s2",
+                meaning_example_sentences_2="m2",
+            )
+            for item in chunk
+        ]
+
+    def stream(self, chunk, offset=0):
+        yield from self.generate(chunk, offset)
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(decks, "get_generator", lambda kind, target, native: FakeGenerator())
+    monkeypatch.setattr(decks, "job_options", lambda kind: {"chunk_size": 2})
+    return TestClient(app)
+
+
+def read_events(response):
+    events = []
+    for block in response.text.split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in block.splitlines() if not line.startswith(":"))
+        if lines:
+            events.append((int(lines["id"]), lines["event"], json.loads(lines["data"])))
+    return events
+
+
+def test_deck_job_streams_cards_and_finishes(client):
+    upload = "見ます,xem\n\n探します,tìm\n食べます,ăn\n".encode("utf-8")
+    response = client.post("/v1/decks", files={"file": ("words.csv", upload, "text/csv")})
+    assert response.status_code == 202
+    job_id = response.json()["id"]
+
+    events = read_events(client.get(f"/v1/decks/{job_id}/events"))
+    cards = [data for _, event, data in events if event == "card"]
+    assert [card["record"]["word"] for card in cards] == ["見ます", "探します", "食べます"]
+    assert events[-1][1] == "status" and events[-1][2]["status"] == "done"
+    assert [event_id for event_id, _, _ in events] == list(range(1, len(events) + 1))
+
+    resumed = read_events(
+        client.get(f"/v1/decks/{job_id}/events", headers={"Last-Event-ID": str(len(events) - 1)})
+    )
+    assert resumed == events[-1:]
+
+    status = client.get(f"/v1/decks/{job_id}", params={"include_records": True}).json()
+    assert status["done"] == 3 and len(status["records"]) == 3
+
+
+def test_repeated_rows_are_skipped_and_not_counted(client):
+    upload = "見ます,xem\n見ます,xem\n食べます,ăn\n".encode("utf-8")
+    job_id = client.post("/v1/decks", files={"file": ("words.csv", upload, "text/csv")}).json()["id"]
+
+    events = read_events(client.get(f"/v1/decks/{job_id}/events"))
+    statuses = [data for _, event, data in events if event == "status"]
+    assert [s["status"] for s in statuses] == ["queued", "running", "done"]
+    assert statuses[-1]["total"] == 2 and statuses[-1]["done"] == 2 and statuses[-1]["skipped"] == 1
+
+
+def test_rejects_bad_uploads(client):
+    assert client.post("/v1/decks", files={"file": ("w.csv", b"\n\n", "text/csv")}).status_code == 400
+    assert (
+        client.post("/v1/decks", files={"file": ("w.csv", b"only-a-word\n", "text/csv")}).status_code == 400
+    )
+    assert client.get("/v1/decks/missing").status_code == 404
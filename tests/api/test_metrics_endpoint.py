@@ -0,0 +1,28 @@
+import pytest
+from fastapi.testclient import TestClient
+
+from api.main import app
+from utils.metrics import metrics
+
+
+@pytest.fixture
+def client():
+    metrics.reset()
+    yield TestClient(app)
+    metrics.reset()
+
+
+def test_metrics_are_exposed_in_the_prometheus_text_format(client):
+    with metrics.time("flashcards.generate"):
+        pass
+    metrics.record_llm_usage("gpt-4o", 2000, 500)
+
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    lines = response.text.splitlines()
+    assert "# TYPE anki_agent_stage_seconds histogram" in lines
+    assert 'anki_agent_stage_seconds_bucket{stage="flashcards.generate",le="+Inf"} 1' in lines
+    assert 'anki_agent_stage_seconds_count{stage="flashcards.generate"} 1' in lines
+    assert 'anki_agent_llm_tokens_total{kind="prompt",model="gpt-4o"} 2000' in lines
+    assert 'anki_agent_llm_cost_usd_total{model="gpt-4o"} 0.01' in lines
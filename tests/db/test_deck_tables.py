@@ -0,0 +1,100 @@
+from typing import cast
+
+import pytest
+from sqlalchemy import Table, create_engine, event, func, select
+from sqlalchemy.dialects import postgresql
+
+from agents.sinks import DbSink
+from db.tables import Deck, FlashcardEntry, GrammarEntry, MediaEntry, Word
+from db.upsert import bulk_upsert
+
+media_table = cast(Table, MediaEntry.__table__)
+cards_table = cast(Table, FlashcardEntry.__table__)
+words_table = cast(Table, Word.__table__)
+
+
+@pytest.fixture
+def engine():
+    # The tables live in the "public" schema on Postgres; SQLite has no schemas
+    engine = create_engine("sqlite://").execution_options(schema_translate_map={"public": None})
+    for table in (Deck, Word, FlashcardEntry, GrammarEntry, MediaEntry):
+        cast(Table, table.__table__).create(engine)
+    yield engine
+    engine.dispose()
+
+
+def card(word, sentence="例文", image_url=None, meaning=None):
+    return {
+        "word": word,
+        "meaning": meaning or f"nghĩa {word}",
+        "example_sentences_1": sentence,
+        "meaning_example_sentences_1": "câu 1",
+        "example_sentences_2": sentence,
+        "meaning_example_sentences_2": "câu 2",
+        "image_url": image_url,
+    }
+
+
+def test_bulk_upsert_sends_one_statement_per_batch(engine):
+    statements = []
+    event.listen(engine, "before_cursor_execute", lambda *args: statements.append(args[2]))
+    with engine.begin() as connection:
+        rows = [{"name": f"{i}.webp"} for i in range(2500)]
+        assert bulk_upsert(connection, media_table, rows, ["name"], batch_size=1000) == 2500
+        bulk_upsert(connection, media_table, rows[:10], ["name"], update_columns=())
+    assert len([s for s in statements if s.startswith("INSERT")]) == 4
+    with engine.connect() as connection:
+        assert connection.execute(select(func.count()).select_from(media_table)).scalar() == 2500
+
+
+def test_upsert_compiles_to_on_conflict_for_postgres():
+    statement = (
+        postgresql.insert(cards_table)
+        .values([{"deck_id": 1, "row_key": "a", "normalized_word": "a", "word": "a"}])
+        .on_conflict_do_update(index_elements=["deck_id", "row_key"], set_={"word": "a"})
+    )
+    sql = str(statement.compile(dialect=postgresql.dialect()))
+    assert "ON CONFLICT (deck_id, row_key) DO UPDATE" in sql
+
+
+def test_db_sink_replaces_cards_by_row_key(engine):
+    with DbSink("n5", kind="flashcards", engine=engine) as sink:
+        sink.write(
+            [card("探す"), card("ＡＢＣ", image_url="abc.webp"), card("猫", image_url="https://x/cat.png")]
+        )
+        sink.write([card("探す", sentence="新しい例文"), card("abc", meaning="nghĩa ＡＢＣ")])
+        assert sink.rows_written == 5
+        assert sink.delete(["猫\x1fnghĩa 猫"]) == 1
+
+    with engine.connect() as connection:
+        rows = connection.execute(
+            select(cards_table.c.normalized_word, cards_table.c.example_sentences_1)
+        ).all()
+        assert sorted(rows) == [("abc", "例文"), ("探す", "新しい例文")]
+        words = connection.execute(select(words_table.c.normalized_word)).scalars().all()
+        assert sorted(words) == ["abc", "探す"]
+        assert connection.execute(select(media_table.c.name)).scalars().all() == ["abc.webp"]
+
+    # Reopening the deck by name keeps writing to the same deck
+    assert DbSink("n5", engine=engine).deck_id == sink.deck_id
+
+
+def test_db_sink_keys_cards_on_the_input_row(engine):
+    items = [{"word": "かける", "meaning": "gọi điện"}, {"word": "かける", "meaning": "treo"}]
+    with DbSink("n4", kind="flashcards", engine=engine) as sink:
+        # The model wrote the word back in kanji: the cards still belong to their input rows
+        sink.write([card("掛ける", meaning=item["meaning"]) for item in items], items=items)
+        sink.write([card("かける", sentence="新しい例文", meaning="treo")], items=items[1:])
+        with pytest.raises(ValueError):
+            sink.write([card("かける")], items=items)
+
+    with engine.connect() as connection:
+        rows = connection.execute(
+            select(cards_table.c.row_key, cards_table.c.word, cards_table.c.example_sentences_1)
+        ).all()
+        assert sorted(rows) == [
+            ("かける\x1fgọi điện", "掛ける", "例文"),
+            ("かける\x1ftreo", "かける", "新しい例文"),
+        ]
+        words = connection.execute(select(words_table.c.word, words_table.c.meaning)).all()
+        assert sorted(words) == [("かける", "gọi điện"), ("かける", "treo")]
@@ -0,0 +1,73 @@
+import csv
+import json
+
+import pyarrow.parquet as pq
+from openpyxl import Workbook
+
+from tools.converters import AnkiHeader, convert, iter_anki_text
+
+ANKI_EXPORT = (
+    "#separator:tab\n"
+    "#html:false\n"
+    '見ます、診ます\t\t"""chuẩn đoán, khám bệnh"""\t\t\tTrue\t\n'
+    "\n"
+    "探します、捜します\t\ttìm kiếm\t\t\tTrue\t\n"
+    "時間\n"
+)
+
+
+def test_header_directives():
+    header = AnkiHeader.parse(
+        ["#separator:semicolon\n", "#html:true\n", "#columns:Front;Back\n", "#deck:N3\n"]
+    )
+    assert header.separator == ";" and header.html
+    assert header.columns == ["Front", "Back"]
+    assert header.directives["deck"] == "N3"
+
+
+def test_anki_text_is_read_in_batches_with_the_header_directives(tmp_path):
+    path = tmp_path / "goi.txt"
+    path.write_text(ANKI_EXPORT, encoding="utf-8")
+    batches = list(iter_anki_text(path, columns=["Kanji", "Meaning"], batch_size=1))
+    assert batches == [
+        [{"Kanji": "見ます、診ます", "Meaning": "chuẩn đoán, khám bệnh"}],
+        [{"Kanji": "探します、捜します", "Meaning": "tìm kiếm"}],
+    ]
+
+    html_export = "#separator:comma\n#html:true\n#columns:Front,Back\n猫,<b>con mèo</b><br>mèo &amp; chó\n"
+    path.write_text(html_export, encoding="utf-8")
+    assert list(iter_anki_text(path)) == [[{"Front": "猫", "Back": "con mèo\nmèo & chó"}]]
+
+
+def test_convert_writes_csv_jsonl_and_parquet(tmp_path):
+    source = tmp_path / "goi.txt"
+    source.write_text(ANKI_EXPORT, encoding="utf-8")
+    columns = ["Kanji", "Meaning"]
+
+    assert convert(source, tmp_path / "goi.csv", columns=columns) == 2
+    with open(tmp_path / "goi.csv", encoding="utf-8", newline="") as f:
+        assert list(csv.reader(f))[1] == ["見ます、診ます", "chuẩn đoán, khám bệnh"]
+
+    assert convert(source, tmp_path / "goi.jsonl", columns=columns, batch_size=1) == 2
+    lines = (tmp_path / "goi.jsonl").read_text(encoding="utf-8").splitlines()
+    assert json.loads(lines[1]) == {"Kanji": "探します、捜します", "Meaning": "tìm kiếm"}
+
+    # Converting over an existing file replaces it rather than appending
+    assert convert(source, tmp_path / "goi.parquet", columns=columns, batch_size=1) == 2
+    assert convert(tmp_path / "goi.csv", tmp_path / "goi.parquet") == 2
+    table = pq.read_table(tmp_path / "goi.parquet")
+    assert table.column_names == columns and table.num_rows == 2
+
+
+def test_convert_streams_xlsx(tmp_path):
+    workbook = Workbook()
+    workbook.active.append(["word", "meaning"])
+    for i in range(5):
+        workbook.active.append([f"単語{i}", f"nghĩa {i}"])
+    workbook.active.append([None, None])
+    workbook.save(tmp_path / "final.xlsx")
+
+    assert convert(tmp_path / "final.xlsx", tmp_path / "flashcards.csv", batch_size=2) == 5
+    with open(tmp_path / "flashcards.csv", encoding="utf-8", newline="") as f:
+        rows = list(csv.DictReader(f))
+    assert rows[-1] == {"word": "単語4", "meaning": "nghĩa 4"}
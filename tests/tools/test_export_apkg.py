@@ -0,0 +1,98 @@
+import json
+import sqlite3
+import zipfile
+
+import httpx
+import pytest
+
+from agents.sinks import open_sink
+from tools.export_apkg import ApkgSink, export_csv_to_apkg, note_guid
+from tools.media_store import MediaStore
+
+COLUMNS = ["word", "meaning", "image_url"]
+
+
+def read_apkg(path, tmp_path):
+    with zipfile.ZipFile(path) as apkg:
+        apkg.extract("collection.anki2", tmp_path)
+        media = json.loads(apkg.read("media"))
+        files = {name: apkg.read(index) for index, name in media.items()}
+    conn = sqlite3.connect(str(tmp_path / "collection.anki2"))
+    notes = conn.execute("SELECT guid, mid, flds, sfld FROM notes ORDER BY id").fetchall()
+    cards = conn.execute("SELECT nid, did, due FROM cards ORDER BY id").fetchall()
+    models, decks = conn.execute("SELECT models, decks FROM col").fetchone()
+    conn.close()
+    return notes, cards, json.loads(models), json.loads(decks), files
+
+
+def test_apkg_sink_writes_notes_cards_and_media(tmp_path):
+    store = MediaStore(root=tmp_path / "media", client=httpx.Client())
+    name = "ab12.jpg"
+    store.path_for(name).parent.mkdir(parents=True)
+    store.path_for(name).write_bytes(b"jpeg bytes")
+    path = tmp_path / "deck.apkg"
+
+    with ApkgSink(path, COLUMNS, deck_name="N3", media_store=store) as sink:
+        sink.write([{"word": "見ます", "meaning": "xem", "image_url": name}])
+        sink.write(
+            [
+                {"word": "<b>探します</b>", "meaning": "tìm", "image_url": "https://example.com/a.png"},
+                {"word": "見ます", "meaning": "xem", "image_url": None},
+            ]
+        )
+    assert sink.notes_written == 2
+
+    notes, cards, models, decks, files = read_apkg(path, tmp_path)
+    assert [n[0] for n in notes] == [
+        note_guid(sink.note_type, "見ます\x1fxem"),
+        note_guid(sink.note_type, "<b>探します</b>\x1ftìm"),
+    ]
+    assert notes[0][2].split("\x1f") == ["見ます", "xem", f'<img src="{name}">']
+    assert notes[1][3] == "<b>探します</b>"
+    assert [c[2] for c in cards] == [1, 2]
+    assert {c[1] for c in cards} == {sink.deck_id}
+    assert [f["name"] for f in models[str(sink.model_id)]["flds"]] == ["word", "meaning", "image"]
+    assert decks[str(sink.deck_id)]["name"] == "N3"
+    assert files == {name: b"jpeg bytes"}
+    store.close()
+
+
+def test_reexport_keeps_guids_and_ids(tmp_path):
+    rows = [{"word": "食べます", "meaning": "ăn", "image_url": None}]
+    first = tmp_path / "first.apkg"
+    second = tmp_path / "second.apkg"
+    with ApkgSink(first, COLUMNS) as sink_a:
+        sink_a.write(rows)
+    with ApkgSink(second, COLUMNS, deck_name="first") as sink_b:
+        sink_b.write(rows)
+
+    assert (sink_a.model_id, sink_a.deck_id) == (sink_b.model_id, sink_b.deck_id)
+    (tmp_path / "a").mkdir()
+    (tmp_path / "b").mkdir()
+    notes_a = read_apkg(first, tmp_path / "a")[0]
+    notes_b = read_apkg(second, tmp_path / "b")[0]
+    assert notes_a[0][0] == notes_b[0][0]
+
+
+def test_each_sense_of_a_word_is_its_own_note(tmp_path):
+    rows = [
+        {"word": "やります", "meaning": "làm", "image_url": None},
+        {"word": "やります", "meaning": "cho", "image_url": None},
+    ]
+    with ApkgSink(tmp_path / "deck.apkg", COLUMNS) as sink:
+        sink.write(rows)
+
+    notes = read_apkg(tmp_path / "deck.apkg", tmp_path)[0]
+    assert sink.notes_written == 2
+    assert [n[2].split("\x1f")[1] for n in notes] == ["làm", "cho"]
+    assert len({n[0] for n in notes}) == 2
+
+
+def test_apkg_is_export_only_and_empty_input_writes_nothing(tmp_path):
+    with pytest.raises(ValueError, match="export-only"):
+        open_sink(tmp_path / "deck.apkg", COLUMNS)
+
+    source = tmp_path / "empty.csv"
+    source.write_text("", encoding="utf-8")
+    assert export_csv_to_apkg(source, tmp_path / "empty.apkg") == 0
+    assert not (tmp_path / "empty.apkg").exists()
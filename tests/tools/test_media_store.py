@@ -0,0 +1,73 @@
+import io
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from PIL import Image
+
+from agents.flascard_generator import Flashcard
+from tools.media_store import MediaStore
+
+
+def png(color, size=(1200, 800)) -> bytes:
+    out = io.BytesIO()
+    Image.new("RGB", size, color).save(out, format="PNG")
+    return out.getvalue()
+
+
+@pytest.fixture
+def image_server():
+    """Local HTTP stub: /red and /also-red serve the same image, /blue another one."""
+    images = {"/red": png("red"), "/also-red": png("red"), "/blue": png("blue")}
+    hits = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            hits.append(self.path)
+            body = images.get(self.path)
+            self.send_response(200 if body else 404)
+            self.end_headers()
+            self.wfile.write(body or b"")
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_port}", hits
+    server.shutdown()
+
+
+def card(word, image_url):
+    return Flashcard(
+        word=word,
+        meaning="m",
+        example_sentences_1="s1",
+        meaning_example_sentences_1="m1",
+        example_sentences_2="s2",
+        meaning_example_sentences_2="m2",
+        image_url=image_url,
+    )
+
+
+def test_localize_dedupes_and_resizes(tmp_path, image_server):
+    base, hits = image_server
+    store = MediaStore(tmp_path / "media", max_size=256)
+    cards = [card("a", f"{base}/red"), card("b", f"{base}/also-red"), card("c", f"{base}/blue")]
+
+    store.localize(cards)
+
+    assert cards[0].image_url == cards[1].image_url != cards[2].image_url
+    stored = store.path_for(cards[0].image_url)
+    assert stored.parent.name == cards[0].image_url[:2]
+    with Image.open(stored) as image:
+        assert max(image.size) == 256
+    assert len([p for p in (tmp_path / "media").rglob("*.jpg")]) == 2
+
+    # Known URLs are served from the index without another download
+    hits.clear()
+    again = [card("a", f"{base}/red"), card("d", f"{base}/missing")]
+    store.localize(again)
+    assert again[0].image_url == cards[0].image_url
+    assert again[1].image_url == f"{base}/missing"
+    assert hits == ["/missing"]
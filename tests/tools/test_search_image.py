@@ -0,0 +1,104 @@
+import threading
+import time
+from unittest.mock import MagicMock
+
+from tools.search_image import ImageCache, ImageSearchClient
+
+
+def make_service(results, delay=0.0):
+    """Mock of the Custom Search service: `results` maps query → list of links."""
+    calls = []
+    lock = threading.Lock()
+
+    def list_(q, cx, searchType, num):
+        request = MagicMock()
+
+        def execute():
+            with lock:
+                calls.append(q)
+            time.sleep(delay)
+            if q not in results:
+                raise RuntimeError("quota exceeded")
+            return {"items": [{"link": link} for link in results[q]]}
+
+        request.execute.side_effect = execute
+        return request
+
+    service = MagicMock()
+    service.cse.return_value.list.side_effect = list_
+    return service, calls
+
+
+def test_service_built_once_per_thread_and_cached(tmp_path):
+    service, calls = make_service(
+        {"見ます": ["http://a/1.png"], "診ます": [], "探します": ["http://a/2.png"]}
+    )
+    builds = []
+
+    def factory():
+        builds.append(threading.get_ident())
+        return service, "cx"
+
+    client = ImageSearchClient(factory, cache=ImageCache(tmp_path / "images.sqlite"), max_workers=1)
+
+    assert client.search_many(["見ます", "診ます", "見ます"]) == {"見ます": ["http://a/1.png"], "診ます": []}
+    # 探します misses the cache, so this call needs the service again
+    assert client.search_many(["見ます", "診ます", "探します"]) == {
+        "見ます": ["http://a/1.png"],
+        "診ます": [],
+        "探します": ["http://a/2.png"],
+    }
+    assert len(builds) == 1
+    # The empty result for 診ます is negatively cached too
+    assert calls == ["見ます", "診ます", "探します"]
+    client.close()
+
+
+def test_pool_threads_and_their_services_are_reused_across_calls():
+    service, calls = make_service({f"w{i}": [] for i in range(20)}, delay=0.01)
+    builds = []
+    lock = threading.Lock()
+
+    def factory():
+        with lock:
+            builds.append(threading.get_ident())
+        return service, "cx"
+
+    client = ImageSearchClient(factory, max_workers=4)
+    for call in range(5):
+        client.search_many([f"w{i}" for i in range(call * 4, call * 4 + 4)])
+    client.close()
+
+    assert len(calls) == 20
+    assert len(builds) <= 4
+
+
+def test_errors_are_not_cached(tmp_path):
+    service, calls = make_service({})
+    client = ImageSearchClient(lambda: (service, "cx"), cache=ImageCache(tmp_path / "images.sqlite"))
+
+    assert client.search_many(["探します"]) == {"探します": []}
+    assert client.search_many(["探します"]) == {"探します": []}
+    assert calls == ["探します", "探します"]
+
+
+def test_lookups_run_in_parallel():
+    words = [f"w{i}" for i in range(16)]
+    service, _ = make_service({w: [f"http://img/{w}"] for w in words}, delay=0.05)
+    client = ImageSearchClient(lambda: (service, "cx"), max_workers=8)
+
+    started = time.monotonic()
+    result = client.search_many(words)
+
+    assert result == {w: [f"http://img/{w}"] for w in words}
+    assert time.monotonic() - started < 0.4
+
+
+def test_negative_entries_expire_sooner(tmp_path):
+    cache = ImageCache(tmp_path / "images.sqlite", ttl_seconds=3600, negative_ttl_seconds=0)
+    cache.set("a", 5, ["http://a"])
+    cache.set("b", 5, [])
+    time.sleep(0.01)
+
+    assert cache.get("a", 5) == ["http://a"]
+    assert cache.get("b", 5) is None
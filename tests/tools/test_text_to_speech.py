@@ -0,0 +1,70 @@
+from types import SimpleNamespace
+
+import pytest
+
+from tools.text_to_speech import TextToSpeech, find_voice
+
+
+class FakeEngine:
+    def __init__(self):
+        self.properties = {
+            "voices": [
+                SimpleNamespace(id="english", languages=[b"\x05en"]),
+                SimpleNamespace(id="kyoko", languages=["ja_JP"]),
+            ]
+        }
+        self.queued = []
+        self.runs = 0
+        self.saved = []
+
+    def getProperty(self, name):
+        return self.properties[name]
+
+    def setProperty(self, name, value):
+        self.properties[name] = value
+
+    def save_to_file(self, text, path):
+        self.queued.append((text, path))
+
+    def runAndWait(self):
+        self.runs += 1
+        for text, path in self.queued:
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(text)
+            self.saved.append(text)
+        self.queued = []
+
+
+def test_find_voice_by_language():
+    voices = FakeEngine().properties["voices"]
+    assert find_voice(voices, "ja").id == "kyoko"
+    assert find_voice(voices, "ja-JP").id == "kyoko"
+    assert find_voice(voices, "en").id == "english"
+    with pytest.raises(ValueError):
+        find_voice(voices, "vi")
+
+
+def test_synthesize_many_batches_and_caches(tmp_path):
+    engine = FakeEngine()
+    tts = TextToSpeech(
+        language="ja", rate=150, audio_dir=tmp_path, batch_size=2, engine_factory=lambda: engine
+    )
+
+    names = tts.synthesize_many(["見ます", "探します", "見ます", "食べます"])
+
+    assert list(names) == ["見ます", "探します", "食べます"]
+    assert engine.runs == 2
+    assert engine.properties["voice"] == "kyoko"
+    assert engine.properties["rate"] == 150
+    assert (tmp_path / names["探します"]).read_text(encoding="utf-8") == "探します"
+
+    again = tts.synthesize_many(["探します", "行きます"])
+    assert again["探します"] == names["探します"]
+    assert engine.saved == ["見ます", "探します", "食べます", "行きます"]
+
+
+def test_audio_name_depends_on_rate(tmp_path):
+    slow = TextToSpeech(rate=100, audio_dir=tmp_path, engine_factory=FakeEngine)
+    fast = TextToSpeech(rate=200, audio_dir=tmp_path, engine_factory=FakeEngine)
+    assert slow.audio_name("見ます") != fast.audio_name("見ます")
+    assert slow.audio_name("見ます") == slow.audio_name("見ます")
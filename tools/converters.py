@@ -0,0 +1,231 @@
+import csv
+import html
+import json
+import os
+import re
+import sys
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Sequence, TextIO, Union
+
+from agents.sinks import open_sink
+
+# Giá trị của chỉ thị `#separator:` trong file Anki xuất ra
+_SEPARATORS = {"tab": "\t", "comma": ",", "semicolon": ";", "space": " ", "pipe": "|", "colon": ":"}
+_HTML_TAG = re.compile(r"<[^>]+>")
+_HTML_BREAK = re.compile(r"<br\s*/?>|</div>|</p>", re.IGNORECASE)
+
+# Số dòng mỗi lô khi đọc và ghi
+DEFAULT_BATCH_SIZE = 5000
+
+
+@dataclass
+class AnkiHeader:
+    """Các chỉ thị `#key:value` ở đầu file text mà Anki xuất ra (ví dụ `#separator:tab`, `#html:false`)."""
+
+    separator: str = "\t"
+    html: bool = False
+    columns: Optional[List[str]] = None
+    # Các chỉ thị khác (`#deck:`, `#notetype column:`, `#tags column:`...) được giữ nguyên
+    directives: Dict[str, str] = field(default_factory=dict)
+
+    @classmethod
+    def parse(cls, lines: Sequence[str]) -> "AnkiHeader":
+        header = cls()
+        for line in lines:
+            key, _, value = line.lstrip("#").rstrip("\r\n").partition(":")
+            key = key.strip().lower()
+            header.directives[key] = value
+            if key == "separator":
+                header.separator = _SEPARATORS.get(value.strip().lower(), value or "\t")
+            elif key == "html":
+                header.html = value.strip().lower() == "true"
+        if "columns" in header.directives:
+            header.columns = header.directives["columns"].split(header.separator)
+        return header
+
+
+def read_anki_header(file: TextIO) -> AnkiHeader:
+    """Đọc các dòng chỉ thị ở đầu file và để con trỏ file ở dòng dữ liệu đầu tiên."""
+    lines = []
+    while True:
+        position = file.tell()
+        line = file.readline()
+        if not line.startswith("#"):
+            file.seek(position)
+            break
+        lines.append(line)
+    return AnkiHeader.parse(lines)
+
+
+def html_to_text(value: str) -> str:
+    """Chuyển một trường HTML của Anki thành văn bản thường"""
+    return html.unescape(_HTML_TAG.sub("", _HTML_BREAK.sub("\n", value))).strip()
+
+
+def iter_anki_text(
+    path: Union[str, Path],
+    columns: Optional[Sequence[str]] = None,
+    compact: bool = True,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+) -> Iterator[List[dict]]:
+    """
+    Đọc file text Anki xuất ra theo từng lô dòng, không nạp cả file vào bộ nhớ
+
+    Args:
+        path: File .txt của Anki
+        columns: Tên các cột; mặc định lấy từ chỉ thị `#columns:`
+        compact: Bỏ các trường rỗng trước khi ghép với tên cột, như các file xuất có cột trống xen kẽ
+        batch_size: Số dòng mỗi lô
+    """
+    with open(path, "r", encoding="utf-8-sig", newline="") as f:
+        header = read_anki_header(f)
+        columns = list(columns or header.columns or [])
+        if not columns:
+            raise ValueError(f"{path}: no #columns: directive, pass the column names")
+        # Anki đặt trong ngoặc kép các trường có dấu phân cách, ngoặc kép hoặc xuống dòng, như CSV
+        reader = csv.reader(f, delimiter=header.separator)
+        batch = []
+        for fields in reader:
+            if compact:
+                fields = [value for value in fields if value.strip()]
+            if len(fields) < len(columns):
+                continue
+            if header.html:
+                fields = [html_to_text(value) for value in fields]
+            batch.append({c: value.strip().strip('"') for c, value in zip(columns, fields)})
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+
+def iter_csv(path: Union[str, Path], batch_size: int = DEFAULT_BATCH_SIZE) -> Iterator[List[dict]]:
+    with open(path, "r", encoding="utf-8-sig", newline="") as f:
+        batch = []
+        for row in csv.DictReader(f):
+            batch.append(row)
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+
+def iter_xlsx(path: Union[str, Path], batch_size: int = DEFAULT_BATCH_SIZE) -> Iterator[List[dict]]:
+    """Đọc sheet đầu tiên ở chế độ read-only của openpyxl, từng dòng một thay vì nạp cả workbook"""
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(path, read_only=True)
+    try:
+        values = workbook.active.iter_rows(values_only=True)
+        header = [str(c) if c is not None else "" for c in next(values, ())]
+        batch = []
+        for row in values:
+            if all(v is None for v in row):
+                continue
+            batch.append({h: v for h, v in zip(header, row) if h})
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+    finally:
+        workbook.close()
+
+
+def iter_parquet(path: Union[str, Path], batch_size: int = DEFAULT_BATCH_SIZE) -> Iterator[List[dict]]:
+    """Đọc file Parquet qua memory map, mỗi lần một lô dòng"""
+    import pyarrow.parquet as pq
+
+    parquet_file = pq.ParquetFile(path, memory_map=True)
+    for record_batch in parquet_file.iter_batches(batch_size=batch_size):
+        yield record_batch.to_pylist()
+
+
+def iter_jsonl(path: Union[str, Path], batch_size: int = DEFAULT_BATCH_SIZE) -> Iterator[List[dict]]:
+    with open(path, "r", encoding="utf-8") as f:
+        batch = []
+        for line in f:
+            if line.strip():
+                batch.append(json.loads(line))
+                if len(batch) >= batch_size:
+                    yield batch
+                    batch = []
+        if batch:
+            yield batch
+
+
+def read_rows(
+    path: Union[str, Path], batch_size: int = DEFAULT_BATCH_SIZE, columns: Optional[Sequence[str]] = None
+) -> Iterator[List[dict]]:
+    """Đọc từng lô dòng của file .txt (Anki), .csv, .xlsx, .parquet hoặc .jsonl, chọn theo đuôi file"""
+    suffix = Path(path).suffix.lower()
+    if suffix == ".txt":
+        return iter_anki_text(path, columns=columns, batch_size=batch_size)
+    if suffix == ".csv":
+        return iter_csv(path, batch_size)
+    if suffix == ".xlsx":
+        return iter_xlsx(path, batch_size)
+    if suffix == ".parquet":
+        return iter_parquet(path, batch_size)
+    if suffix in (".jsonl", ".ndjson"):
+        return iter_jsonl(path, batch_size)
+    raise ValueError(f"Unsupported input format: {suffix}")
+
+
+def convert(
+    input_file: Union[str, Path],
+    output_file: Union[str, Path],
+    columns: Optional[Sequence[str]] = None,
+    format: Optional[str] = None,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    schema: Optional[Any] = None,
+) -> int:
+    """
+    Chuyển đổi file theo luồng: đọc từng lô và ghi ngay ra CSV, XLSX, Parquet hoặc JSONL
+
+    Bộ nhớ dùng chỉ phụ thuộc vào `batch_size`, không phụ thuộc vào kích thước file. File
+    đích được ghi vào file tạm rồi mới thay thế, nên lỗi giữa chừng không làm hỏng file cũ.
+
+    Args:
+        input_file: File nguồn (.txt Anki, .csv, .xlsx, .parquet, .jsonl)
+        output_file: File đích; định dạng lấy từ `format` hoặc đuôi file
+        columns: Tên cột cho file text Anki không có chỉ thị `#columns:`
+        format: "csv", "xlsx", "parquet" hoặc "jsonl"
+        batch_size: Số dòng mỗi lô
+        schema: Schema pyarrow cho file Parquet đích, ví dụ `arrow_schema(Flashcard)` để
+            chuyển một file .xlsx cũ sang định dạng chuẩn của bộ thẻ (xem agents/deck_format.py)
+
+    Returns:
+        int: Số dòng đã ghi
+    """
+    output_file = Path(output_file)
+    format = (format or output_file.suffix.lstrip(".")).lower()
+    tmp_path = output_file.with_name(f".{output_file.stem}.tmp{output_file.suffix}")
+    if tmp_path.exists():
+        tmp_path.unlink()
+
+    batches = read_rows(input_file, batch_size=batch_size, columns=columns)
+    first = next(batches, [])
+    # Cột của file đích lấy theo schema, hoặc theo thứ tự của dòng đầu tiên
+    if columns is None and schema is not None:
+        columns = schema.names
+    header = list(columns or (first[0].keys() if first else []))
+    with open_sink(tmp_path, header, format=format, schema=schema) as sink:
+        if first:
+            sink.write(first)
+        for batch in batches:
+            sink.write(batch)
+    os.replace(tmp_path, output_file)
+    return sink.rows_written
+
+
+if __name__ == "__main__":
+    # python -m tools.converters <input> <output> [cột1,cột2,...]
+    if len(sys.argv) < 3:
+        print("Usage: python -m tools.converters <input> <output> [column,column,...]")
+        sys.exit(1)
+    written = convert(sys.argv[1], sys.argv[2], columns=sys.argv[3].split(",") if len(sys.argv) > 3 else None)
+    print(f"Đã ghi {written} dòng vào '{sys.argv[2]}'")
@@ -0,0 +1,378 @@
+import hashlib
+import html
+import json
+import re
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+import zipfile
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Set, Union
+
+from agents.sinks import FileSink
+from tools.media_store import MediaStore
+from utils.log import logger
+
+# Bảng chữ cái base91 mà Anki dùng cho GUID của note
+_BASE91 = "abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789!#$%&()*+,-./:;<=>?@[]^_`{|}~"
+_FIELD_SEPARATOR = "\x1f"
+_HTML_TAG = re.compile(r"<[^>]+>")
+# Cột chứa ảnh được xuất thành thẻ <img> và file ảnh được đóng gói vào .apkg
+IMAGE_COLUMN = "image_url"
+
+# Schema của collection.anki2 (schema 11) mà mọi phiên bản Anki đều import được
+_SCHEMA = """
+CREATE TABLE col (
+    id integer primary key, crt integer not null, mod integer not null, scm integer not null,
+    ver integer not null, dty integer not null, usn integer not null, ls integer not null,
+    conf text not null, models text not null, decks text not null, dconf text not null, tags text not null
+);
+CREATE TABLE notes (
+    id integer primary key, guid text not null, mid integer not null, mod integer not null,
+    usn integer not null, tags text not null, flds text not null, sfld integer not null,
+    csum integer not null, flags integer not null, data text not null
+);
+CREATE TABLE cards (
+    id integer primary key, nid integer not null, did integer not null, ord integer not null,
+    mod integer not null, usn integer not null, type integer not null, queue integer not null,
+    due integer not null, ivl integer not null, factor integer not null, reps integer not null,
+    lapses integer not null, left integer not null, odue integer not null, odid integer not null,
+    flags integer not null, data text not null
+);
+CREATE TABLE revlog (
+    id integer primary key, cid integer not null, usn integer not null, ease integer not null,
+    ivl integer not null, lastIvl integer not null, factor integer not null, time integer not null,
+    type integer not null
+);
+CREATE TABLE graves (usn integer not null, oid integer not null, type integer not null);
+"""
+
+# Index được tạo sau khi đã chèn hết note, để các lần chèn không phải cập nhật index
+_INDEXES = """
+CREATE INDEX ix_notes_usn ON notes (usn);
+CREATE INDEX ix_cards_usn ON cards (usn);
+CREATE INDEX ix_revlog_usn ON revlog (usn);
+CREATE INDEX ix_cards_nid ON cards (nid);
+CREATE INDEX ix_cards_sched ON cards (did, queue, due);
+CREATE INDEX ix_revlog_cid ON revlog (cid);
+CREATE INDEX ix_notes_csum ON notes (csum);
+"""
+
+_CSS = ".card { font-family: arial; font-size: 22px; text-align: center; color: black; background-color: white; }"
+
+
+def _stable_int(text: str, bits: int) -> int:
+    return int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "big") >> (64 - bits)
+
+
+def stable_id(text: str) -> int:
+    """ID ổn định (dương, 52 bit) cho note type và deck, để các lần xuất sau trỏ về cùng đối tượng"""
+    return _stable_int(text, 52) or 1
+
+
+def note_guid(note_type: str, key: str) -> str:
+    """
+    GUID của note, suy ra từ note type và khóa của dòng (từ vựng và nghĩa, xem `ApkgSink`)
+
+    Anki nhận ra note đã có theo GUID, nên xuất lại cùng một dòng sẽ cập nhật note cũ
+    thay vì tạo note trùng, còn mỗi nghĩa của một từ vẫn là một note riêng.
+    """
+    value = _stable_int(f"{note_type}{_FIELD_SEPARATOR}{key}", 64)
+    chars = []
+    while value:
+        value, remainder = divmod(value, len(_BASE91))
+        chars.append(_BASE91[remainder])
+    return "".join(reversed(chars)) or _BASE91[0]
+
+
+def _strip_html(text: str) -> str:
+    return html.unescape(_HTML_TAG.sub("", text)).strip()
+
+
+def _checksum(text: str) -> int:
+    return int(hashlib.sha1(_strip_html(text).encode("utf-8")).hexdigest()[:8], 16)
+
+
+class ApkgSink(FileSink):
+    """
+    Ghi các record (Flashcard, Grammar) thẳng vào một gói Anki .apkg
+
+    Note được chèn dần vào collection.anki2 trong một thư mục tạm bằng `executemany`,
+    tất cả trong một transaction duy nhất; bộ nhớ không tăng theo số note. `close`
+    commit transaction, tạo index rồi nén collection cùng các file media thành .apkg.
+
+    Cột đầu tiên là trường chính của note (mặt trước của thẻ). GUID được tạo từ các cột
+    `key_fields`, mặc định là cột đầu tiên và cột `meaning` (nếu có), giống khóa của các
+    dòng trong deck index, nên hai nghĩa của cùng một từ (ví dụ やります "làm" và "cho")
+    là hai note riêng. Cột `image_url` chứa tên file trong `media_store` (xem
+    MediaStore.localize) hoặc URL.
+
+    Args:
+        path: Đường dẫn file .apkg
+        columns: Các trường của note, theo thứ tự
+        deck_name (str | None): Tên deck, mặc định là tên file
+        note_type (str | None): Tên note type, mặc định là "anki-agent <trường chính>"
+        media_store (MediaStore | None): Kho media chứa các ảnh được tham chiếu
+        key_fields (Sequence[str] | None): Các cột tạo nên khóa (và GUID) của note
+    """
+
+    def __init__(
+        self,
+        path: Union[str, Path],
+        columns: Sequence[str],
+        deck_name: Optional[str] = None,
+        note_type: Optional[str] = None,
+        media_store: Optional[MediaStore] = None,
+        key_fields: Optional[Sequence[str]] = None,
+    ):
+        super().__init__(path, columns)
+        if not self.columns:
+            raise ValueError("ApkgSink needs at least one column")
+        if key_fields is None:
+            key_fields = [self.columns[0]] + (["meaning"] if "meaning" in self.columns[1:] else [])
+        self.key_fields = list(key_fields)
+        self.deck_name = deck_name or self.path.stem
+        self.note_type = note_type or f"anki-agent {self.columns[0]}"
+        self.media_store = media_store
+        self.model_id = stable_id(f"model{_FIELD_SEPARATOR}{self.note_type}")
+        self.deck_id = stable_id(f"deck{_FIELD_SEPARATOR}{self.deck_name}")
+        self._now = int(time.time())
+        self._next_id = int(time.time() * 1000)
+        self._guids: Set[str] = set()
+        self._media: Dict[str, Path] = {}
+        self._closed = False
+
+        self._tmpdir = tempfile.mkdtemp(prefix="apkg-")
+        self._db_path = Path(self._tmpdir) / "collection.anki2"
+        # isolation_level=None: tự quản lý transaction, chỉ một BEGIN/COMMIT cho cả file
+        self._conn = sqlite3.connect(str(self._db_path), isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode = OFF")
+        self._conn.execute("PRAGMA synchronous = OFF")
+        self._conn.executescript(_SCHEMA)
+        self._conn.execute("BEGIN")
+
+    @property
+    def notes_written(self) -> int:
+        """Số note đã ghi, không tính các dòng trùng bị bỏ qua"""
+        return len(self._guids)
+
+    @property
+    def fields(self) -> List[str]:
+        """Tên các trường của note; cột image_url được đặt tên là image"""
+        return ["image" if c == IMAGE_COLUMN else c for c in self.columns]
+
+    def _render(self, column: str, value) -> str:
+        if value is None:
+            return ""
+        value = str(value)
+        if column != IMAGE_COLUMN or not value:
+            return html.escape(value, quote=False)
+        if "://" not in value and self.media_store is not None:
+            path = self.media_store.path_for(value)
+            if path.exists():
+                self._media[value] = path
+            else:
+                logger.warning(f"Media file {value} is missing from {self.media_store.root}")
+        return f'<img src="{html.escape(value)}">'
+
+    def _write(self, rows: List[dict]) -> None:
+        notes = []
+        cards = []
+        for row in rows:
+            key = _FIELD_SEPARATOR.join(str(row.get(f) or "").strip() for f in self.key_fields)
+            guid = note_guid(self.note_type, key)
+            if guid in self._guids:
+                logger.warning(f"Skipping duplicate note for {key.replace(_FIELD_SEPARATOR, ' / ')!r}")
+                continue
+            self._guids.add(guid)
+            values = [self._render(c, row.get(c)) for c in self.columns]
+            note_id = self._next_id
+            card_id = self._next_id + 1
+            self._next_id += 2
+            sort_field = _strip_html(values[0])
+            notes.append(
+                (
+                    note_id,
+                    guid,
+                    self.model_id,
+                    self._now,
+                    -1,
+                    "",
+                    _FIELD_SEPARATOR.join(values),
+                    sort_field,
+                    _checksum(values[0]),
+                    0,
+                    "",
+                )
+            )
+            # Thẻ mới được xếp theo thứ tự ghi (due = vị trí trong hàng đợi thẻ mới)
+            cards.append(
+                (
+                    card_id,
+                    note_id,
+                    self.deck_id,
+                    0,
+                    self._now,
+                    -1,
+                    0,
+                    0,
+                    len(self._guids),
+                    0,
+                    0,
+                    0,
+                    0,
+                    0,
+                    0,
+                    0,
+                    0,
+                    "",
+                )
+            )
+        self._conn.executemany("INSERT INTO notes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", notes)
+        self._conn.executemany(
+            "INSERT INTO cards VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", cards
+        )
+
+    def _model(self) -> dict:
+        fields = self.fields
+        back = "".join(f"{{{{{name}}}}}<br>" for name in fields[1:])
+        return {
+            "id": self.model_id,
+            "name": self.note_type,
+            "type": 0,
+            "mod": self._now,
+            "usn": -1,
+            "sortf": 0,
+            "did": self.deck_id,
+            "tmpls": [
+                {
+                    "name": "Card 1",
+                    "ord": 0,
+                    "qfmt": f"{{{{{fields[0]}}}}}",
+                    "afmt": f'{{{{FrontSide}}}}<hr id="answer">{back}',
+                    "did": None,
+                    "bqfmt": "",
+                    "bafmt": "",
+                }
+            ],
+            "flds": [
+                {
+                    "name": name,
+                    "ord": i,
+                    "sticky": False,
+                    "rtl": False,
+                    "font": "Arial",
+                    "size": 20,
+                    "media": [],
+                }
+                for i, name in enumerate(fields)
+            ],
+            "css": _CSS,
+            "latexPre": "\\documentclass[12pt]{article}\n\\begin{document}\n",
+            "latexPost": "\\end{document}",
+            "latexsvg": False,
+            "req": [[0, "any", [0]]],
+            "tags": [],
+            "vers": [],
+        }
+
+    def _deck(self, deck_id: int, name: str) -> dict:
+        return {
+            "id": deck_id,
+            "name": name,
+            "mod": self._now,
+            "usn": -1,
+            "desc": "",
+            "dyn": 0,
+            "conf": 1,
+            "collapsed": False,
+            "extendNew": 10,
+            "extendRev": 50,
+            "newToday": [0, 0],
+            "revToday": [0, 0],
+            "lrnToday": [0, 0],
+            "timeToday": [0, 0],
+        }
+
+    def _write_collection(self) -> None:
+        decks = {"1": self._deck(1, "Default"), str(self.deck_id): self._deck(self.deck_id, self.deck_name)}
+        conf = {"curDeck": self.deck_id, "curModel": self.model_id, "nextPos": len(self._guids) + 1}
+        self._conn.execute(
+            "INSERT INTO col VALUES (1, ?, ?, ?, 11, 0, 0, 0, ?, ?, ?, ?, '{}')",
+            (
+                self._now,
+                self._now * 1000,
+                self._now * 1000,
+                json.dumps(conf),
+                json.dumps({str(self.model_id): self._model()}, ensure_ascii=False),
+                json.dumps(decks, ensure_ascii=False),
+                json.dumps({}),
+            ),
+        )
+        self._conn.execute("COMMIT")
+        self._conn.executescript(_INDEXES)
+        self._conn.close()
+
+    def _package(self) -> None:
+        tmp_path = self.path.with_name(self.path.name + ".tmp")
+        with zipfile.ZipFile(tmp_path, "w", compression=zipfile.ZIP_DEFLATED) as apkg:
+            apkg.write(self._db_path, "collection.anki2")
+            # File media được ghi lần lượt từ đĩa với tên "0", "1", ... như Anki yêu cầu
+            media_map = {}
+            for i, (name, path) in enumerate(self._media.items()):
+                apkg.write(path, str(i), compress_type=zipfile.ZIP_STORED)
+                media_map[str(i)] = name
+            apkg.writestr("media", json.dumps(media_map, ensure_ascii=False))
+        tmp_path.replace(self.path)
+
+    def close(self) -> None:
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            self._write_collection()
+            self._package()
+            logger.info(
+                f"Exported {len(self._guids)} notes and {len(self._media)} media files to {self.path}"
+            )
+        finally:
+            shutil.rmtree(self._tmpdir, ignore_errors=True)
+
+
+def export_csv_to_apkg(
+    csv_file: Union[str, Path],
+    apkg_file: Union[str, Path],
+    deck_name: Optional[str] = None,
+    media_store: Optional[MediaStore] = None,
+    batch_size: int = 1000,
+) -> int:
+    """
+    Chuyển một bộ thẻ (file .parquet chuẩn, hoặc .csv, .xlsx... ví dụ data/flashcards.csv) thành gói
+    .apkg, đọc và ghi theo từng batch
+
+    Returns:
+        int: Số note đã ghi
+    """
+    from tools.converters import read_rows
+
+    batches = read_rows(csv_file, batch_size=batch_size)
+    first = next(batches, [])
+    if not first:
+        # Không có dòng nào thì cũng không có trường nào để tạo note type
+        logger.warning(f"{csv_file} has no rows, nothing to export")
+        return 0
+    with ApkgSink(apkg_file, list(first[0].keys()), deck_name=deck_name, media_store=media_store) as sink:
+        sink.write(first)
+        for batch in batches:
+            sink.write(batch)
+        return sink.notes_written
+
+
+if __name__ == "__main__":
+    data_dir = Path(__file__).parent.parent / "data"
+    csv_file = Path(sys.argv[1]) if len(sys.argv) > 1 else data_dir / "flashcards.csv"
+    apkg_file = Path(sys.argv[2]) if len(sys.argv) > 2 else csv_file.with_suffix(".apkg")
+    count = export_csv_to_apkg(csv_file, apkg_file, media_store=MediaStore())
+    print(f"Đã xuất {count} note từ '{csv_file}' sang '{apkg_file}'")
@@ -0,0 +1,150 @@
+import hashlib
+import io
+import os
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, Iterable, Optional, Union
+
+import httpx
+
+from utils.log import logger
+
+# Thư mục mặc định chứa media của deck
+DEFAULT_MEDIA_DIR = Path(__file__).parent.parent / "data" / "media"
+
+
+class MediaStore:
+    """
+    Kho media cục bộ cho flashcard: tải ảnh song song, loại trùng theo hash nội dung
+    và lưu thumbnail vào các thư mục con (shard) theo 2 ký tự đầu của hash
+
+    Tên file media (ví dụ `3f2a...c1.jpg`) là duy nhất theo nội dung, nên có thể dùng
+    trực tiếp làm tên file trong collection.media của Anki. Một index SQLite ghi lại
+    URL → tên file để những URL đã tải không bị tải lại.
+
+    Args:
+        root: Thư mục gốc của kho media
+        max_size (int): Cạnh dài nhất của thumbnail, tính bằng pixel
+        max_workers (int): Số lượt tải song song tối đa
+    """
+
+    def __init__(
+        self,
+        root: Union[str, Path, None] = None,
+        max_size: int = 512,
+        quality: int = 85,
+        max_workers: int = 8,
+        timeout: float = 15.0,
+        client: Optional[httpx.Client] = None,
+    ):
+        self.root = Path(root) if root is not None else DEFAULT_MEDIA_DIR
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.max_size = max_size
+        self.quality = quality
+        self.max_workers = max_workers
+        self.client = client or httpx.Client(
+            timeout=timeout,
+            follow_redirects=True,
+            limits=httpx.Limits(max_connections=max_workers, max_keepalive_connections=max_workers),
+        )
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.root / "index.sqlite"), check_same_thread=False)
+        self._conn.execute("CREATE TABLE IF NOT EXISTS urls (url TEXT PRIMARY KEY, name TEXT NOT NULL)")
+        self._conn.commit()
+
+    def path_for(self, name: str) -> Path:
+        """Đường dẫn trên đĩa của một file media"""
+        return self.root / name[:2] / name
+
+    def _lookup(self, url: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute("SELECT name FROM urls WHERE url = ?", (url,)).fetchone()
+        if row is not None and self.path_for(row[0]).exists():
+            return row[0]
+        return None
+
+    def _remember(self, url: str, name: str) -> None:
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO urls (url, name) VALUES (?, ?)", (url, name))
+            self._conn.commit()
+
+    def _thumbnail(self, data: bytes) -> tuple:
+        """Thu nhỏ ảnh thành JPEG. Trả về (bytes, đuôi file); giữ nguyên ảnh gốc nếu không có Pillow."""
+        try:
+            from PIL import Image
+        except ImportError:
+            logger.warning("Pillow is not installed, storing original images without resizing")
+            return data, ".img"
+        with Image.open(io.BytesIO(data)) as opened:
+            opened.thumbnail((self.max_size, self.max_size))
+            image = opened if opened.mode in ("RGB", "L") else opened.convert("RGB")
+            out = io.BytesIO()
+            image.save(out, format="JPEG", quality=self.quality, optimize=True)
+        return out.getvalue(), ".jpg"
+
+    def store_bytes(self, data: bytes) -> str:
+        """
+        Lưu một ảnh vào kho, bỏ qua nếu nội dung đã có
+
+        Returns:
+            str: Tên file media
+        """
+        digest = hashlib.sha256(data).hexdigest()[:32]
+        for suffix in (".jpg", ".img"):
+            if self.path_for(digest + suffix).exists():
+                return digest + suffix
+        thumbnail, suffix = self._thumbnail(data)
+        name = digest + suffix
+        path = self.path_for(name)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f"{name}.{threading.get_ident()}.tmp")
+        tmp.write_bytes(thumbnail)
+        os.replace(tmp, path)
+        return name
+
+    def fetch(self, url: str) -> Optional[str]:
+        """
+        Tải một ảnh về kho
+
+        Returns:
+            str | None: Tên file media, hoặc None nếu tải hoặc xử lý ảnh bị lỗi
+        """
+        name = self._lookup(url)
+        if name is not None:
+            return name
+        try:
+            response = self.client.get(url)
+            response.raise_for_status()
+            name = self.store_bytes(response.content)
+        except Exception as e:
+            logger.warning(f"Could not store image {url}: {e}")
+            return None
+        self._remember(url, name)
+        return name
+
+    def fetch_many(self, urls: Iterable[str]) -> Dict[str, Optional[str]]:
+        """Tải nhiều ảnh song song. Trả về dict URL → tên file media (None nếu lỗi)."""
+        unique_urls = [u for u in dict.fromkeys(urls) if u]
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="media") as executor:
+            return dict(zip(unique_urls, executor.map(self.fetch, unique_urls)))
+
+    def localize(self, records: Iterable) -> None:
+        """
+        Thay `image_url` của từng record (Flashcard, Grammar) bằng tên file media cục bộ
+
+        Record đã trỏ tới file trong kho được giữ nguyên; record tải lỗi giữ URL gốc.
+        """
+        records = list(records)
+        remote = [r.image_url for r in records if r.image_url and "://" in r.image_url]
+        names = self.fetch_many(remote)
+        for record in records:
+            name = names.get(record.image_url) if record.image_url else None
+            if name is not None:
+                record.image_url = name
+
+    def close(self) -> None:
+        self.client.close()
+        with self._lock:
+            self._conn.close()
@@ -1,77 +1,271 @@
-from googleapiclient.discovery import build
+import json
 import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional, Union
+
 from dotenv import load_dotenv
 
+from utils.metrics import metrics
+
 # Load environment variables
 load_dotenv()
 
+# Vị trí mặc định của cache word → URLs
+DEFAULT_CACHE_PATH = Path(__file__).parent.parent / "data" / "cache" / "images.sqlite"
+# Kết quả có ảnh được giữ 30 ngày, kết quả rỗng chỉ giữ 1 ngày
+DEFAULT_TTL_SECONDS = 30 * 24 * 60 * 60
+DEFAULT_NEGATIVE_TTL_SECONDS = 24 * 60 * 60
+
+
 def setup_google_api():
     """
     Thiết lập Google Custom Search API từ biến môi trường
-    
+
     Returns:
         tuple: (service, custom_search_engine_id)
             - service: Đối tượng service của Google API
             - custom_search_engine_id: ID của Custom Search Engine
     """
+    from googleapiclient.discovery import build
+
     api_key = os.getenv('GOOGLE_API_KEY')
     custom_search_engine_id = os.getenv('GOOGLE_SEARCH_ENGINE_ID')
-    
+
     if not api_key or not custom_search_engine_id:
         raise ValueError("GOOGLE_API_KEY và GOOGLE_SEARCH_ENGINE_ID phải được cấu hình trong file .env")
-        
-    service = build("customsearch", "v1", developerKey=api_key)
+
+    service = build("customsearch", "v1", developerKey=api_key, cache_discovery=False)
     return service, custom_search_engine_id
 
 def search_images(service, cx, keyword, num_images=5):
     """
     Tìm kiếm hình ảnh cho một từ khóa sử dụng Google Custom Search API
-    
+
     Args:
         service: Đối tượng service của Google API
         cx (str): ID của Custom Search Engine
         keyword (str): Từ khóa cần tìm kiếm
         num_images (int): Số lượng hình ảnh cần tìm, mặc định là 5
-    
+
     Returns:
         list: Danh sách các URL hình ảnh tìm được
     """
     try:
-        result = service.cse().list(
-            q=keyword,
-            cx=cx,
-            searchType='image',
-            num=num_images
-        ).execute()
-        
-        # Chỉ trả về list các URL hình ảnh
-        return [item.get('link') for item in result.get('items', [])]
+        return _search_images(service, cx, keyword, num_images)
     except Exception as e:
         print(f"Lỗi khi tìm kiếm '{keyword}': {str(e)}")
         return []
 
+def _search_images(service, cx, keyword, num_images=5):
+    # Không bắt lỗi ở đây để lỗi mạng không bị lưu vào cache như một kết quả rỗng
+    result = service.cse().list(
+        q=keyword,
+        cx=cx,
+        searchType='image',
+        num=num_images
+    ).execute()
+
+    # Chỉ trả về list các URL hình ảnh
+    return [item.get('link') for item in result.get('items', [])]
+
+
+class ImageCache:
+    """
+    Cache word → danh sách URL hình ảnh, lưu trong SQLite
+
+    Kết quả rỗng cũng được lưu (negative cache) nhưng với TTL ngắn hơn,
+    để những từ không có ảnh không bị tìm lại ở mỗi lần chạy.
+    """
+
+    def __init__(
+        self,
+        path: Union[str, Path, None] = None,
+        ttl_seconds: int = DEFAULT_TTL_SECONDS,
+        negative_ttl_seconds: int = DEFAULT_NEGATIVE_TTL_SECONDS,
+    ):
+        self.path = Path(path) if path is not None else DEFAULT_CACHE_PATH
+        self.ttl_seconds = ttl_seconds
+        self.negative_ttl_seconds = negative_ttl_seconds
+        self._lock = threading.Lock()
+        if str(self.path) != ":memory:":
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS images ("
+            "word TEXT NOT NULL, num_images INTEGER NOT NULL, urls TEXT NOT NULL, fetched_at REAL NOT NULL, "
+            "PRIMARY KEY (word, num_images))"
+        )
+        self._conn.commit()
+
+    def get(self, word: str, num_images: int) -> Optional[List[str]]:
+        """
+        Lấy danh sách URL đã cache
+
+        Returns:
+            list | None: Danh sách URL (có thể rỗng), hoặc None nếu chưa có hoặc đã hết hạn
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT urls, fetched_at FROM images WHERE word = ? AND num_images = ?", (word, num_images)
+            ).fetchone()
+        if row is None:
+            return None
+        urls = json.loads(row[0])
+        ttl = self.ttl_seconds if urls else self.negative_ttl_seconds
+        if time.time() - row[1] > ttl:
+            return None
+        return urls
+
+    def set(self, word: str, num_images: int, urls: List[str]) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO images (word, num_images, urls, fetched_at) VALUES (?, ?, ?, ?)",
+                (word, num_images, json.dumps(urls, ensure_ascii=False), time.time()),
+            )
+            self._conn.commit()
+
+
+class ImageSearchClient:
+    """
+    Client tìm kiếm hình ảnh dùng lại được cho nhiều từ
+
+    Service của Google API chỉ được tạo một lần cho mỗi thread (đối tượng service
+    không an toàn khi dùng chung giữa các thread), thay vì tạo lại cho mỗi từ.
+    Client giữ một thread pool riêng, dùng lại giữa các lần gọi `search_many`, nên
+    service cũng chỉ được tạo tối đa `max_workers` lần; gọi `close()` để tắt pool.
+
+    Args:
+        service_factory: Hàm trả về (service, cx), mặc định là setup_google_api
+        cache (ImageCache | None): Cache kết quả, None để tắt cache
+        max_workers (int): Số request chạy song song tối đa
+    """
+
+    def __init__(
+        self,
+        service_factory: Callable[[], tuple] = setup_google_api,
+        cache: Optional[ImageCache] = None,
+        max_workers: int = 8,
+    ):
+        self.service_factory = service_factory
+        self.cache = cache
+        self.max_workers = max_workers
+        self._local = threading.local()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._executor_lock = threading.Lock()
+
+    def _service(self):
+        if getattr(self._local, "service", None) is None:
+            self._local.service, self._local.cx = self.service_factory()
+        return self._local.service, self._local.cx
+
+    def search(self, word: str, num_images: int = 5) -> List[str]:
+        """
+        Tìm hình ảnh cho một từ, ưu tiên lấy từ cache
+
+        Lỗi khi gọi API được ném ra và không được lưu vào cache.
+        """
+        if self.cache is not None:
+            cached = self.cache.get(word, num_images)
+            metrics.record_cache("images", hits=int(cached is not None), misses=int(cached is None))
+            if cached is not None:
+                return cached
+        service, cx = self._service()
+        # Chỉ đo thời gian các lần gọi API thật, không tính các lần lấy từ cache
+        with metrics.time("image_search"):
+            urls = _search_images(service, cx, word, num_images)
+        if self.cache is not None:
+            self.cache.set(word, num_images, urls)
+        return urls
+
+    def search_many(self, words: Iterable[str], num_images: int = 5) -> Dict[str, List[str]]:
+        """
+        Tìm hình ảnh song song cho nhiều từ
+
+        Returns:
+            dict: word → danh sách URL, từ bị lỗi có danh sách rỗng
+        """
+        unique_words = list(dict.fromkeys(words))
+
+        def safe_search(word: str) -> List[str]:
+            try:
+                return self.search(word, num_images)
+            except Exception as e:
+                print(f"Lỗi khi xử lý từ '{word}': {str(e)}")
+                return []
+
+        return dict(zip(unique_words, self._pool().map(safe_search, unique_words)))
+
+    def _pool(self) -> ThreadPoolExecutor:
+        # Pool được tạo một lần và giữ lại, để các thread (và service của chúng) không bị tạo lại
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_workers, thread_name_prefix="image-search"
+                )
+            return self._executor
+
+    def close(self) -> None:
+        """
+        Tắt thread pool; client vẫn dùng được, pool mới sẽ được tạo ở lần gọi sau
+        """
+        with self._executor_lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+
+_default_client: Optional[ImageSearchClient] = None
+_default_client_lock = threading.Lock()
+
+
+def get_image_search_client() -> ImageSearchClient:
+    """
+    Lấy client mặc định (có cache trên đĩa), được tạo một lần cho cả process
+    """
+    global _default_client
+    with _default_client_lock:
+        if _default_client is None:
+            _default_client = ImageSearchClient(cache=ImageCache())
+        return _default_client
+
 def get_images_for_word(word, num_images=5):
     """
     Lấy danh sách URL hình ảnh cho một từ
-    
+
     Args:
         word (str): Từ cần tìm hình ảnh
         num_images (int): Số lượng hình ảnh cần tìm, mặc định là 5
-    
+
     Returns:
         list: Danh sách các URL hình ảnh
     """
     try:
-        service, cx = setup_google_api()
-        return search_images(service, cx, word, num_images)
+        return get_image_search_client().search(word, num_images)
     except Exception as e:
         print(f"Lỗi khi xử lý từ '{word}': {str(e)}")
         return []
 
+def get_images_for_words(words, num_images=5):
+    """
+    Lấy danh sách URL hình ảnh cho nhiều từ, tìm song song
+
+    Args:
+        words (list): Danh sách từ cần tìm hình ảnh
+        num_images (int): Số lượng hình ảnh cần tìm cho mỗi từ, mặc định là 5
+
+    Returns:
+        dict: word → danh sách các URL hình ảnh
+    """
+    return get_image_search_client().search_many(words, num_images)
+
 if __name__ == "__main__":
     # Test với một từ
     word = "見ます"
     image_urls = get_images_for_word(word)
     print(f"Các URL hình ảnh cho từ '{word}':")
     for url in image_urls:
-      print(url)
\ No newline at end of file
+      print(url)
@@ -1,23 +1,183 @@
-import pyttsx3
-
-# Khởi tạo engine
-engine = pyttsx3.init()
-
-# Lấy danh sách tất cả các giọng nói
-voices = engine.getProperty('voices')
-
-# # In ra thông tin của từng giọng nói
-# for idx, voice in enumerate(voices):
-#     print(f"Voice #{idx}")
-#     print(f" - ID: {voice.id}")
-#     print(f" - Name: {voice.name}")
-#     print(f" - Languages: {voice.languages}")
-#     print(f" - Gender: {voice.gender}")
-#     print("------------------------")
-
-# Nếu muốn thử một giọng nói cụ thể
-# Thay đổi voice_index tương ứng với giọng tiếng Nhật bạn tìm được
-voice_index = 26  # Thay đổi số này
-engine.setProperty('voice', voices[voice_index].id)
-engine.say("探します、捜します")
-engine.runAndWait()
\ No newline at end of file
+import hashlib
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional, Union
+
+from utils.log import logger
+
+# Thư mục mặc định chứa file âm thanh đã tổng hợp
+DEFAULT_AUDIO_DIR = Path(__file__).parent.parent / "data" / "audio"
+
+
+def _language_codes(voice) -> List[str]:
+    """Chuẩn hoá danh sách ngôn ngữ của một giọng nói (espeak trả về bytes như b'\\x05ja')."""
+    codes = []
+    for language in getattr(voice, "languages", None) or []:
+        if isinstance(language, bytes):
+            language = language.decode("utf-8", errors="ignore")
+        code = "".join(ch for ch in str(language) if ch.isprintable()).strip().lower().replace("-", "_")
+        if code:
+            codes.append(code)
+    return codes
+
+
+def find_voice(voices, language: str):
+    """
+    Tìm giọng nói đầu tiên hỗ trợ ngôn ngữ, ví dụ "ja" hoặc "ja_JP"
+
+    Raises:
+        ValueError: Nếu không có giọng nói nào hỗ trợ ngôn ngữ này
+    """
+    wanted = language.lower().replace("-", "_")
+    for voice in voices:
+        codes = _language_codes(voice)
+        if any(code == wanted or code.startswith(wanted + "_") for code in codes):
+            return voice
+    for voice in voices:
+        # Một số engine không khai báo languages mà chỉ ghi ngôn ngữ trong id
+        if f".{wanted}" in voice.id.lower() or f"/{wanted}" in voice.id.lower():
+            return voice
+    raise ValueError(f"Không tìm thấy giọng nói cho ngôn ngữ '{language}'")
+
+
+class TextToSpeech:
+    """
+    Dịch vụ chuyển văn bản thành giọng nói, dùng lại một engine pyttsx3 cho mọi câu
+
+    File âm thanh được đặt tên theo hash của (text, voice, rate), nên những câu đã
+    tổng hợp trước đó không bao giờ bị tổng hợp lại.
+
+    Args:
+        language (str): Mã ngôn ngữ của giọng nói, ví dụ "ja"
+        rate (int | None): Tốc độ đọc (từ/phút), None để dùng mặc định của engine
+        audio_dir: Thư mục lưu file âm thanh (cache)
+        batch_size (int): Số câu được xếp hàng trước mỗi lần runAndWait
+        audio_format (str): Đuôi file âm thanh
+    """
+
+    def __init__(
+        self,
+        language: str = "ja",
+        rate: Optional[int] = None,
+        audio_dir: Union[str, Path, None] = None,
+        batch_size: int = 50,
+        audio_format: str = "wav",
+        engine_factory: Optional[Callable] = None,
+    ):
+        self.language = language
+        self.rate = rate
+        self.audio_dir = Path(audio_dir) if audio_dir is not None else DEFAULT_AUDIO_DIR
+        self.batch_size = batch_size
+        self.audio_format = audio_format
+        self.engine_factory = engine_factory
+        self._engine = None
+        self._voice_id: Optional[str] = None
+
+    @property
+    def engine(self):
+        """Engine pyttsx3, chỉ được khởi tạo một lần"""
+        if self._engine is None:
+            if self.engine_factory is not None:
+                engine = self.engine_factory()
+            else:
+                import pyttsx3
+
+                engine = pyttsx3.init()
+            self._voice_id = find_voice(engine.getProperty("voices"), self.language).id
+            engine.setProperty("voice", self._voice_id)
+            if self.rate is not None:
+                engine.setProperty("rate", self.rate)
+            self._engine = engine
+        return self._engine
+
+    @property
+    def voice_id(self) -> str:
+        self.engine
+        return self._voice_id  # type: ignore
+
+    def audio_name(self, text: str) -> str:
+        """Tên file âm thanh cho một câu với giọng nói và tốc độ hiện tại"""
+        key = "\x1f".join([text, self.voice_id, str(self.rate)])
+        return f"{hashlib.sha256(key.encode('utf-8')).hexdigest()[:32]}.{self.audio_format}"
+
+    def speak(self, text: str) -> None:
+        self.engine.say(text)
+        self.engine.runAndWait()
+
+    def synthesize_many(self, texts: Iterable[str]) -> Dict[str, str]:
+        """
+        Tổng hợp nhiều câu thành file âm thanh, bỏ qua những câu đã có trong cache
+
+        Returns:
+            dict: text → tên file âm thanh trong audio_dir
+        """
+        self.audio_dir.mkdir(parents=True, exist_ok=True)
+        names = {text: self.audio_name(text) for text in dict.fromkeys(t for t in texts if t and t.strip())}
+        missing = [text for text, name in names.items() if not (self.audio_dir / name).exists()]
+        if len(missing) < len(names):
+            logger.debug(f"{len(names) - len(missing)} of {len(names)} texts already synthesized")
+
+        for start in range(0, len(missing), self.batch_size):
+            batch = missing[start : start + self.batch_size]
+            tmp_paths = []
+            for text in batch:
+                tmp_path = self.audio_dir / f"{names[text]}.tmp.{self.audio_format}"
+                self.engine.save_to_file(text, str(tmp_path))
+                tmp_paths.append((tmp_path, self.audio_dir / names[text]))
+            # Một lần runAndWait xử lý cả batch đã xếp hàng
+            self.engine.runAndWait()
+            for tmp_path, path in tmp_paths:
+                if tmp_path.exists():
+                    os.replace(tmp_path, path)
+                else:
+                    logger.warning(f"Engine did not produce {path.name}")
+        return {text: name for text, name in names.items() if (self.audio_dir / name).exists()}
+
+    def synthesize_parallel(self, texts: Iterable[str], processes: Optional[int] = None) -> Dict[str, str]:
+        """
+        Giống synthesize_many nhưng chia các câu cho nhiều process, mỗi process có engine riêng
+
+        Returns:
+            dict: text → tên file âm thanh trong audio_dir
+        """
+        texts = list(dict.fromkeys(texts))
+        processes = processes or os.cpu_count() or 1
+        if processes <= 1 or len(texts) <= self.batch_size:
+            return self.synthesize_many(texts)
+        shards = [texts[i::processes] for i in range(processes)]
+        config = dict(
+            language=self.language,
+            rate=self.rate,
+            audio_dir=str(self.audio_dir),
+            batch_size=self.batch_size,
+            audio_format=self.audio_format,
+        )
+        results: Dict[str, str] = {}
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            for result in executor.map(_synthesize_shard, [config] * len(shards), shards):
+                results.update(result)
+        return results
+
+
+def _synthesize_shard(config: dict, texts: List[str]) -> Dict[str, str]:
+    return TextToSpeech(**config).synthesize_many(texts)
+
+
+def list_voices() -> None:
+    """In ra thông tin của từng giọng nói"""
+    import pyttsx3
+
+    engine = pyttsx3.init()
+    for idx, voice in enumerate(engine.getProperty("voices")):
+        print(f"Voice #{idx}")
+        print(f" - ID: {voice.id}")
+        print(f" - Name: {voice.name}")
+        print(f" - Languages: {voice.languages}")
+        print(f" - Gender: {voice.gender}")
+        print("------------------------")
+
+
+if __name__ == "__main__":
+    tts = TextToSpeech(language="ja")
+    tts.speak("探します、捜します")
@@ -0,0 +1,308 @@
+import bisect
+import json
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, Iterator, Optional, Sequence, Tuple, Union
+
+# Upper bounds, in seconds, of the latency histogram buckets
+DEFAULT_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+# USD per million prompt and completion tokens, used to estimate the cost of a run
+MODEL_PRICES = {
+    "gpt-4o": (2.50, 10.00),
+    "gpt-4o-mini": (0.15, 0.60),
+    "text-embedding-3-small": (0.02, 0.0),
+    "text-embedding-3-large": (0.13, 0.0),
+}
+
+PREFIX = "anki_agent"
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def _labels(labels: Dict[str, Any]) -> Labels:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def estimate_cost(model: str, prompt_tokens: int, completion_tokens: int) -> float:
+    """Estimated USD cost of a call; 0 for models without a known price."""
+    # Dated snapshots such as gpt-4o-mini-2024-07-18 cost the same as their alias
+    name = max((m for m in MODEL_PRICES if model.startswith(m)), key=len, default=None)
+    if name is None:
+        return 0.0
+    prompt_price, completion_price = MODEL_PRICES[name]
+    return (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1_000_000
+
+
+class Histogram:
+    """Cumulative-bucket latency histogram, as Prometheus expects it."""
+
+    def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.max = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+        self.max = max(self.max, value)
+
+    def quantile(self, q: float) -> float:
+        """Upper bound of the bucket holding the `q` quantile (the maximum for the last bucket)."""
+        if not self.count:
+            return 0.0
+        rank = math.ceil(q * self.count)
+        seen = 0
+        for bound, count in zip(self.buckets + (self.max,), self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def merge(self, other: Dict[str, Any]) -> None:
+        self.counts = [a + b for a, b in zip(self.counts, other["counts"])]
+        self.sum += other["sum"]
+        self.count += other["count"]
+        self.max = max(self.max, other["max"])
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"counts": list(self.counts), "sum": self.sum, "count": self.count, "max": self.max}
+
+
+class MetricsRegistry:
+    """Counters and latency histograms of one process, keyed by name and labels.
+
+    `time` records the latency of a block under `stage_seconds{stage=...}` and counts the
+    blocks that raise in `stage_errors_total`; `inc` adds to a counter. The registry renders
+    itself in the Prometheus text format for the API's `/metrics` endpoint, and as a JSON
+    summary of a run. `snapshot` and `merge`
+    carry the metrics of worker processes back to the process that writes the summary.
+    """
+
+    def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._counters: Dict[Tuple[str, Labels], float] = {}
+        self._histograms: Dict[Tuple[str, Labels], Histogram] = {}
+        self.started_at = time.time()
+
+    def inc(self, name: str, value: float = 1, **labels) -> None:
+        key = (name, _labels(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        key = (name, _labels(labels))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(self.buckets)
+            histogram.observe(value)
+
+    @contextmanager
+    def time(self, stage: str, **labels) -> Iterator[None]:
+        """Record the duration of the block as one call of `stage`, and count it as an error if it raises."""
+        started = time.perf_counter()
+        try:
+            yield
+        except BaseException:
+            self.inc("stage_errors_total", stage=stage, **labels)
+            raise
+        finally:
+            self.observe("stage_seconds", time.perf_counter() - started, stage=stage, **labels)
+
+    def record_llm_usage(self, model: str, prompt_tokens: int, completion_tokens: int) -> None:
+        self.inc("llm_tokens_total", prompt_tokens, model=model, kind="prompt")
+        self.inc("llm_tokens_total", completion_tokens, model=model, kind="completion")
+        self.inc("llm_cost_usd_total", estimate_cost(model, prompt_tokens, completion_tokens), model=model)
+
+    def record_cache(self, cache: str, hits: int, misses: int) -> None:
+        if hits:
+            self.inc("cache_requests_total", hits, cache=cache, result="hit")
+        if misses:
+            self.inc("cache_requests_total", misses, cache=cache, result="miss")
+
+    def reset(self) -> None:
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+            self.started_at = time.time()
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "taken_at": time.time(),
+                "counters": [[name, list(labels), value] for (name, labels), value in self._counters.items()],
+                "histograms": [
+                    [name, list(labels), h.to_dict()] for (name, labels), h in self._histograms.items()
+                ],
+            }
+
+    def merge(self, snapshot: Dict[str, Any]) -> None:
+        """Add the metrics of another registry's `snapshot`, e.g. from a worker process."""
+        with self._lock:
+            for name, labels, value in snapshot["counters"]:
+                key = (name, tuple(tuple(label) for label in labels))
+                self._counters[key] = self._counters.get(key, 0) + value
+            for name, labels, data in snapshot["histograms"]:
+                key = (name, tuple(tuple(label) for label in labels))
+                histogram = self._histograms.get(key)
+                if histogram is None:
+                    histogram = self._histograms[key] = Histogram(self.buckets)
+                histogram.merge(data)
+
+    def since(self, snapshot: Dict[str, Any]) -> "MetricsRegistry":
+        """A new registry holding what was recorded after `snapshot` was taken.
+
+        The registry itself keeps counting (Prometheus expects counters that only grow), so
+        the summary of one run is taken from the difference. Histogram maxima are those of
+        the whole lifetime of the registry.
+        """
+        delta = MetricsRegistry(self.buckets)
+        delta.started_at = snapshot["taken_at"]
+        delta.merge(self.snapshot())
+        delta.merge(
+            {
+                "counters": [[name, labels, -value] for name, labels, value in snapshot["counters"]],
+                "histograms": [
+                    [
+                        name,
+                        labels,
+                        {
+                            **data,
+                            "counts": [-c for c in data["counts"]],
+                            "sum": -data["sum"],
+                            "count": -data["count"],
+                            "max": 0.0,
+                        },
+                    ]
+                    for name, labels, data in snapshot["histograms"]
+                ],
+            }
+        )
+        with delta._lock:
+            delta._counters = {key: value for key, value in delta._counters.items() if value}
+            delta._histograms = {key: h for key, h in delta._histograms.items() if h.count}
+        return delta
+
+    def render_prometheus(self) -> str:
+        """The metrics in the Prometheus text exposition format."""
+
+        def label_text(labels: Labels, extra: Labels = ()) -> str:
+            pairs = [f'{k}="{v}"'.replace("\n", " ") for k, v in labels + extra]
+            return "{" + ",".join(pairs) + "}" if pairs else ""
+
+        lines = []
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted(self._histograms.items(), key=lambda item: item[0])
+            typed = set()
+            for (name, labels), value in counters:
+                if name not in typed:
+                    lines.append(f"# TYPE {PREFIX}_{name} counter")
+                    typed.add(name)
+                lines.append(f"{PREFIX}_{name}{label_text(labels)} {value}")
+            for (name, labels), histogram in histograms:
+                if name not in typed:
+                    lines.append(f"# TYPE {PREFIX}_{name} histogram")
+                    typed.add(name)
+                cumulative = 0
+                for bound, count in zip(histogram.buckets + (math.inf,), histogram.counts):
+                    cumulative += count
+                    le = "+Inf" if bound == math.inf else repr(float(bound))
+                    lines.append(f"{PREFIX}_{name}_bucket{label_text(labels, (('le', le),))} {cumulative}")
+                lines.append(f"{PREFIX}_{name}_sum{label_text(labels)} {histogram.sum}")
+                lines.append(f"{PREFIX}_{name}_count{label_text(labels)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def summary(self) -> Dict[str, Any]:
+        """Per-stage latency, tokens, cost, retries and cache hit rates, with the slowest stage first."""
+        stages: Dict[str, Dict[str, Any]] = {}
+        tokens: Dict[str, Dict[str, int]] = {}
+        cost: Dict[str, float] = {}
+        retries: Dict[str, int] = {}
+        caches: Dict[str, Dict[str, Any]] = {}
+        with self._lock:
+            for (name, labels), histogram in self._histograms.items():
+                if name != "stage_seconds":
+                    continue
+                stage = dict(labels)["stage"]
+                stages[stage] = {
+                    "calls": histogram.count,
+                    "errors": 0,
+                    "seconds_total": round(histogram.sum, 3),
+                    "seconds_mean": round(histogram.sum / histogram.count, 3) if histogram.count else 0.0,
+                    "seconds_p50": histogram.quantile(0.5),
+                    "seconds_p95": histogram.quantile(0.95),
+                    "seconds_max": round(histogram.max, 3),
+                }
+            for (name, labels), value in self._counters.items():
+                label = dict(labels)
+                if name == "stage_errors_total" and label["stage"] in stages:
+                    stages[label["stage"]]["errors"] += int(value)
+                elif name == "llm_tokens_total":
+                    tokens.setdefault(label["model"], {"prompt": 0, "completion": 0})[label["kind"]] += int(
+                        value
+                    )
+                elif name == "llm_cost_usd_total":
+                    cost[label["model"]] = cost.get(label["model"], 0.0) + value
+                elif name == "retries_total":
+                    retries[label["stage"]] = retries.get(label["stage"], 0) + int(value)
+                elif name == "cache_requests_total":
+                    entry = caches.setdefault(label["cache"], {"hits": 0, "misses": 0})
+                    entry["hits" if label["result"] == "hit" else "misses"] += int(value)
+        for entry in caches.values():
+            entry["hit_rate"] = round(entry["hits"] / (entry["hits"] + entry["misses"]), 3)
+        ordered = dict(sorted(stages.items(), key=lambda item: -item[1]["seconds_total"]))
+        return {
+            "wall_seconds": round(time.time() - self.started_at, 3),
+            "hot_stage": next(iter(ordered), None),
+            "stages": ordered,
+            "tokens": tokens,
+            "cost_usd": {**{m: round(c, 6) for m, c in cost.items()}, "total": round(sum(cost.values()), 6)},
+            "retries": retries,
+            "caches": caches,
+        }
+
+    def write_summary(self, path: Union[str, Path], **run: Any) -> Dict[str, Any]:
+        """Write `summary()` as JSON, with `run` (e.g. the deck and its row counts) under "run"."""
+        summary = {
+            "run": run,
+            "finished_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            **self.summary(),
+        }
+        path = Path(path)
+        tmp_path = path.with_name(path.name + ".tmp")
+        tmp_path.write_text(json.dumps(summary, ensure_ascii=False, indent=2), encoding="utf-8")
+        os.replace(tmp_path, path)
+        return summary
+
+
+# Metrics of this process
+metrics = MetricsRegistry()
+
+
+def record_run_usage(model: Optional[str], response: Any) -> None:
+    """Record the token usage of a phidata `RunResponse`, whose metrics hold one count per model message."""
+    run_metrics = getattr(response, "metrics", None)
+    if not model or not run_metrics:
+        return
+
+    def total(*keys: str) -> int:
+        for key in keys:
+            value = run_metrics.get(key)
+            if value:
+                return int(sum(value) if isinstance(value, list) else value)
+        return 0
+
+    metrics.record_llm_usage(
+        model, total("prompt_tokens", "input_tokens"), total("completion_tokens", "output_tokens")
+    )